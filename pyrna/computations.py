@@ -1,12 +1,221 @@
-import os, commands, re, shutil, sys, urllib, subprocess, time, fcntl, urllib, urllib2
+import os, commands, re, shutil, sys, urllib, subprocess, time, fcntl, urllib, urllib2, contextlib, glob, tempfile, collections, threading, datetime, Queue
 from string import maketrans
 from pandas import DataFrame
-import parsers, utils
-from features import RNA, SecondaryStructure, TertiaryStructure
+import parsers, utils, containers
+from features import RNA, SecondaryStructure, TertiaryStructure, BasePairProbabilities
 from parsers import base_pairs_to_secondary_structure, parse_bn, to_fasta, to_pdb
 from distutils.spawn import find_executable
 from pyrna.utils import check_docker_image
-import docker
+
+_image_versions = {}
+
+def cached_result(image = None, state = []):
+    """
+    Decorator caching the results of a Tool method in the ResultCache of the Tool (see Tool.enable_result_cache()). Without cache, the method is run as usual.
+
+    The cache key is computed from the name of the Tool, the name of the method, the version of the Docker image, the attributes of the Tool listed in state and the arguments of the method (the Molecule objects, DataFrames and files are hashed with their content).
+
+    Parameters:
+    -----------
+    - image (default: None): the Docker image running the tool
+    - state (default: []): the names of the Tool attributes the result depends on
+    """
+    def decorator(method):
+        import functools, inspect
+        argument_names, varargs, keywords, defaults = inspect.getargspec(method)
+        defaults = dict(zip(argument_names[-len(defaults):], defaults)) if defaults else {}
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.result_cache:
+                return method(self, *args, **kwargs)
+            arguments = dict(defaults)
+            arguments.update(zip(argument_names[1:], args))
+            arguments.update(kwargs)
+            key = utils.hash_content(self.__class__.__name__, method.__name__, self.rest_server, self.get_image_version(image) if image and not self.rest_server else None, dict((name, getattr(self, name, None)) for name in state), arguments)
+            found, result = self.result_cache.get(key)
+            if not found:
+                result = method(self, *args, **kwargs)
+                self.result_cache.set(key, result)
+            return result
+        return wrapper
+    return decorator
+
+_BRACKET_NOTATION = re.compile(r'^[.()]+$')
+
+_DNA_COMPLEMENT = maketrans('ACGT', 'TGCA')
+_RNA_COMPLEMENT = maketrans('ACGU', 'UGCA')
+
+def _reverse_complement(molecule, start, end):
+    """
+    Returns:
+    --------
+    the reverse complement of the region [start, end] (1-based, inclusive) of a molecule, like molecule.get_complement()[start-1:end][::-1] but without complementing the whole molecule
+    """
+    return molecule.sequence[start-1:end].translate(_RNA_COMPLEMENT if isinstance(molecule, RNA) else _DNA_COMPLEMENT)[::-1]
+
+def _batches(items, batch_size):
+    """
+    Split an iterable into lists of batch_size items.
+    """
+    import itertools
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, batch_size))
+        if not batch:
+            break
+        yield batch
+
+def _iter_records(lines):
+    """
+    Split the concatenated output of a tool run on a multi-FASTA input into records, as soon as each record is complete.
+
+    Parameters:
+    -----------
+    - lines: an iterable of the lines of the output
+
+    Returns:
+    --------
+    a generator of tuples (name of the record without the '>', list of the lines following the header)
+    """
+    name, record = None, None
+    for line in lines:
+        line = line.rstrip('\n')
+        if line.startswith('>') and not line.startswith('>structure'):
+            if record is not None:
+                yield name, record
+            name, record = line[1:].strip().split()[0] if line[1:].strip() else '', []
+        elif record is not None:
+            record.append(line)
+    if record is not None:
+        yield name, record
+
+def _split_records(output):
+    """
+    Split the concatenated output of a tool run on a multi-FASTA file into the lines of each record.
+
+    Returns:
+    --------
+    a dict whose keys are the names of the records (without the '>') and the values the list of lines following the header
+    """
+    return dict(_iter_records(output.split('\n')))
+
+def _in_order(records, size, parse):
+    """
+    Parse the records named with their rank (see the fold_batch() methods) and yield the results in the order of the ranks, as soon as possible. A missing record is parsed as an empty list of lines.
+    """
+    pending = {}
+    rank = 0
+    for name, lines in records:
+        pending[name] = lines
+        while str(rank) in pending:
+            yield parse(pending.pop(str(rank)))
+            rank += 1
+    while rank < size:
+        yield parse(pending.pop(str(rank), []))
+        rank += 1
+
+MapResult = collections.namedtuple('MapResult', ['item', 'result', 'error'])
+
+_map_tool = None
+
+def _init_map_worker(tool):
+    global _map_tool
+    _map_tool = tool #the Tool is sent once to each process, not with each item
+
+def _run_map_job(job, tool = None):
+    """
+    Run a Tool method on one item of Tool.map() and capture its error, if any.
+
+    Returns:
+    --------
+    a tuple (result, error)
+    """
+    import traceback, cPickle
+    method, item, args, kwargs = job
+    in_process = tool is None
+    tool = tool or _map_tool
+    try:
+        function = getattr(tool, method) if isinstance(method, basestring) else method
+        result = function(item, *args, **kwargs)
+        if in_process:
+            cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL) #the result has to go back to the parent process: a job failing in the pool itself would never be reported to Tool.map()
+        return result, None
+    except Exception, e:
+        e.traceback = traceback.format_exc()
+        try:
+            cPickle.dumps(e)
+        except Exception: #the error has to go back to the parent process
+            e = Exception("%s: %s\n%s"%(e.__class__.__name__, e, e.traceback))
+        return None, e
+
+_async_calls = threading.local() #the cancel_event of the call run by Tool.call_async() in the current thread
+_async_executor = None
+_async_executor_lock = threading.Lock()
+
+def _get_async_executor():
+    """
+    Returns:
+    --------
+    the ThreadPoolExecutor running the calls of Tool.call_async() (created at the first call)
+    """
+    global _async_executor
+    with _async_executor_lock:
+        if _async_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            from multiprocessing import cpu_count
+            _async_executor = ThreadPoolExecutor(max_workers = 4*cpu_count())
+    return _async_executor
+
+def _run_async_call(function, cancel_event, args, kwargs):
+    if cancel_event.is_set():
+        raise Exception("The call has been cancelled")
+    _async_calls.cancel_event = cancel_event #the commands run by the function are killed once the event is set (see Tool.stream_command())
+    try:
+        return function(*args, **kwargs)
+    finally:
+        _async_calls.cancel_event = None
+
+def _tblout_to_hits(table, metadata, molecules, cm_file, extract_sequences = False):
+    """
+    Convert the table produced by parsers.parse_tblout() into the hits returned by Cmsearch.search() and Cmscan.search(). The table has to describe the hits as cmsearch does (the targets are the molecules and the queries the models).
+
+    Parameters:
+    -----------
+    - table, metadata: the tuple returned by parsers.parse_tblout()
+    - molecules: the molecules used to do the search
+    - cm_file: the path of the CM file
+    - extract_sequences (default: False): if True, the sequences of the hits are extracted from the molecules
+
+    Returns:
+    --------
+    a pandas DataFrame (see Cmsearch.search())
+    """
+    molecules_by_name = dict((molecule.name, molecule) for molecule in molecules)
+    plus_strand = table['strand'] == '+'
+    starts = table['seq_from'].where(plus_strand, table['seq_to'])
+    ends = table['seq_to'].where(plus_strand, table['seq_from'])
+    hits = DataFrame({
+        'e_value': table['e_value'],
+        'score': table['score'],
+        'target_strand': table['strand'],
+        'target_name': table['target_name'],
+        'target_positions': [[(start, end)] for start, end in zip(starts, ends)],
+        'query_positions': [[(start, end)] for start, end in zip(table['mdl_from'], table['mdl_to'])],
+        'cm_file': cm_file,
+        'RFAM_family': table['query_name'],
+        'RFAM_accession': table['query_accession'],
+        'truncated': table['trunc'],
+        'included': table['inc'],
+        'gc': table['gc'],
+        'bias': table['bias'],
+        'source': "INFERNAL %s"%metadata.get('Version', ''),
+        'organism': [getattr(molecules_by_name.get(name), 'organism', None) for name in table['target_name']]
+    }, columns = ['e_value', 'score', 'target_strand', 'target_name', 'target_positions', 'query_positions', 'cm_file', 'RFAM_family', 'RFAM_accession', 'truncated', 'included', 'gc', 'bias', 'source', 'organism'])
+    if extract_sequences:
+        hits['sequence'] = [molecules_by_name[name].sequence[start-1:end] if strand == '+' else _reverse_complement(molecules_by_name[name], start, end) for name, strand, start, end in zip(table['target_name'], table['strand'], starts, ends)]
+    hits.index = ["%s_candidate_%i"%(family, rank+1) for family, rank in zip(table['query_name'], table.groupby('query_name').cumcount())]
+    return hits
 
 def get_api_key(rest_server):
     response = urllib.urlopen("http://%s/api/get_key"%rest_server)
@@ -21,8 +230,348 @@ class Tool:
         self.rest_server = rest_server
         self.api_key = api_key
         self.use_docker = use_docker
-        if self.use_docker:
-            self.docker_client = docker.from_env()
+        self.result_cache = None
+        self.container_pool = None
+        self.target_store = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['container_pool'] = None #a pool belongs to its process
+        return state
+
+    def map(self, method, inputs, workers = None, ordered = True, processes = False, progress = None, max_in_flight = None, args = (), kwargs = {}):
+        """
+        Run a method of this Tool on each input with a pool of workers. Each input is given as the first argument of the method (the other arguments are shared by all the inputs).
+
+        for map_result in Snoreport().map('search', windows, workers = 8, kwargs = {'reverse_complement': True}):
+            if map_result.error:
+                print map_result.error
+            else:
+                hits = map_result.result
+
+        Parameters:
+        -----------
+        - method: the name of the method (or a function taking an input as first argument)
+        - inputs: an iterable of inputs
+        - workers (default: None): the number of workers. If None, one worker per CPU. If 1, the inputs are processed in the current thread.
+        - ordered (default: True): if True, the results are generated in the order of the inputs. Otherwise, they are generated as soon as they are available.
+        - processes (default: False): if True, the workers are processes (for the methods doing a lot of work in Python). Otherwise, they are threads (enough for the methods waiting for an external program). With processes, the Tool, the inputs and the results have to be picklable.
+        - progress (default: None): a function called after each input with the number of inputs done and the total number of inputs (None if the inputs have no length)
+        - max_in_flight (default: None): the maximal number of inputs submitted and not yet consumed. If None, twice the number of workers. The inputs are read as the results are consumed.
+        - args (default: ()): the other positional arguments of the method
+        - kwargs (default: {}): the keyword arguments of the method
+
+        Returns:
+        --------
+        a generator of MapResult tuples (item, result, error). The error is None if the method succeeded. Otherwise, the result is None and the error is the exception raised (with the attribute traceback).
+        """
+        from multiprocessing import cpu_count
+        from multiprocessing.pool import Pool, ThreadPool
+
+        total = len(inputs) if hasattr(inputs, '__len__') else None
+        workers = workers or cpu_count()
+        done = [0]
+
+        def collect(item, outcome):
+            done[0] += 1
+            if progress:
+                progress(done[0], total)
+            return MapResult(item, outcome[0], outcome[1])
+
+        if workers == 1:
+            for item in inputs:
+                yield collect(item, _run_map_job((method, item, args, kwargs), tool = self))
+            return
+
+        pending = collections.OrderedDict() #the jobs submitted and not yet consumed (number -> (item, AsyncResult))
+        finished = Queue.Queue() #the numbers of the jobs done, pushed by the pool (unordered results)
+
+        def submit(number, item):
+            callback = None if ordered else lambda outcome: finished.put(number)
+            if processes:
+                return pool.apply_async(_run_map_job, ((method, item, args, kwargs),), callback = callback)
+            return pool.apply_async(_run_map_job, ((method, item, args, kwargs), self), callback = callback)
+
+        def next_done():
+            return pending.popitem(last = False)[1] if ordered else pending.pop(finished.get())
+
+        if processes:
+            pool = Pool(processes = workers, initializer = _init_map_worker, initargs = (self,))
+        else:
+            pool = ThreadPool(processes = workers)
+        max_in_flight = max_in_flight or 2*workers
+        try:
+            for number, item in enumerate(inputs):
+                pending[number] = (item, submit(number, item))
+                if len(pending) >= max_in_flight:
+                    item, async_result = next_done()
+                    yield collect(item, async_result.get())
+            while pending:
+                item, async_result = next_done()
+                yield collect(item, async_result.get())
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def call_async(self, method, *args, **kwargs):
+        """
+        Run a method of this Tool without blocking the Tornado IOLoop. The method is run in a thread of a shared executor and the commands it runs are killed if the call times out or is cancelled.
+
+        @gen.coroutine
+        def post(self):
+            cancel_event = threading.Event()
+            rna = yield Rnafold().call_async('fold', molecule, timeout = 60, cancel_event = cancel_event)
+
+        Parameters:
+        -----------
+        - method: the name of the method (or a function)
+        - args: the positional arguments of the method
+        - kwargs: the keyword arguments of the method, plus:
+            - timeout (default: None): the maximal duration of the call (in seconds). If None, no limit.
+            - cancel_event (default: None): a threading.Event that the caller can set to cancel the call
+
+        Returns:
+        --------
+        a Tornado Future resolved with the result of the method. If the call times out or is cancelled, the Future raises an Exception.
+        """
+        from tornado import gen
+        timeout = kwargs.pop('timeout', None)
+        cancel_event = kwargs.pop('cancel_event', None) or threading.Event()
+        function = getattr(self, method) if isinstance(method, basestring) else method
+        future = _get_async_executor().submit(_run_async_call, function, cancel_event, args, kwargs)
+
+        @gen.coroutine
+        def wait():
+            try:
+                if timeout:
+                    result = yield gen.with_timeout(datetime.timedelta(seconds = timeout), future)
+                else:
+                    result = yield future
+            except gen.TimeoutError:
+                cancel_event.set()
+                raise Exception("The call to %s timed out after %s seconds"%(getattr(function, '__name__', method), timeout))
+            except:
+                cancel_event.set()
+                raise
+            raise gen.Return(result)
+
+        return wait()
+
+    def __getattr__(self, name):
+        if name == 'docker_client' and self.__dict__.get('use_docker'): #the client is created at the first use and shared by all the tools
+            return containers.get_docker_client()
+        raise AttributeError(name)
+
+    def enable_container_pool(self, container_pool = None):
+        """
+        Run the commands of this Tool in the warm containers of a ContainerPool (see pyrna.containers) instead of starting a new container for each command.
+
+        Parameters:
+        -----------
+        - container_pool (default: None): a ContainerPool object. If None, the pool shared by all the tools is used.
+
+        Returns:
+        --------
+        the ContainerPool object
+        """
+        self.container_pool = container_pool or containers.get_container_pool()
+        return self.container_pool
+
+    def run_command(self, image, command, input = None, data_dir = None, workdir = None):
+        """
+        Run a command (with bash) in a container of a Docker image. The directory data_dir is mounted as /data in the container.
+
+        Parameters:
+        -----------
+        - image: the name of the Docker image. If None, the command is run on the host.
+        - command: the command
+        - input (default: None): the data to send on the stdin of the command, as a String or an iterable of Strings
+        - data_dir (default: None): the directory mounted as /data. If None, the cache_dir is mounted. The containers of the ContainerPool are shared by the calls mounting the same directory, so a directory private to a call (like a workspace()) should be reached with workdir instead.
+        - workdir (default: None): the working directory of the command in the container
+
+        Returns:
+        --------
+        the output of the command (stdout and stderr)
+        """
+        if self.container_pool and image and input is None and not getattr(_async_calls, 'cancel_event', None):
+            output = self.container_pool.run(image, command, volumes = {data_dir or self.cache_dir: '/data'}, workdir = workdir)
+        else:
+            output = ''.join(self.stream_command(image, command, input = input, data_dir = data_dir, workdir = workdir))
+        return output[:-1] if output.endswith('\n') else output
+
+    def stream_command(self, image, command, input = None, data_dir = None, workdir = None, check = False):
+        """
+        Like run_command() but the output is yielded line by line as soon as it is produced, to be parsed incrementally. If check is True, an Exception is raised at the end of the output if the command failed (non-zero exit status).
+
+        Returns:
+        --------
+        a generator of the lines of the output (stdout and stderr)
+        """
+        cancel_event = getattr(_async_calls, 'cancel_event', None)
+        if image and self.container_pool:
+            return self.container_pool.stream(image, command, input = input, volumes = {data_dir or self.cache_dir: '/data'}, workdir = workdir, cancel_event = cancel_event, check = check)
+        args, cwd, kill = self.__command_args(image, command, data_dir, workdir)
+        return containers.stream_process(args, input = input, cwd = cwd, cancel_event = cancel_event, check = check, kill = kill)
+
+    def __command_args(self, image, command, data_dir, workdir):
+        """
+        Returns:
+        --------
+        a tuple (arguments, working directory, kill function) to run a command in a new container (or on the host if image is None). The kill function kills the container (killing the docker client does not stop it) or, on the host, the process group of the command (killing bash does not stop its children).
+        """
+        if not image:
+            pid_file = "/tmp/pyrna_%s.pid"%utils.generate_random_name(10)
+            return ['bash', '-c', containers.killable_command(command, pid_file)], workdir, lambda: containers.kill_host_command(pid_file)
+        name = "pyrna_%s"%utils.generate_random_name(10)
+        return ['docker', 'run', '-i', '--rm', '--name', name, '-v', "%s:/data"%(data_dir or self.cache_dir)]+(['-w', workdir] if workdir else [])+[image, 'bash', '-c', command], None, lambda: containers.docker_kill(name)
+
+    def run_command_async(self, image, command, input = None, data_dir = None, workdir = None, timeout = None, cancel_event = None):
+        """
+        Like run_command() but returns a Tornado Future and does not block the IOLoop (the output is read with non-blocking pipes). The command is always run in a new container (the ContainerPool is not used).
+
+        Parameters:
+        -----------
+        - image: the name of the Docker image. If None, the command is run on the host.
+        - command: the command
+        - input (default: None): the data to send on the stdin of the command, as a String
+        - data_dir (default: None): the directory mounted as /data. If None, the cache_dir is mounted.
+        - workdir (default: None): the working directory of the command in the container
+        - timeout (default: None): the maximal duration of the command (in seconds). If None, no limit.
+        - cancel_event (default: None): a threading.Event that the caller can set to kill the command
+
+        Returns:
+        --------
+        a Tornado Future resolved with the output of the command (stdout and stderr). If the command times out or is cancelled, it is killed and the Future raises an Exception.
+        """
+        from tornado import gen
+        from tornado.iostream import StreamClosedError
+        from tornado.process import Subprocess
+
+        args, cwd, kill = self.__command_args(image, command, data_dir, workdir)
+
+        @gen.coroutine
+        def run():
+            process = Subprocess(args, stdin = Subprocess.STREAM if input is not None else open(os.devnull), stdout = Subprocess.STREAM, stderr = subprocess.STDOUT, cwd = cwd)
+            try:
+                reading = process.stdout.read_until_close() #started before the input is written, so that a large output cannot block the command
+                if input is not None:
+                    try:
+                        yield process.stdin.write(input)
+                    except StreamClosedError: #the command stopped reading its input
+                        pass
+                    process.stdin.close()
+                deadline = time.time()+timeout if timeout else None
+                while True:
+                    try:
+                        output = yield gen.with_timeout(datetime.timedelta(seconds = 0.1), reading, quiet_exceptions = StreamClosedError)
+                        break
+                    except gen.TimeoutError:
+                        if cancel_event is not None and cancel_event.is_set():
+                            raise Exception("The command has been cancelled")
+                        if deadline and time.time() > deadline:
+                            raise Exception("The command timed out after %s seconds"%timeout)
+                yield process.wait_for_exit(raise_error = False)
+            finally:
+                if process.proc.poll() is None:
+                    if kill:
+                        kill()
+                    process.proc.kill()
+                    yield process.wait_for_exit(raise_error = False)
+            raise gen.Return(output[:-1] if output.endswith('\n') else output)
+
+        return run()
+
+    @contextlib.contextmanager
+    def scratch_file(self, suffix = ''):
+        """
+        A context manager providing the path of a new file in the cache_dir, for the programs that cannot read their input on stdin. All the files sharing the random prefix of this path (like the result files derived from it) are removed at the exit.
+
+        Parameters:
+        -----------
+        - suffix (default: ''): the suffix of the file name (like '.fasta')
+        """
+        prefix = os.path.join(self.cache_dir, utils.generate_random_name(7))
+        try:
+            yield prefix+suffix
+        finally:
+            for path in glob.glob(prefix+'*'):
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors = True)
+                else:
+                    os.remove(path)
+
+    @contextlib.contextmanager
+    def workspace(self):
+        """
+        A context manager providing a new directory in the cache_dir, private to a single call and removed at the exit. A tool run in this directory cannot read or overwrite the files of another call, so that several calls can run at the same time. In a container, the cache_dir is mounted as /data and the workspace is reached with workdir = "/data/%s"%os.path.basename(workspace): mounting the workspace itself (with data_dir) would start a new container of the ContainerPool for each call.
+        """
+        path = self.new_output_dir()
+        try:
+            yield path
+        finally:
+            shutil.rmtree(path, ignore_errors = True)
+
+    @contextlib.contextmanager
+    def target_file(self, molecules):
+        """
+        A context manager providing the molecules as a FASTA file, written once for all in the IndexStore cache_dir/targets (see pyrna.utils): the file is found from the hash of the names and sequences of the molecules, so that all the searches against the same molecules (like a genome searched with several models) share it. The file cannot be evicted until the exit. The least recently used files are removed once the store exceeds 10GB.
+
+        Parameters:
+        -----------
+        - molecules: the molecules (like the genomic sequences of a genome)
+        """
+        def build(target_dir):
+            with open(os.path.join(target_dir, 'targets.fasta'), 'w') as f:
+                parsers.write_fasta(molecules, f)
+
+        if self.target_store is None:
+            self.target_store = utils.IndexStore(self.cache_dir, 'targets', max_disk_size = 10*1024*1024*1024)
+        with self.target_store.use(utils.hash_content([(molecule.name, molecule.sequence) for molecule in molecules]), build) as target_dir:
+            yield os.path.join(target_dir, 'targets.fasta')
+
+    def new_output_dir(self):
+        """
+        Create a new directory in the cache_dir, for the result files of a call that are returned to the caller (and so not removed).
+
+        Returns:
+        --------
+        the full path of the directory
+        """
+        return tempfile.mkdtemp(prefix = "%s_"%self.__class__.__name__.lower(), dir = self.cache_dir)
+
+    def enable_result_cache(self, result_cache = None, max_entries = 256, max_disk_size = 1024*1024*1024):
+        """
+        Cache the results of the methods decorated with cached_result(). The results are kept in memory and on disk, in the directory cache_dir/results.
+
+        Parameters:
+        -----------
+        - result_cache (default: None): a ResultCache object (see pyrna.utils) to share between several Tools. If None, a new one is created in the cache_dir.
+        - max_entries (default: 256): the number of results kept in memory
+        - max_disk_size (default: 1GB): the maximal size of the results stored on disk (in bytes)
+
+        Returns:
+        --------
+        the ResultCache object
+        """
+        self.result_cache = result_cache or utils.ResultCache(self.cache_dir, max_entries = max_entries, max_disk_size = max_disk_size)
+        return self.result_cache
+
+    def get_image_version(self, image):
+        """
+        Returns:
+        --------
+        the id of the local Docker image (or the image name if the Docker daemon cannot tell it)
+        """
+        if not image in _image_versions:
+            try:
+                client = containers.get_docker_client()
+                _image_versions[image] = client.images.get(image).id
+            except Exception:
+                _image_versions[image] = image
+        return _image_versions[image]
 
     def find_executable(self, executable):
         if not find_executable(executable):
@@ -54,10 +603,13 @@ class Tool:
         else:
             print "Error: your URI should not end with the character '/'"
             sys.exit(1)
+        tmp_file_name = "%s.%s"%(file_name, utils.generate_random_name(7)) #the file is renamed once complete, a concurrent call never reads a partial file
         if uri.startswith("https://") or uri.startswith("http://"):
-            urllib.urlretrieve(uri, file_name)
+            urllib.urlretrieve(uri, tmp_file_name)
+            os.rename(tmp_file_name, file_name)
         elif uri.startswith("file://"):
-            shutil.copy(uri.split('file://')[1], self.cache_dir)
+            shutil.copy(uri.split('file://')[1], tmp_file_name)
+            os.rename(tmp_file_name, file_name)
         else:
             print "Error: your URI must start with 'file://', 'http://' or 'https://'" #if the given path start with /Users/, URI must start with file:///Users/
             sys.exit(1)
@@ -84,7 +636,7 @@ class Augustus(Tool):
 
         fileName = self.cache_dir+'/'+utils.generate_random_name(7)+'.fasta'
         f = open(fileName, 'w')
-        f.write(parsers.to_fasta(molecules))
+        parsers.write_fasta(molecules, f)
         f.close()
 
         data = commands.getoutput('cd %s ; augustus --species=%s %s'%(self.cache_dir, species, fileName))
@@ -175,7 +727,7 @@ class Bcheck(Tool):
         fileName = self.cache_dir+'/'+utils.generate_random_name(7)+'.fasta'
 
         with open(fileName, 'w') as f:
-            f.write(parsers.to_fasta(target_molecules))
+            parsers.write_fasta(target_molecules, f)
 
         hits = []
         output = commands.getoutput("Bcheck -f %s"%fileName)
@@ -205,32 +757,48 @@ class Bcheck(Tool):
 
         return DataFrame(hits)
 
+_BLAST_COLUMNS = ['qseqid', 'sseqid', 'pident', 'length', 'mismatch', 'gapopen', 'qstart', 'qend', 'sstart', 'send', 'evalue', 'bitscore']
+
 class Blast(Tool):
-    def __init__(self, target_molecules, cache_dir = "/tmp", rest_server = None, api_key = None):
+    def __init__(self, target_molecules, cache_dir = "/tmp", rest_server = None, api_key = None, db_store = None):
         """"
         Parameters:
         ---------
         - target_molecules:  the target molecules that will be used to make the blast database and to do the search (as a list of Molecule objects, see pyrna.features)
+        - db_store (default: None): the IndexStore object (see pyrna.utils) keeping the Blast databases. If None, the databases are kept in cache_dir/blast_dbs, up to 10GB.
         """
         Tool.__init__(self, cache_dir = cache_dir, rest_server = rest_server, api_key = api_key)
         if not self.rest_server:
             self.find_executable("makeblastdb")
             self.find_executable("legacy_blast.pl")
         self.target_molecules = target_molecules
+        self.db_store = db_store or utils.IndexStore(self.cache_dir, 'blast_dbs', max_disk_size = 10*1024*1024*1024)
 
     def format_db(self, is_nucleotide=True):
         """
-        Dump the target_molecules into a fasta file and format them into a Blast database.
+        Dump the target_molecules into a fasta file and format them into a Blast database. The database is reused if the same molecules have already been formatted (by any call or process sharing the db_store). Its path is recorded in the attribute formatted_db. blastn() looks the database up again, to protect it from the eviction during the search.
 
         Parameters:
         ---------
         is_nucleotide (default: True): state if the target molecules are nucleotides or proteins
         """
-        with open("%s/input.fasta"%self.cache_dir, 'w+b') as fasta_file:
-            fasta_file.write(parsers.to_fasta(self.target_molecules))
+        with self.db_store.use(*self.__database("nucl" if is_nucleotide else "prot")) as db_dir:
+            self.formatted_db = os.path.join(db_dir, "input.fasta")
 
-        commands.getoutput("cd %s ; makeblastdb -in %s -dbtype %s"%(self.cache_dir, fasta_file.name, "nucl" if is_nucleotide else "prot"))
-        self.formatted_db = fasta_file.name
+    def __database(self, dbtype):
+        """
+        Returns:
+        --------
+        a tuple (key, build function) describing the Blast database of the target_molecules in the db_store (see pyrna.utils.IndexStore)
+        """
+        def build(db_dir):
+            with open("%s/input.fasta"%db_dir, 'w+b') as fasta_file:
+                parsers.write_fasta(self.target_molecules, fasta_file)
+            output = self.run_command(None, "makeblastdb -in input.fasta -dbtype %s"%dbtype, workdir = db_dir) #relative paths, the directory is renamed once built
+            if not glob.glob("%s/input.fasta.*"%db_dir):
+                raise Exception("Cannot format the Blast database: %s"%output)
+
+        return utils.hash_content(dbtype, [(molecule.name, molecule.sequence) for molecule in self.target_molecules]), build
 
     def parse_output(self, output):
         """
@@ -346,18 +914,22 @@ class Blast(Tool):
                     break
         return DataFrame(hits)
 
-    def blastn(self, query_molecule):
+    @cached_result(state = ['target_molecules'])
+    def blastn(self, query_molecules, e_value = None):
         """
-        Blast a query against the formated target molecules
+        Blast one or several queries against the formated target molecules. All the queries are searched with a single blastn run, whose tabular output (-outfmt 7) is read at once. The database is taken from the db_store (and formatted if needed), and cannot be evicted during the search.
 
         Parameters:
         -----------
-        - query_molecule: a Molecule object (see pyrna.features).
+        - query_molecules: a Molecule object or a list of Molecule objects (see pyrna.features)
+        - e_value (default: None): the maximal e-value of the hits (option -evalue). If None, the default of blastn.
 
         Returns:
         --------
         A pandas DataFrame describing all the blast hits. The index stores hit ids. The columns are:
         - e_value
+        - bitscore
+        - identity (the percentage of identical positions)
         - target_strand ('+' or '-')
         - target_positions
         - target_name
@@ -366,12 +938,73 @@ class Blast(Tool):
         - sequence (the hit primary sequence)
         - source
         - organism
+        - name (the name of the query)
+        """
+        if not isinstance(query_molecules, (list, tuple)):
+            query_molecules = [query_molecules]
+        self.__targets_by_id() #checked before the search: a hit on a duplicated id could not be assigned to its target molecule
+        with self.db_store.use(*self.__database("nucl")) as db_dir, self.workspace() as workdir:
+            output_file = os.path.join(workdir, 'hits.tsv')
+            output = self.run_command(None, "blastn -db %s -query - -outfmt '7 %s' -out %s%s"%(os.path.join(db_dir, "input.fasta"), ' '.join(_BLAST_COLUMNS), output_file, " -evalue %g"%e_value if e_value is not None else ""), input = parsers.to_fasta(query_molecules)+"\n")
+            if not os.path.exists(output_file):
+                raise Exception("No Blast output: %s"%output)
+            return self.parse_table(output_file, query_molecules)
+
+    def parse_table(self, output_file, query_molecules = []):
         """
-        tmp_dir = os.path.dirname(self.formatted_db)
-        with open("%s/query.fasta"%tmp_dir, 'w+b') as query_file:
-            query_file.write(query_molecule.to_fasta())
+        Parse the tabular output of blastn (-outfmt 7 with the columns listed in _BLAST_COLUMNS).
+
+        Parameters:
+        ---------
+        - output_file: the path of the output file
+        - query_molecules (default: []): the query molecules, to report their full names
 
-        return self.parse_output(commands.getoutput("cd %s ; blastn -db %s -query %s"%(self.cache_dir, self.formatted_db, query_file.name)))
+        Returns:
+        --------
+        A pandas DataFrame describing all the blast hits (see blastn())
+        """
+        import pandas
+        with open(output_file) as h:
+            program = h.readline()[1:].strip() #like '# BLASTN 2.2.31+'
+        table = pandas.read_csv(output_file, sep = '\t', comment = '#', header = None, names = _BLAST_COLUMNS, dtype = {'qseqid': str, 'sseqid': str})
+        targets = self.__targets_by_id()
+        unknown_ids = set(table['sseqid'])-set(targets)
+        if unknown_ids:
+            raise Exception("Unknown subject id(s) in the Blast output: %s"%', '.join(sorted(unknown_ids)))
+        queries = dict((molecule.name.split()[0], molecule.name) for molecule in query_molecules)
+        plus_strand = table['sstart'] <= table['send']
+        starts = table['sstart'].where(plus_strand, table['send'])
+        ends = table['send'].where(plus_strand, table['sstart'])
+        strands = plus_strand.map({True: '+', False: '-'})
+        hits = DataFrame({
+            'e_value': table['evalue'],
+            'bitscore': table['bitscore'],
+            'identity': table['pident'],
+            'target_strand': strands,
+            'target_positions': [[(start, end)] for start, end in zip(starts, ends)],
+            'target_name': [targets[name].name for name in table['sseqid']],
+            'query_strand': '+', #the queries are always reported on their plus strand
+            'query_positions': [[(start, end)] for start, end in zip(table['qstart'], table['qend'])],
+            'sequence': [targets[name].sequence[start-1:end] if strand == '+' else _reverse_complement(targets[name], start, end) for name, strand, start, end in zip(table['sseqid'], strands, starts, ends)],
+            'source': "tool:blast:%s"%program.lower(),
+            'organism': [getattr(targets[name], 'organism', None) for name in table['sseqid']],
+            'name': [queries.get(name, name) for name in table['qseqid']]
+        }, columns = ['e_value', 'bitscore', 'identity', 'target_strand', 'target_positions', 'target_name', 'query_strand', 'query_positions', 'sequence', 'source', 'organism', 'name'])
+        return hits
+
+    def __targets_by_id(self):
+        """
+        Returns:
+        --------
+        a dict whose keys are the ids of the target molecules in the Blast database (the first word of their names) and the values the target molecules
+        """
+        targets = {}
+        for molecule in self.target_molecules:
+            target_id = molecule.name.split()[0]
+            if target_id in targets:
+                raise Exception("Several target molecules share the Blast id %s (the first word of their names)"%target_id)
+            targets[target_id] = molecule
+        return targets
 
     def rpsblast(self):
         pass
@@ -397,9 +1030,10 @@ class Blastr(Blast):
         """
         Dump the target_molecules into a fasta file and format them into a Blast database.
         """
-        with open("%s/input.fasta"%self.cache_dir, 'w+b') as fasta_file:
-            fasta_file.write(parsers.to_fasta(self.target_molecules))
-        commands.getoutput("cd %s ; formatdbR.pl -i %s"%(self.cache_dir, fasta_file.name))
+        db_dir = self.new_output_dir()
+        with open("%s/input.fasta"%db_dir, 'w+b') as fasta_file:
+            parsers.write_fasta(self.target_molecules, fasta_file)
+        commands.getoutput("cd %s ; formatdbR.pl -i %s"%(db_dir, fasta_file.name))
         self.formatted_db = fasta_file.name
 
     def blastallr(self, query_molecule):
@@ -414,20 +1048,28 @@ class Blastr(Blast):
         --------
         For now, this method returns the raw output of blastr as a String.
         """
-        tmp_dir = os.path.dirname(self.formatted_db)
-        with open("%s/query.fasta"%tmp_dir, 'w+b') as query_file:
-            query_file.write(query_molecule.to_fasta())
-        return self.parse_output(commands.getoutput("cd %s ; blastallR.pl -p blastr -i %s -d %s"%(self.cache_dir, query_file.name, self.formatted_db)))
+        with self.workspace() as workspace:
+            with open("%s/query.fasta"%workspace, 'w+b') as query_file:
+                query_file.write(query_molecule.to_fasta())
+            return self.parse_output(commands.getoutput("cd %s ; blastallR.pl -p blastr -i %s -d %s"%(workspace, query_file.name, self.formatted_db)))
 
 class Bowtie2(Tool):
     """
     Application Controller for Bowtie2.
     """
-    def __init__(self, cache_dir = "/tmp", index_path = None, rest_server = None, api_key = None):
+    def __init__(self, cache_dir = "/tmp", index_path = None, rest_server = None, api_key = None, index_store = None):
+        """
+        Parameters:
+        -----------
+        - index_path (default: None): the path of an existing index (relative to the cache_dir, plus the prefix of the index files), used by all the alignments. If None, each alignment looks the index of its target molecules up in the index_store (and builds it if needed).
+        - index_store (default: None): the IndexStore object (see pyrna.utils) keeping the indexes. It has to be located in the cache_dir (mounted in the container). If None, the indexes are kept in cache_dir/bowtie2_indexes, up to 10 indexes.
+        """
         Tool.__init__(self, cache_dir = cache_dir, rest_server = rest_server, api_key = api_key)
         if not self.rest_server:
             check_docker_image('fjossinet/rnaseq')
         self.index_path = index_path
+        self.__given_index_path = index_path
+        self.index_store = index_store or utils.IndexStore(self.cache_dir, 'bowtie2_indexes', max_entries = 10)
 
     def parse_sam(self, sam_file, target_molecules):
         """
@@ -462,7 +1104,16 @@ class Bowtie2(Tool):
         print "%i reads found, %i reads aligned..."%(total_reads, total_aligned_reads)
         return DataFrame(reads)
 
-    def align(self, target_molecules, fastq_file, parsing = False, user_defined_options=[]):
+    def reads_to_frame(self, reads):
+        """
+        Returns:
+        --------
+        the reads produced by parsers.iter_sam() as a pandas DataFrame with the columns genomicStart, genomicEnd, genomicStrand and genomeName
+        """
+        columns = ['genomicStart', 'genomicEnd', 'genomicStrand', 'genomeName']
+        return DataFrame([[read[column] for column in columns] for read in reads], columns = columns)
+
+    def align(self, target_molecules, fastq_file, parsing = False, user_defined_options=[], threads = 1, output = 'sam'):
         """
         Align reads against target molecules.
 
@@ -471,70 +1122,140 @@ class Bowtie2(Tool):
         - target_molecules: the genomic sequences to be used for the alignment (an array of Molecule objects, see pyrna.features)
         - fastq_file: the full path for the fastq file containing the reads (as a String). This file HAS TO BE located in the cache_dir defined during the instanciation of Bowtie2
         - no_parsing (default: False): if True, the function returns the full path of the SAM file without parsing it
+        - threads (default: 1): the number of threads used to align the reads (and to build the index if needed)
+        - output (default: 'sam'): what is done with the alignments:
+            - 'sam': they are stored in a SAM file
+            - 'bam': they are sorted with samtools (in the container) while bowtie2 is running and stored in a BAM file. No SAM file is written.
+            - 'reads': they are parsed as soon as bowtie2 produces them (see parsers.iter_sam()). No file is written. The consumer of the reads paces bowtie2: bowtie2 waits when the reads are not consumed.
 
         Returns:
         --------
-        The full path of the SAM file or a pandas DataFrame describing the reads. The columns are:
+        Depends on the output:
+        - 'sam': the name of the SAM file (in the cache_dir) or, if parsing is True, a pandas DataFrame describing the reads
+        - 'bam': the name of the BAM file (in the cache_dir)
+        - 'reads': a generator of the aligned reads (dicts, see parsers.iter_sam()) or, if parsing is True, a pandas DataFrame describing the reads
+
+        The columns of the DataFrame are:
         - genomicStart (an int)
         - genomicEnd (an int)
         - genomicStrand ('+' or '-')
         - genomeName (a String)
 
-        Once done, the full path to the directory containing the index plus the prefix of the index files is recorded in an attribute named index_path:
+        The index is looked up from the target molecules (unless an index_path was given to the constructor) and cannot be evicted from the index_store during the alignment. Once done, the path of the index (relative to the cache_dir, plus the prefix of the index files) is recorded in an attribute named index_path:
         bowtie2 = Bowtie2()
         bowtie2.align(....)
         print bowtie2.index_path
         """
 
-        result_file = os.path.basename(fastq_file)+'.sam'
+        if output == 'reads':
+            reads = self.__iter_reads(target_molecules, fastq_file, user_defined_options, threads)
+            return self.reads_to_frame(reads) if parsing else reads
 
-        if not self.index_path:
-            self.index_path = self.build_index(target_molecules)
+        with self.use_index(target_molecules, threads) as index_path:
+            print "Reads alignment..."
+            command = "bowtie2 -p %i %s -x /data/%s -q \"/data/%s\""%(threads, ' '.join(user_defined_options), index_path, fastq_file)
 
-        elif not os.path.exists(self.index_path+".1.bt2"):
-            self.build_index(target_molecules)
+            if output == 'bam':
+                result_file = os.path.basename(fastq_file)+'.bam'
+                log = self.run_command("fjossinet/rnaseq", "%s | samtools sort -@ %i -o /data/%s -"%(command, threads, result_file))
+                if not os.path.exists(os.path.join(self.cache_dir, result_file)):
+                    raise Exception("Cannot produce the BAM file: %s"%log)
+                print "BAM file %s produced successfully: "%result_file
+                return result_file
 
-        print "Reads alignment..."
-        commands.getoutput("docker run -v %s:/data fjossinet/rnaseq bowtie2 %s -x /data/%s -q \"/data/%s\" -S /data/%s"%(self.cache_dir, ' '.join(user_defined_options), self.index_path, fastq_file, result_file))
-        print "SAM file %s produced successfully: "%result_file
+            result_file = os.path.basename(fastq_file)+'.sam'
+            self.run_command("fjossinet/rnaseq", "%s -S /data/%s"%(command, result_file))
+            print "SAM file %s produced successfully: "%result_file
 
         if not parsing:
             return result_file
 
         return self.parse_sam(self.cache_dir+"/"+result_file, target_molecules)
 
-    def build_index(self, target_molecules):
+    def __iter_reads(self, target_molecules, fastq_file, user_defined_options, threads):
+        """
+        The generator of the reads returned by align() with output = 'reads'. The index is kept in use until the generator stops. The messages of bowtie2 (stderr) are written in a log file, so that they cannot be mixed with the SAM records.
         """
-        Build a new index for the target molecules
+        with self.use_index(target_molecules, threads) as index_path, self.workspace() as workspace:
+            print "Reads alignment..."
+            command = "bowtie2 -p %i %s -x /data/%s -q \"/data/%s\" 2> bowtie2.log"%(threads, ' '.join(user_defined_options), index_path, fastq_file)
+            try:
+                for read in parsers.iter_sam(self.stream_command("fjossinet/rnaseq", command, workdir = "/data/%s"%os.path.basename(workspace), check = True)):
+                    yield read
+            except Exception, e:
+                log = os.path.join(workspace, 'bowtie2.log')
+                raise Exception("Bowtie2 failed (%s): %s"%(e, open(log).read() if os.path.exists(log) else "no log"))
+
+    @contextlib.contextmanager
+    def use_index(self, target_molecules, threads = 1):
+        """
+        A context manager providing the path of the index to be used for the target molecules (relative to the cache_dir, plus the prefix of the index files). The index found in the index_store is built if needed and protected from the eviction until the exit, so that a long alignment (by bowtie2 or by another tool like tophat2) cannot lose it. If an index_path was given to the constructor, this path is provided as is.
+
+        with Bowtie2().use_index(genomes) as index_path:
+            ....
+
+        Parameters:
+        -----------
+        - target_molecules: the genomic sequences to be used for the index (an array of Molecule objects, see pyrna.features)
+        - threads (default: 1): the number of threads used by bowtie2-build
+        """
+        if self.__given_index_path:
+            yield self.__given_index_path
+            return
+        with self.index_store.use(*self.__index(target_molecules, threads)) as index_dir:
+            self.index_path = os.path.join(os.path.relpath(index_dir, self.cache_dir), 'index')
+            yield self.index_path
+
+    def build_index(self, target_molecules, threads = 1):
+        """
+        Get the index for the target molecules from the index_store. The index is built only if no index has been built for the same molecules with the same version of bowtie2 (by any call or process sharing the index_store). Concurrent calls for the same molecules wait for the first one.
 
         Parameters:
         -----------
         - target_molecules: the genomic sequences to be used for the index (an array of Molecule objects, see pyrna.features)
+        - threads (default: 1): the number of threads used by bowtie2-build
 
         Returns:
         --------
-        The full path to the directory containing the index plus the prefix of the index files
-        """
-        print "Build index..."
-        if not self.index_path:
-            random_name = utils.generate_random_name(7)
-            self.index_path = random_name
-            fasta_file_name = random_name+'.fa'
-            fasta_file = open(self.cache_dir+'/'+fasta_file_name, 'w')
-            fasta_file.write(to_fasta(target_molecules))
-            fasta_file.close()
-            commands.getoutput("docker run -v %s:/data fjossinet/rnaseq bowtie2-build /data/%s /data/%s"%(self.cache_dir, fasta_file_name, self.index_path))
-            print "Index files produced successfully: %s"%(self.cache_dir+'/'+self.index_path)
-        else:
-            fasta_file_name = self.index_path+".fa"
-            fasta_file = open(self.cache_dir+'/'+fasta_file_name, 'w')
-            fasta_file.write(to_fasta(target_molecules))
-            fasta_file.close()
-            commands.getoutput("docker run -v %s:/data fjossinet/rnaseq bowtie2-build /data/%s /data/%s"%(self.cache_dir, fasta_file_name, self.index_path))
-            print "Index files produced successfully: %s"%(self.cache_dir+'/'+self.index_path)
-
+        The path of the index relative to the cache_dir (the directory containing the index plus the prefix of the index files). It is also recorded in the attribute index_path.
+        """
+        index_dir = self.index_store.get(*self.__index(target_molecules, threads))
+        self.index_path = os.path.join(os.path.relpath(index_dir, self.cache_dir), 'index')
+        print "Index files available: %s"%(self.cache_dir+'/'+self.index_path)
         return self.index_path
 
+    def __index(self, target_molecules, threads):
+        """
+        Returns:
+        --------
+        a tuple (key, build function) describing the index of the target molecules in the index_store (see pyrna.utils.IndexStore)
+        """
+        def build(index_dir):
+            path = os.path.relpath(index_dir, self.cache_dir)
+            if path.startswith('..'):
+                raise Exception("The index store has to be located in %s"%self.cache_dir)
+            print "Build index..."
+            with open(os.path.join(index_dir, 'genome.fa'), 'w') as fasta_file:
+                parsers.write_fasta(target_molecules, fasta_file)
+            output = self.run_command("fjossinet/rnaseq", "bowtie2-build --threads %i genome.fa index"%threads, workdir = "/data/%s"%path) #the cache_dir stays mounted as /data, so that the containers of the pool are reused
+            if not glob.glob(os.path.join(index_dir, "index.1.bt2*")): #.bt2l for the large indexes
+                raise Exception("Cannot build the Bowtie2 index: %s"%output)
+            os.remove(os.path.join(index_dir, 'genome.fa'))
+
+        return utils.hash_content("bowtie2 %s"%self.get_version(), [(molecule.name, molecule.sequence) for molecule in target_molecules]), build
+
+    def get_version(self):
+        """
+        Returns:
+        --------
+        the version of bowtie2 installed in the Docker image
+        """
+        key = ('bowtie2', self.get_image_version("fjossinet/rnaseq"))
+        if not key in _image_versions:
+            output = self.run_command("fjossinet/rnaseq", "bowtie2-build --version")
+            _image_versions[key] = output.split('\n')[0].split('version')[-1].strip()
+        return _image_versions[key]
+
 
 class Clustalw(Tool):
 
@@ -557,15 +1278,14 @@ class Clustalw(Tool):
         --------
         the clustalw output as a String and an array of aligned molecules
         """
-        fileName = self.cache_dir+'/'+utils.generate_random_name(7)+'.fasta'
-
-        with open(fileName, 'w') as f:
-            f.write(parsers.to_fasta(molecules))
+        with self.scratch_file('.fasta') as fileName: #clustalw2 cannot read stdin, the .aln and .dnd files produced are removed with the input
+            with open(fileName, 'w') as f:
+                parsers.write_fasta(molecules, f)
 
-        commands.getoutput("clustalw2 -infile=%s"%fileName)
+            self.run_command(None, "clustalw2 -infile=%s"%fileName)
 
-        with open(fileName.split('.fasta')[0]+".aln") as output_file:
-            data = output_file.read()
+            with open(fileName.split('.fasta')[0]+".aln") as output_file:
+                data = output_file.read()
 
         return data, self.parse_output(data, molecules)
 
@@ -618,36 +1338,33 @@ class Cmalign(Tool):
         --------
         a tuple like: (list of all the aligned molecules, dict of organism names (keys) and accession numbers/start-end (values), Dataframe of the consensus 2D)
         """
-        with open("%s/input.fasta"%self.cache_dir, 'w') as fasta_file:
-            fasta_file.write(parsers.to_fasta(molecules))
         if not stockholm_content:
             try:
                 stockholm_content = rfam.get_entry(rfam_id, format='stockholm')
             except Exception, e:
                 raise e
-        if rfam_id:
-            stockholm_file = open("%s/%s.stk"%(self.cache_dir,rfam_id), 'w')
-        else:
-            stockholm_file = open("%s/%s.stk"%(self.cache_dir, utils.generate_random_name(7)), 'w')
 
-        stockholm_file.write(stockholm_content)
-        stockholm_file.close()
+        with self.workspace() as workspace:
+            with open("%s/input.fasta"%workspace, 'w') as fasta_file:
+                parsers.write_fasta(molecules, fasta_file)
 
-        output = None
+            with open("%s/%s.stk"%(workspace, rfam_id or "alignment"), 'w') as stockholm_file:
+                stockholm_file.write(stockholm_content)
 
-        cm_file = None
+            output = None
 
-        if cm_content:
-            cm_file = self.cache_dir+'/'+utils.generate_random_name(7)+'.cm'
+            cm_file = None
 
-            with open(cm_file, 'w') as f:
-                f.write(cm_content)
+            if cm_content:
+                cm_file = workspace+'/model.cm'
 
-        if self.local_mode:
-            output = commands.getoutput("cmalign -l --withali %s %s %s"%(stockholm_file.name, cm_file if cm_file else rfam.cache_dir+'/CMs/'+rfam_id+".cm", fasta_file.name))
-        else:
-            output = commands.getoutput("cmalign --withali %s %s %s"%(stockholm_file.name, cm_file if cm_file else rfam.cache_dir+'/CMs/'+rfam_id+".cm", fasta_file.name))
-        #shutil.rmtree(self.cache_dir)
+                with open(cm_file, 'w') as f:
+                    f.write(cm_content)
+
+            if self.local_mode:
+                output = commands.getoutput("cmalign -l --withali %s %s %s"%(stockholm_file.name, cm_file if cm_file else rfam.cache_dir+'/CMs/'+rfam_id+".cm", fasta_file.name))
+            else:
+                output = commands.getoutput("cmalign --withali %s %s %s"%(stockholm_file.name, cm_file if cm_file else rfam.cache_dir+'/CMs/'+rfam_id+".cm", fasta_file.name))
         if rfam_id:
             output = "#=GF AC "+rfam_id+"\n"+output
         return parsers.parse_stockholm(output)
@@ -672,18 +1389,18 @@ class Cmbuild(Tool):
         --------
         the content of a covariance model (as a String)
         """
-        name = utils.generate_random_name(7)
-        stockholm_file = self.cache_dir+'/'+name+'.sto'
-        cm_file = self.cache_dir+'/'+name+'.cm'
+        with self.workspace() as workspace:
+            stockholm_file = workspace+'/alignment.sto'
+            cm_file = workspace+'/model.cm'
 
-        with open(stockholm_file, 'w') as f:
-            f.write(stockholm_content)
+            with open(stockholm_file, 'w') as f:
+                f.write(stockholm_content)
 
-        commands.getoutput("cmbuild %s %s "%(cm_file, stockholm_file))
+            commands.getoutput("cmbuild %s %s "%(cm_file, stockholm_file))
 
-        cm_content = None
-        with open(cm_file) as f:
-            cm_content = f.read()
+            cm_content = None
+            with open(cm_file) as f:
+                cm_content = f.read()
 
         return cm_content
 
@@ -707,16 +1424,16 @@ class Cmcalibrate(Tool):
         --------
         the calibrated content of a covariance model (as a String)
         """
-        name = utils.generate_random_name(7)
-        cm_file = self.cache_dir+'/'+name+'.cm'
+        with self.workspace() as workspace:
+            cm_file = workspace+'/model.cm'
 
-        with open(cm_file, 'w') as f:
-            f.write(cm_content)
+            with open(cm_file, 'w') as f:
+                f.write(cm_content)
 
-        commands.getoutput("cmcalibrate %s"%cm_file)
+            commands.getoutput("cmcalibrate %s"%cm_file)
 
-        with open(cm_file) as f:
-            cm_content = f.read()
+            with open(cm_file) as f:
+                cm_content = f.read()
 
         return cm_content
 
@@ -730,9 +1447,10 @@ class Cmsearch(Tool):
         if not self.rest_server:
             self.find_executable("cmsearch")
 
-    def search(self, molecules, rfam_id = None, rfam = None, cm_content = None,  gathering_threshold = True):
+    @cached_result()
+    def search(self, molecules, rfam_id = None, rfam = None, cm_content = None,  gathering_threshold = True, cm_file = None, extract_sequences = False, cpu = None, Z = None):
         """
-        Launch a search with cmsearch
+        Launch a search with cmsearch. The hits are read from the tabular output of cmsearch (option --tblout).
 
         Parameters:
         -----------
@@ -740,49 +1458,59 @@ class Cmsearch(Tool):
         - rfam_id : to id of the RFAM family
         - rfam: an Rfam object (see pyrna.db)
         - cm_content: the content of a CM file as a String (default is None).
+        - gathering_threshold (default: True): if True, the gathering thresholds of the models are used (option --ga)
+        - cm_file (default: None): the path of a CM file. It can contain several models (like the Rfam.cm file of an Rfam object), all searched during the same pass over the molecules.
+        - extract_sequences (default: False): if True, the column sequence stores the sequence of each hit (extracted from the molecules)
+        - cpu (default: None): the number of threads used by cmsearch (option --cpu). If None, the default of cmsearch.
+        - Z (default: None): the size of the search space in megabases used to compute the E-values (option -Z). If None, cmsearch uses the size of the molecules. Useful to get comparable E-values when a genome is searched in several chunks.
+
+        The molecules are written once in the cache_dir (see Tool.target_file()) and reused by all the searches against the same molecules.
 
         Returns:
         --------
         A pandas DataFrame describing all the cmsearch hits. The index stores hit ids. The column are:
         - e_value
-        - p_value
         - score
         - target_strand ('+' or '-')
-        - sequence (the hit primary sequence)
+        - sequence (the hit primary sequence, only if extract_sequences is True)
         - target_positions
         - target_name
         - query_positions
         - cm_file (corresponds to the query sequence, but its a covariance models for cmsearch)
-        - RFAM_family
+        - RFAM_family (the name of the model)
+        - RFAM_accession (the accession of the model)
+        - truncated (the value of the column trunc of cmsearch, like 'no' or "5'")
+        - included (True if the hit satisfies the inclusion thresholds)
+        - gc
+        - bias
         - source
         - organism
         """
-        if cm_content:
-            fileName = self.cache_dir+'/'+utils.generate_random_name(7)+'.fasta'
-
-            with open(fileName, 'w') as f:
-                f.write(parsers.to_fasta(molecules))
-
-            cmFile = self.cache_dir+'/'+utils.generate_random_name(7)+'.cm'
-
-            with open(cmFile, 'w') as f:
-                f.write(cm_content)
-
-            if not gathering_threshold:
-                return self.parse_output(commands.getoutput("cmsearch "+cmFile+" "+fileName), molecules, False)
-            else:
-                return self.parse_output(commands.getoutput("cmsearch --ga "+cmFile+" "+fileName), molecules, True)
-        else:
-            #write molecules as FASTA
-            fileName = self.cache_dir+'/'+utils.generate_random_name(7)+'.fasta'
-
-            with open(fileName, 'w') as f:
-                f.write(parsers.to_fasta(molecules))
-
-            if not gathering_threshold:
-                return self.parse_output(commands.getoutput("cmsearch "+rfam.cache_dir+"/CMs/"+rfam_id+".cm "+fileName), molecules, False)
-            else:
-                return self.parse_output(commands.getoutput("cmsearch --ga "+rfam.cache_dir+"/CMs/"+rfam_id+".cm "+fileName), molecules, True)
+        with self.workspace() as workdir:
+            if cm_content:
+                cm_file = os.path.join(workdir, 'models.cm')
+                with open(cm_file, 'w') as f:
+                    f.write(cm_content)
+            elif not cm_file:
+                cm_file = os.path.join(rfam.cache_dir, 'CMs', rfam_id+'.cm')
+
+            options = []
+            if gathering_threshold:
+                options.append("--ga")
+            if cpu is not None:
+                options.append("--cpu %i"%cpu)
+            if Z is not None:
+                options.append("-Z %g"%Z)
+
+            tblout_file = os.path.join(workdir, 'hits.tblout')
+            with self.target_file(molecules) as target_file:
+                output = self.run_command(None, "cmsearch --noali -o /dev/null %s --tblout %s %s %s"%(' '.join(options), tblout_file, cm_file, target_file))
+            if not os.path.exists(tblout_file):
+                raise Exception("No Cmsearch output: %s"%output)
+            with open(tblout_file) as h:
+                table, metadata = parsers.parse_tblout(h)
+
+        return _tblout_to_hits(table, metadata, molecules, cm_file, extract_sequences)
 
     def parse_output(self, output, molecules, gathering_threshold = True):
         """
@@ -947,6 +1675,142 @@ class Cmsearch(Tool):
             raise Exception("No Cmsearch output")
         return DataFrame(hits, index)
 
+class Cmscan(Tool):
+    """
+    Application Controller for Cmscan. Where Cmsearch searches the molecules with one model (or a few), Cmscan searches them with a whole library of models (like Rfam.cm) during a single pass.
+    """
+
+    def __init__(self, cache_dir = "/tmp", rest_server = None, api_key = None):
+        Tool.__init__(self, cache_dir = cache_dir, rest_server = rest_server, api_key = api_key)
+        if not self.rest_server:
+            self.find_executable("cmscan")
+
+    def press(self, cm_file):
+        """
+        Index a CM file with cmpress, if not already done. The CM files have to be pressed to be used by cmscan. Concurrent calls for the same file wait for the first one.
+
+        Parameters:
+        -----------
+        - cm_file: the path of the CM file
+
+        Returns:
+        --------
+        the path of the CM file
+        """
+        pressed = lambda: all(os.path.exists(cm_file+extension) for extension in ['.i1m', '.i1i', '.i1f', '.i1p'])
+        if not pressed():
+            with open(cm_file+'.lock', 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    if not pressed():
+                        output = self.run_command(None, "cmpress -F %s"%cm_file)
+                        if not pressed():
+                            raise Exception("Cannot press %s: %s"%(cm_file, output))
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        return cm_file
+
+    @cached_result()
+    def search(self, molecules, cm_file, clanin = None, families = None, gathering_threshold = True, extract_sequences = False, chunk_size = None, overlap = 10000, cpu = None, Z = None):
+        """
+        Launch a search with cmscan, with all the models of a CM file at once. Among the hits overlapping on the same strand, only the best one is kept for each family, or for each clan if clanin is given (the families of a clan compete for the same region, as in the Rfam annotations).
+
+        Parameters:
+        -----------
+        - molecules: the molecules used to do the search
+        - cm_file: the path of the CM file (like the Rfam.cm file of an Rfam object). It is pressed if needed (see press()).
+        - clanin (default: None): the path of a file listing the families of each clan (like the Rfam.clanin file, see pyrna.db.Rfam.get_clanin())
+        - families (default: None): a list of the accessions or names of the families to keep. If None, the hits of all the families are kept. The families are selected after the resolution of the overlaps: a hit beaten by a family of the same clan is removed, even if this family is not kept.
+        - gathering_threshold (default: True): if True, the gathering thresholds of the models are used (option --cut_ga)
+        - extract_sequences (default: False): if True, the column sequence stores the sequence of each hit
+        - chunk_size (default: None): if not None, the molecules longer than chunk_size are scanned as overlapping chunks of chunk_size residues. The positions of the hits are given on the molecules.
+        - overlap (default: 10000): the overlap between two consecutive chunks. It has to be longer than the longest hit expected and shorter than chunk_size.
+        - cpu (default: None): the number of threads used by cmscan (option --cpu). If None, the default of cmscan.
+        - Z (default: None): the size of the search space in megabases (option -Z). If None, the size of the molecules (even if they are scanned as chunks).
+
+        Returns:
+        --------
+        A pandas DataFrame with the columns of the hits of Cmsearch.search() (see Cmsearch.search()) plus the column clan (None for the families without clan).
+        """
+        self.press(cm_file)
+
+        targets = molecules
+        chunks = {}
+        if chunk_size:
+            if overlap >= chunk_size:
+                raise Exception("The overlap (%i) has to be shorter than the chunk size (%i)"%(overlap, chunk_size))
+            targets = []
+            for molecule in molecules:
+                offset = 0
+                while True:
+                    name = "chunk_%i"%len(targets)
+                    chunk = molecule.__class__(sequence = molecule.sequence[offset:offset+chunk_size], name = name)
+                    chunks[name] = (molecule.name, offset)
+                    targets.append(chunk)
+                    if offset+chunk_size >= len(molecule):
+                        break
+                    offset += chunk_size-overlap
+            if Z is None: #the E-values of the chunks are computed as for the whole molecules (both strands)
+                Z = 2.0*sum(len(molecule) for molecule in molecules)/1e6
+
+        options = ["--fmt 2"]
+        if gathering_threshold:
+            options.append("--cut_ga")
+        if clanin:
+            options.append("--clanin %s"%clanin)
+        if cpu is not None:
+            options.append("--cpu %i"%cpu)
+        if Z is not None:
+            options.append("-Z %g"%Z)
+
+        with self.workspace() as workdir:
+            tblout_file = os.path.join(workdir, 'hits.tblout')
+            with self.target_file(targets) as target_file:
+                output = self.run_command(None, "cmscan --noali -o /dev/null %s --tblout %s %s %s"%(' '.join(options), tblout_file, cm_file, target_file))
+            if not os.path.exists(tblout_file):
+                raise Exception("No Cmscan output: %s"%output)
+            with open(tblout_file) as h:
+                table, metadata = parsers.parse_tblout(h, fmt = 2)
+
+        #cmscan describes the molecules as the queries and the models as the targets
+        table = table.rename(columns = {'target_name': 'query_name', 'target_accession': 'query_accession', 'query_name': 'target_name', 'query_accession': 'target_accession'})
+
+        if chunks:
+            names, offsets = zip(*[chunks[name] for name in table['target_name']]) if len(table) else ([], [])
+            table = table.assign(target_name = list(names), seq_from = table['seq_from']+list(offsets), seq_to = table['seq_to']+list(offsets))
+
+        table = self.resolve_overlaps(table)
+
+        if families is not None: #once the overlaps are resolved, so that a family keeps only the hits not beaten by another family of its clan
+            table = table[table['query_accession'].isin(families) | table['query_name'].isin(families)]
+        hits = _tblout_to_hits(table, metadata, molecules, cm_file, extract_sequences)
+        hits['clan'] = [None if clan == '-' else clan for clan in table['clan_name']]
+        return hits
+
+    def resolve_overlaps(self, table):
+        """
+        Remove the hits overlapping a better hit (with a higher score) on the same molecule and the same strand, for the same family or for a family of the same clan.
+
+        Parameters:
+        -----------
+        - table: the table produced by parsers.parse_tblout() with fmt = 2
+
+        Returns:
+        --------
+        the table without the hits removed, sorted by molecule and position
+        """
+        table = table.assign(_start = table[['seq_from', 'seq_to']].min(axis = 1), _end = table[['seq_from', 'seq_to']].max(axis = 1))
+        table = table.assign(_competition = table['clan_name'].where(table['clan_name'] != '-', table['query_name']))
+        kept = []
+        for (target_name, strand, competition), group in table.groupby(['target_name', 'strand', '_competition'], sort = False):
+            regions = []
+            group = group.sort_values('score', ascending = False)
+            for index, start, end in zip(group.index, group['_start'], group['_end']):
+                if not any(start <= other_end and other_start <= end for other_start, other_end in regions):
+                    regions.append((start, end))
+                    kept.append(index)
+        return table.loc[kept].sort_values(['target_name', '_start']).drop(['_start', '_end', '_competition'], axis = 1)
+
 class Contrafold(Tool):
     """
     Application Controller for Contrafold.
@@ -957,6 +1821,7 @@ class Contrafold(Tool):
         if not self.rest_server:
             check_docker_image('fjossinet/assemble2')
 
+    @cached_result()
     def fold(self, molecule, raw_output = False):
         """
         Parameters:
@@ -981,10 +1846,10 @@ class Contrafold(Tool):
             output = str(response.read())
             response.close()
         else:
-            fileName = self.cache_dir+'/'+utils.generate_random_name(7)+'.fasta'
-            with open(fileName, 'w') as fasta_file:
-                fasta_file.write(parsers.to_fasta([molecule]))
-            output = commands.getoutput("cd %s ; contrafold predict %s"%(self.cache_dir, fileName)).strip()
+            with self.scratch_file('.fasta') as fileName: #contrafold cannot read stdin
+                with open(fileName, 'w') as fasta_file:
+                    parsers.write_fasta([molecule], fasta_file)
+                output = self.run_command(None, "contrafold predict %s"%fileName, workdir = self.cache_dir).strip()
         filtered_lines = []
         for line in output.split('\n'):
             if not line.startswith('>structure'):
@@ -996,6 +1861,32 @@ class Contrafold(Tool):
             rnas, base_pairs = parsers.parse_vienna(output)
             return base_pairs[0]
 
+    def fold_batch(self, molecules, batch_size = 1000):
+        """
+        Fold several molecules with a single contrafold process per batch, instead of one process per molecule.
+
+        Parameters:
+        ---------
+        - molecules: an iterable of pyrna.features.Molecule objects (RNA or DNA)
+        - batch_size (default: 1000): the number of molecules folded by each contrafold process
+
+        Returns:
+        -------
+        a generator of the secondary structures (as lists of base-pairs in pandas DataFrames), in the order of the molecules
+        """
+        for batch in _batches(molecules, batch_size):
+            with self.workspace() as batch_dir:
+                file_names = []
+                for i, molecule in enumerate(batch):
+                    file_name = os.path.join(batch_dir, "%i.fasta"%i)
+                    with open(file_name, 'w') as fasta_file:
+                        fasta_file.write(">%i\n%s\n"%(i, molecule.sequence))
+                    file_names.append(file_name)
+                output = commands.getoutput("cd %s ; contrafold predict %s"%(batch_dir, ' '.join(file_names)))
+            records = _split_records(output)
+            for i in xrange(0, len(batch)):
+                yield parsers.parse_bn(''.join(line.strip() for line in records.get(str(i), []) if re.match('^[.()]+$', line.strip())))
+
 class Cufflinks(Tool):
     """
     Application Controller for Cufflinks.
@@ -1062,13 +1953,14 @@ class Cufflinks(Tool):
             for annotation in annotations:
                 data_str += "%s\t.\t%s\t%i\t%i\t0.0\t%s\t.\tid %s\n"%(annotation['genomeName'], annotation['class'], annotation['genomicPositions'][0], annotation['genomicPositions'][1], annotation['genomoicStrand'], annotation['_id'])
 
-        gff_file = utils.generate_random_name(7)+'.gff'
-        fh = open('%s/%s'%(self.cache_dir, gff_file), 'w')
-        fh.write(data_str)
-        fh.close()
+        with self.workspace() as workspace: #cufflinks writes its results in the current directory
+            gff_file = 'annotations.gff'
+            fh = open('%s/%s'%(workspace, gff_file), 'w')
+            fh.write(data_str)
+            fh.close()
 
-        commands.getoutput("cd %s ; cufflinks -g %s %s"%(self.cache_dir, gff_file, bam_file))
-        df = self.__parse_output()
+            commands.getoutput("cd %s ; cufflinks -g %s %s"%(workspace, gff_file, os.path.abspath(bam_file)))
+            df = self.__parse_output(workspace)
         return df
 
     def __mongo_to_gff3(self, db_name, db_host = "localhost", db_port = 27017):
@@ -1193,9 +2085,9 @@ class Cufflinks(Tool):
 
         return data
 
-    def __parse_output(self):
+    def __parse_output(self, output_dir):
         """
-        Method that parses the Cufflinks output file 'isoforms.fpkm_tracking'
+        Method that parses the Cufflinks output file 'isoforms.fpkm_tracking' (in the directory output_dir)
 
         Returns:
         --------
@@ -1207,7 +2099,7 @@ class Cufflinks(Tool):
         - score: FPKM (Fragments Per Kilobase of exon per Million fragments mapped)
         - status: four different gene types are possible: 'expressed' or 'unexpressed' or 'isoform' or 'novel'
         """
-        fh = open("%s/isoforms.fpkm_tracking"%self.cache_dir, 'r')
+        fh = open("%s/isoforms.fpkm_tracking"%output_dir, 'r')
         lines = fh.readlines()
         transcripts = []
         print "Total number of genes in the Cufflinks output (file isoforms.fpkm_tracking): %i"%len(lines[1:])
@@ -1288,7 +2180,7 @@ class Gmorse(Tool):
     def extract_unmapped_reads(self, aligned_reads_file, fastq_file):
         print "extractNonMappedReads %s %s"%(aligned_reads_file, fastq_file)
         output = commands.getoutput("extractNonMappedReads %s %s"%(aligned_reads_file, fastq_file))
-        unmapped_reads_file = self.cache_dir+'/unmapped_reads.fa'
+        unmapped_reads_file = self.new_output_dir()+'/unmapped_reads.fa'
         with open(unmapped_reads_file, 'w') as f:
             f.write (output)
         return unmapped_reads_file
@@ -1296,7 +2188,7 @@ class Gmorse(Tool):
     def calculate_depth_coverage(self, aligned_reads_file):
         print "coverage %s"%(aligned_reads_file)
         output = commands.getoutput("coverage %s"%(aligned_reads_file))
-        depth_coverage_file = self.cache_dir+'/depth_coverage'
+        depth_coverage_file = self.new_output_dir()+'/depth_coverage'
         with open(depth_coverage_file, 'w') as f:
             f.write (output)
         return depth_coverage_file
@@ -1304,23 +2196,24 @@ class Gmorse(Tool):
     def build_covtigs(self, depth_coverage_file, depth_treshold):
         print "build_covtigs %s %i"%(depth_coverage_file, depth_treshold)
         output = commands.getoutput("build_covtigs %s %i"%(depth_coverage_file, depth_treshold))
-        covtigs_file = self.cache_dir+'/covtigs'
+        covtigs_file = self.new_output_dir()+'/covtigs'
         with open(covtigs_file, 'w') as f:
             f.write (output)
         return covtigs_file
 
     def make_model(self, unmapped_reads_file, covtigs_file, target_molecules):
-        scaffolds_file = self.cache_dir+'/scaffolds.fa'
-        output_gene_models = self.cache_dir+'/gene_model'
-        extended_covtigs = self.cache_dir+'/extended_covtigs'
-        validated_junctions = self.cache_dir+'/validated_junctions'
-        with open(scaffolds_file, 'w') as f:
-            f.write (to_fasta(target_molecules))
-        print "gmorse -r %s -c %s -f %s -G %s -C %s -J %s"%(unmapped_reads_file, covtigs_file, scaffolds_file, output_gene_models, extended_covtigs, validated_junctions)
-        commands.getoutput("gmorse -r %s -c %s -f %s -G %s -C %s -J %s"%(unmapped_reads_file, covtigs_file, scaffolds_file, output_gene_models, extended_covtigs, validated_junctions))
-        o = open(output_gene_models)
-        model = o.read()
-        o.close()
+        with self.workspace() as workspace:
+            scaffolds_file = workspace+'/scaffolds.fa'
+            output_gene_models = workspace+'/gene_model'
+            extended_covtigs = workspace+'/extended_covtigs'
+            validated_junctions = workspace+'/validated_junctions'
+            with open(scaffolds_file, 'w') as f:
+                parsers.write_fasta(target_molecules, f)
+            print "gmorse -r %s -c %s -f %s -G %s -C %s -J %s"%(unmapped_reads_file, covtigs_file, scaffolds_file, output_gene_models, extended_covtigs, validated_junctions)
+            commands.getoutput("gmorse -r %s -c %s -f %s -G %s -C %s -J %s"%(unmapped_reads_file, covtigs_file, scaffolds_file, output_gene_models, extended_covtigs, validated_junctions))
+            o = open(output_gene_models)
+            model = o.read()
+            o.close()
         return self.parse_model(model)
 
     def parse_model(self, model):
@@ -1386,11 +2279,11 @@ class Gotohscan(Tool):
         hits = []
         queryFileName = self.cache_dir+'/'+utils.generate_random_name(7)+'.fasta'
         with open(queryFileName, 'w') as query_file:
-            query_file.write(parsers.to_fasta([query_molecule]))
+            parsers.write_fasta([query_molecule], query_file)
 
         targetFileName = self.cache_dir+'/'+utils.generate_random_name(7)+'.fasta'
         with open(targetFileName, 'w') as target_file:
-            target_file.write(parsers.to_fasta(target_molecules))
+            parsers.write_fasta(target_molecules, target_file)
 
         output = commands.getoutput("GotohScan2a -e %e -d %s -q %s"%(evalue, targetFileName, queryFileName))
 
@@ -1434,10 +2327,10 @@ class Mlocarna(Tool):
         --------
         a tuple like (list of aligned molecules, secondary structure computed as a list of base-pairs in a pandas DataFrame)
         """
-        fileName = utils.generate_random_name(7)+'.fasta'
-        with open(self.cache_dir+'/'+fileName, 'w') as fasta_file:
-            fasta_file.write(parsers.to_fasta(molecules))
-        output = commands.getoutput("docker run -v %s:/data fjossinet/assemble2 mlocarna /data/%s"%(self.cache_dir,fileName))
+        with self.workspace() as workspace: #mlocarna writes its results in the directory input.out
+            with open(workspace+'/input.fasta', 'w') as fasta_file:
+                parsers.write_fasta(molecules, fasta_file)
+            output = self.run_command("fjossinet/assemble2", "mlocarna input.fasta", workdir = "/data/%s"%os.path.basename(workspace))
 
         aligned_molecules = {}
         consensus2D = None
@@ -1475,10 +2368,8 @@ class RnaAlifold(Tool):
         --------
         the bracket notation of the MFE structure as a String
         """
-        fileName = utils.generate_random_name(7)+'.aln'
-        with open(self.cache_dir+'/'+fileName, 'w') as aln_file:
-            aln_file.write(alignment)
-        return commands.getoutput("docker run -v %s:/data fjossinet/assemble2 bash -c 'RNAalifold < /data/%s'"%(self.cache_dir, fileName)).strip().split('\n')[-1].split(' ')[0]
+        with self.workspace() as workspace: #RNAalifold writes alirna.ps and aln.ps in the current directory
+            return self.run_command("fjossinet/assemble2", "RNAalifold", input = alignment, workdir = "/data/%s"%os.path.basename(workspace)).strip().split('\n')[-1].split(' ')[0]
 
 class Rnafold(Tool):
 
@@ -1491,7 +2382,8 @@ class Rnafold(Tool):
         if not self.rest_server:
             check_docker_image('fjossinet/assemble2')
 
-    def fold(self, molecule, constraints = None, bp_probabilities = False, raw_output = False):
+    @cached_result(image = 'fjossinet/assemble2')
+    def fold(self, molecule, constraints = None, bp_probabilities = False, raw_output = False, sparse = False, cutoff = 1e-5):
         """
         Parameters:
         -----------
@@ -1499,10 +2391,13 @@ class Rnafold(Tool):
         - constraints: a string defining the constraints. See the RNAfold documentation for the notation to be used.
         - bp_probabilities (default: False): if True, the method returns the base-pair probabilities
         - raw_output (default: False): if True, the method returns the raw output instead of the pandas Dataframe.
+        - sparse (default: False): if True (and bp_probabilities is True), the method returns a pyrna.features.BasePairProbabilities object storing the probability of each base-pair in a sparse matrix
+        - cutoff (default: 1e-5): the base-pairs with a lower probability are ignored (if bp_probabilities is True)
 
         Returns:
         --------
-        - base-pair probabilities in a pandas DataFrame (if parameter bp_probabilities is True)
+        - a BasePairProbabilities object (if parameters bp_probabilities and sparse are True)
+        - base-pair probabilities in a pandas DataFrame (if parameter bp_probabilities is True). The column 'probability' gives the probability of each position to be paired.
         - a secondary structure as a list of base-pairs in a pandas DataFrame (if parameter bp_probabilities is False)
         """
         if self.rest_server:
@@ -1516,36 +2411,31 @@ class Rnafold(Tool):
                 parameters['constraints'] = constraints
             output = self.submit('rnafold', parameters)
         else:
-            fileName = utils.generate_random_name(7)+'.fasta'
-            with open(self.cache_dir+'/'+fileName, 'w') as fasta_file:
-                fasta_file.write(parsers.to_fasta([molecule], single_line=True))
-                if constraints:
-                    fasta_file.write("\n"+constraints)
+            fasta_data = parsers.to_fasta([molecule], single_line=True)+"\n" #streamed on stdin
+            if constraints:
+                fasta_data += constraints+"\n"
 
             if constraints:
-                output = commands.getoutput("docker run -v %s:/data fjossinet/assemble2 bash -c 'RNAfold -C < /data/%s'"%(self.cache_dir, fileName)).strip()
-            elif bp_probabilities:
-                commands.getoutput("docker run -v %s:/data fjossinet/assemble2 bash -c 'RNAfold -p < /data/%s'"%(self.cache_dir, fileName)).strip()
-                with open("%s/%s_dp.ps"%(self.cache_dir, molecule.name), 'r') as ps_file:
-                    output = ps_file.read()
+                output = self.run_command("fjossinet/assemble2", "RNAfold --noPS -C", input = fasta_data).strip()
+            elif bp_probabilities: #the probabilities are only available in the dot plot file
+                with self.workspace() as workspace:
+                    self.run_command("fjossinet/assemble2", "RNAfold -p", input = ">rnafold\n%s\n"%molecule.sequence, workdir = "/data/%s"%os.path.basename(workspace))
+                    with open("%s/rnafold_dp.ps"%workspace, 'r') as ps_file:
+                        output = ps_file.read()
             else:
-                output = commands.getoutput("docker run -v %s:/data fjossinet/assemble2 bash -c 'RNAfold < /data/%s'"%(self.cache_dir, fileName)).strip()
+                output = self.run_command("fjossinet/assemble2", "RNAfold --noPS", input = fasta_data).strip()
         if raw_output:
             return output
         else:
             if bp_probabilities:
-                probabilities = []
-                for i in xrange(0, len(molecule.sequence)):
-                    probabilities.append(0)
-                for line in output.split('\n'):
-                    tokens = line.split(' ')
-                    if len(tokens) == 4 and tokens[-1] == 'ubox':
-                        probabilities[int(tokens[0])-1] = probabilities[int(tokens[0])-1]+float(tokens[2])*float(tokens[2])
-                        probabilities[int(tokens[1])-1] = probabilities[int(tokens[1])-1]+float(tokens[2])*float(tokens[2])
-                result = []
-                for i in xrange(0, len(molecule.sequence)):
-                    result.append({'position':i+1, 'residue': molecule.sequence[i], 'probability': probabilities[i] })
-                return DataFrame(result, columns = ['position', 'residue', 'probability'])
+                probabilities = BasePairProbabilities(molecule, parsers.parse_dot_plot(output, length = len(molecule.sequence), cutoff = cutoff))
+                if sparse:
+                    return probabilities
+                return DataFrame({
+                    'position': range(1, len(molecule.sequence)+1),
+                    'residue': list(molecule.sequence),
+                    'probability': probabilities.paired_probabilities()
+                }, columns = ['position', 'residue', 'probability'])
             else:
                 vienna_data = ""
                 for line in output.split('\n'):
@@ -1556,6 +2446,37 @@ class Rnafold(Tool):
                 rnas, base_pairs = parsers.parse_vienna(vienna_data)
                 return base_pairs[0]
 
+    def fold_batch(self, molecules, constraints = None, batch_size = 1000):
+        """
+        Fold several molecules with a single RNAfold process per batch, instead of one container per molecule.
+
+        Parameters:
+        -----------
+        - molecules: an iterable of pyrna.features.Molecule objects (RNA or DNA)
+        - constraints (default: None): a list of strings defining the constraints for each molecule (in the same order). See the RNAfold documentation for the notation to be used.
+        - batch_size (default: 1000): the number of molecules folded by each RNAfold process
+
+        Returns:
+        --------
+        a generator of the secondary structures (as lists of base-pairs in pandas DataFrames), in the order of the molecules
+        """
+        def parse(lines):
+            for line in lines:
+                if re.match('^[.()]+', line):
+                    return parse_bn(line.split(' ')[0]) #we remove the stability value
+            return parse_bn('')
+
+        constraints = iter(constraints) if constraints is not None else None
+        for batch in _batches(molecules, batch_size):
+            fasta_data = []
+            for i, molecule in enumerate(batch):
+                fasta_data.append(">%i\n%s\n"%(i, molecule.sequence)) #the records are named with their rank, the molecule names can contain spaces or duplicates
+                if constraints is not None:
+                    fasta_data.append(next(constraints)+"\n")
+            output = self.stream_command("fjossinet/assemble2", "RNAfold --noPS %s"%("-C" if constraints is not None else ""), input = fasta_data)
+            for secondary_structure in _in_order(_iter_records(output), len(batch), parse):
+                yield secondary_structure
+
 
 
 class Rnainverse(Tool):
@@ -1584,15 +2505,10 @@ class Rnainverse(Tool):
 
         """
 
-        fileName = utils.generate_random_name(7)+'.bn'
-        with open(self.cache_dir+'/'+fileName, 'w') as input_file:
-            input_file.write(parsers.to_bn(secondary_structure, len(molecule))+'\n')
-            input_file.write('N'*len(molecule))
-
         rnas = []
         i = 0
-        output = commands.getoutput("docker run -v %s:/data fjossinet/assemble2 bash -c 'RNAinverse -R %i < /data/%s'"%(repeats, fileName))
-        for line in output.split('\n'):
+        output = self.stream_command("fjossinet/assemble2", "RNAinverse -R %i"%repeats, input = parsers.to_bn(secondary_structure, len(molecule))+'\n'+'N'*len(molecule)+'\n')
+        for line in output:
             i+=1
             name = "%s_%i"%(molecule.name, i)
             rnas.append(RNA(name = name, sequence = line.split()[0].strip()))
@@ -1633,7 +2549,7 @@ class RNAMotif(Tool):
         flag = False
         fasta_file_name = self.cache_dir+'/'+utils.generate_random_name(7)+'.fasta'
         with open(fasta_file_name, 'w') as fasta_file:
-            fasta_file.write(parsers.to_fasta(target_molecules))
+            parsers.write_fasta(target_molecules, fasta_file)
         descr_file_name = self.download_file(descriptor_file)
         output = commands.getoutput("rnamotif -descr %s %s | rmprune"%(descr_file_name, fasta_file_name))
         hits = []
@@ -1730,47 +2646,50 @@ class Rnaplfold(Tool):
 
         Returns:
         --------
-        a pandas DataFrame reporting the mean probability that regions of length 1 to width are unpaired for a sequence. The index of the Dataframe lists the Molecule positions (from A to molecule's length) and the columns list the length of the region (from 1 to width).
+        a pandas DataFrame reporting the mean probability that regions of length 1 to width are unpaired for a sequence. The index of the Dataframe lists the Molecule positions (from A to molecule's length) and the columns list the length of the region (from 1 to width). The values are float32 (see parsers.parse_plfold()).
         """
 
-        fileName = utils.generate_random_name(7)+'.fasta'
-        with open(self.cache_dir+'/'+fileName, 'w') as fasta_file:
-            fasta_file.write(parsers.to_fasta([molecule], single_line=True))
-
-        if free_energies:
-            commands.getoutput("docker run -v %s:/data fjossinet/assemble2 bash -c 'cd /data/ ;RNAplfold -W %i -L %i -u %i -O < /data/%s'"%(self.cache_dir, winsize, span, width, fileName)).strip()
+        with self.workspace() as workspace: #RNAplfold names its output files after the sequence name
+            fasta_data = ">plfold\n%s\n"%molecule.sequence
+            self.run_command("fjossinet/assemble2", "RNAplfold -W %i -L %i -u %i%s"%(winsize, span, width, " -O" if free_energies else ""), input = fasta_data, workdir = "/data/%s"%os.path.basename(workspace))
+            output_file = '%s/plfold_%s'%(workspace, "openen" if free_energies else "lunp")
+            if raw_output:
+                with open(output_file) as h:
+                    return h.read()
+            return parsers.parse_plfold(output_file)
 
-            h = open('%s/test_openen'%self.cache_dir)
-            output = h.read()
-            h.close()
-        else:
-            commands.getoutput("docker run -v %s:/data fjossinet/assemble2 bash -c 'cd /data/ ; RNAplfold -W %i -L %i -u %i < /data/%s'"%(self.cache_dir, winsize, span, width, fileName)).strip()
+    def scan_genome(self, molecule, winsize, span, width, free_energies = False, chunk_size = 100000, widths = None, workers = None):
+        """
+        Like scan() but for long molecules (like genomic sequences): the molecule is cut into chunks scanned in parallel (see Tool.map()). Each chunk is extended on both sides by winsize+width residues, so that the values computed for the positions of the chunk are the same as if the whole molecule was scanned. The values of the extensions are dropped when the profiles of the chunks are put together.
 
-            with open('%s/test_lunp'%self.cache_dir) as h:
-                output = h.read()
+        Parameters:
+        -----------
+        - molecule: a Molecule object to scan (see pyrna.features)
+        - winsize, span, width, free_energies: see scan()
+        - chunk_size (default: 100000): the number of positions of each chunk (without the extensions)
+        - widths (default: None): the lengths of the regions to keep in the profile (like [width]). If None, the lengths from 1 to width are kept.
+        - workers (default: None): the number of chunks scanned at the same time. If None, one per CPU.
 
+        Returns:
+        --------
+        a pandas DataFrame of float32 values (see scan()) whose index lists all the positions of the molecule and the columns the lengths listed in widths
+        """
         import numpy as np
-
-        if raw_output:
-            return output
-        else:
-            index = []
-            columns = None
-            data = []
-            for line in output.split('\n'):
-                line = line.strip()
-                if len(line) and not line.startswith("#"):
-                    tokens = line.split('\t')
-                    index.append(int(tokens[0]))
-                    row = {}
-                    tokens = tokens[1:]
-                    tokens = [float(x) if x != "NA" else np.nan for x in tokens]
-                    for pos in range(0,len(tokens)):
-                        row[columns[pos]] = tokens[pos]
-                    data.append(row)
-                elif len(line) and line.startswith("#i$"):
-                    columns = [int(x) for x in line.split("l=")[1].split('\t')]
-            return DataFrame(data, index = index, columns = columns)
+        length = len(molecule)
+        margin = winsize+width
+        widths = widths or range(1, width+1)
+        chunks = []
+        for chunk_start in xrange(0, length, chunk_size):
+            start, end = max(0, chunk_start-margin), min(length, chunk_start+chunk_size+margin)
+            chunks.append((chunk_start, min(length, chunk_start+chunk_size), start, molecule.__class__(sequence = molecule.sequence[start:end], name = 'plfold')))
+
+        track = np.full((length, len(widths)), np.nan, dtype = np.float32)
+        for map_result in self.map(lambda chunk: self.scan(chunk[3], winsize, span, width, free_energies = free_energies), chunks, workers = workers, ordered = False):
+            if map_result.error:
+                raise map_result.error
+            chunk_start, chunk_end, start = map_result.item[:3]
+            track[chunk_start:chunk_end] = map_result.result.loc[chunk_start-start+1:chunk_end-start, widths].values #the positions of the profile are numbered from the start of the extended chunk
+        return DataFrame(track, index = np.arange(1, length+1), columns = widths)
 
 class Rnaplot(Tool):
     """
@@ -1808,16 +2727,11 @@ class Rnaplot(Tool):
             response.close()
         else:
             _rna = RNA(name="rna", sequence=rna.sequence) #the name of the rna object should not contains any / character.
-            vienna_file_name = utils.generate_random_name(7)+'.fasta'
-            with open(self.cache_dir+'/'+vienna_file_name, 'w') as f:
-                f.write(parsers.to_vienna([secondary_structure], [_rna], single_line=True))
+            with self.workspace() as workspace: #RNAplot cannot write on stdout
+                self.run_command("fjossinet/assemble2", "RNAplot -o svg", input = parsers.to_vienna([secondary_structure], [_rna], single_line=True)+"\n", workdir = "/data/%s"%os.path.basename(workspace))
 
-            commands.getoutput("docker run -v %s:/data fjossinet/assemble2 bash -c 'cd /data ; RNAplot -o svg < /data/%s'"%(self.cache_dir, vienna_file_name))
-
-            for f in os.listdir(self.cache_dir):
-                if f.endswith('.svg'):
-                    with open("%s/%s"%(self.cache_dir, f)) as svg_file:
-                        output = svg_file.read()
+                with open("%s/%s_ss.svg"%(workspace, _rna.name)) as svg_file:
+                    output = svg_file.read()
 
 
         if raw_output:
@@ -1849,30 +2763,98 @@ class Rnasubopt(Tool):
         if not self.rest_server:
             check_docker_image('fjossinet/assemble2')
 
-    def fold(self, molecule, range = None, random_sample = None):
+    def iter_fold(self, molecule, range = None, random_sample = None, max_structures = None, max_energy = None, sort = False, unique = True):
+        """
+        Compute the suboptimal structures and yield them while RNAsubopt produces them. Each structure is parsed into a pair table (see pyrna.parsers.bn_to_pair_table()), the output is never stored. RNAsubopt is killed as soon as the generator stops (enough structures, energy bound reached or generator closed).
+
+        Parameters:
+        ---------
+        - molecule: a Molecule object (see pyrna.features)
+        - range (default: None): calculate suboptimal structures within range kcal/mol of the mfe.
+        - random_sample (default: None): instead of producing all suboptimals in an energy range, produce a random sample of n suboptimal structures.
+        - max_structures (default: None): the maximal number of structures yielded
+        - max_energy (default: None): the structures with a free energy (kcal/mol) above this value are skipped. If the output is sorted, the generator stops at the first one.
+        - sort (default: False): if True, RNAsubopt sorts the structures by free energy (option -s)
+        - unique (default: True): if True, a structure already yielded is skipped (useful with random_sample). The structures are compared through the SHA-1 digests of their bracket notations, so only 20 bytes are kept per structure.
+
+        Returns:
+        --------
+        a generator of tuples (pair table, free energy). The free energy is None if RNAsubopt does not report it.
+        """
+        import hashlib
+        output = self.stream_command("fjossinet/assemble2", "RNAsubopt %s %s %s"%("-e %i"%range if range else "" ,  "-p %i"%random_sample if random_sample else "", "-s" if sort else ""), input = parsers.to_fasta([molecule], single_line=True)+"\n")
+        digests = set()
+        count = 0
+        try:
+            for line in output: #the structures are parsed while RNAsubopt produces them
+                tokens = line.split()
+                if not tokens or line.startswith('>') or not _BRACKET_NOTATION.match(tokens[0]):
+                    continue
+                try:
+                    energy = float(tokens[1]) if len(tokens) > 1 else None
+                except ValueError:
+                    energy = None
+                if max_energy is not None and energy is not None and energy > max_energy:
+                    if sort:
+                        break
+                    continue
+                if unique:
+                    digest = hashlib.sha1(tokens[0]).digest()
+                    if digest in digests:
+                        continue
+                    digests.add(digest)
+                yield parsers.bn_to_pair_table(tokens[0]), energy
+                count += 1
+                if max_structures is not None and count >= max_structures:
+                    break
+        finally:
+            output.close() #kills RNAsubopt if it is still running
+
+    @cached_result(image = 'fjossinet/assemble2')
+    def fold(self, molecule, range = None, random_sample = None, max_structures = None, max_energy = None):
         """
         Parameters:
         ---------
         - molecule: a Molecule object (see pyrna.features)
         - range (default: None): calculate suboptimal structures within range kcal/mol of the mfe.
         - random_sample (default: None): instead of producing all suboptimals in an energy range, produce a random sample of n suboptimal structures.
+        - max_structures (default: None): the maximal number of structures returned
+        - max_energy (default: None): the structures with a free energy (kcal/mol) above this value are skipped
 
         Returns:
         --------
         all the suboptimal secondary structures as a list of pandas DataFrames. Each pandas Dataframe contains a list of base-pairs.
         """
-        fileName = utils.generate_random_name(7)+'.fasta'
+        return [parsers.pair_table_to_base_pairs(pair_table) for pair_table, energy in self.iter_fold(molecule, range = range, random_sample = random_sample, max_structures = max_structures, max_energy = max_energy, unique = False)]
 
-        with open(self.cache_dir+'/'+fileName, 'w') as fasta_file:
-            fasta_file.write(parsers.to_fasta([molecule], single_line=True))
+    def fold_batch(self, molecules, range = None, random_sample = None, batch_size = 1000):
+        """
+        Compute the suboptimal structures of several molecules with a single RNAsubopt process per batch, instead of one container per molecule.
 
-        output = commands.getoutput("docker run -v %s:/data fjossinet/assemble2 bash -c 'RNAsubopt %s %s < /data/%s'"%(self.cache_dir, "-e %i"%range if range else "" ,  "-p %i"%random_sample if random_sample else "", fileName)).strip()
-        secondary_structures = []
-        for line in output.split('\n'):
-            tokens = line.split(' ')
-            if not line.startswith('>') and re.match("^[.()]+$", tokens[0]):
-                secondary_structures.append(parse_bn(tokens[0]))
-        return secondary_structures
+        Parameters:
+        ---------
+        - molecules: an iterable of Molecule objects (see pyrna.features)
+        - range (default: None): calculate suboptimal structures within range kcal/mol of the mfe.
+        - random_sample (default: None): instead of producing all suboptimals in an energy range, produce a random sample of n suboptimal structures.
+        - batch_size (default: 1000): the number of molecules processed by each RNAsubopt process
+
+        Returns:
+        --------
+        a generator of lists of pandas DataFrames (the suboptimal secondary structures of each molecule, in the order of the molecules)
+        """
+        def parse(lines):
+            secondary_structures = []
+            for line in lines:
+                tokens = line.strip().split(' ')
+                if re.match("^[.()]+$", tokens[0]):
+                    secondary_structures.append(parse_bn(tokens[0]))
+            return secondary_structures
+
+        for batch in _batches(molecules, batch_size):
+            fasta_data = [">%i\n%s\n"%(i, molecule.sequence) for i, molecule in enumerate(batch)]
+            output = self.stream_command("fjossinet/assemble2", "RNAsubopt %s %s"%("-e %i"%range if range else "" ,  "-p %i"%random_sample if random_sample else ""), input = fasta_data)
+            for secondary_structures in _in_order(_iter_records(output), len(batch), parse):
+                yield secondary_structures
 
 class Rnaview(Tool):
     """
@@ -1883,6 +2865,7 @@ class Rnaview(Tool):
         if not self.rest_server:
             check_docker_image('fjossinet/assemble2')
 
+    @cached_result(image = 'fjossinet/assemble2')
     def annotate(self, tertiary_structure = None, pdb_content = None, canonical_only = False, raw_output = False):
         """
         Parameters:
@@ -1906,124 +2889,48 @@ class Rnaview(Tool):
             xml_content = str(response.read())
             response.close()
         else:
-            pdb_file_name = utils.generate_random_name(7)+'.pdb'
-            with open(self.cache_dir+'/'+pdb_file_name, 'w') as pdb_file:
-                if pdb_content:
-                    pdb_file.write(pdb_content)
+            with self.workspace() as workspace:
+                pdb_file_name = 'structure.pdb'
+                with open(workspace+'/'+pdb_file_name, 'w') as pdb_file:
+                    if pdb_content:
+                        pdb_file.write(pdb_content)
+                    else:
+                        pdb_file.write(to_pdb(tertiary_structure, export_numbering_system = True))
+                self.run_command("fjossinet/assemble2", "rnaview -p %s"%pdb_file_name, workdir = "/data/%s"%os.path.basename(workspace))
+
+                xml_file_name = workspace+'/'+pdb_file_name+".xml"
+                xml_content = ""
+                if os.path.exists(xml_file_name):
+                    with open(xml_file_name) as xml_file:
+                        xml_content = xml_file.read()
                 else:
-                    pdb_file.write(to_pdb(tertiary_structure, export_numbering_system = True))
-            commands.getoutput("docker run -v %s:/data fjossinet/assemble2 rnaview -p /data/%s"%(self.cache_dir,pdb_file_name))
-
-            xml_file_name = self.cache_dir+'/'+pdb_file_name+".xml"
-            xml_content = ""
-            if os.path.exists(xml_file_name):
-                with open(xml_file_name) as xml_file:
-                    xml_content = xml_file.read()
-            else:
-                raise Exception("No file %s"%xml_file_name)
+                    raise Exception("No RNAML file produced by rnaview")
         if raw_output:
             return xml_content
         else:
-            import xml.etree.ElementTree as ET
-            rnaml_tree = ET.fromstring(xml_content)
-
-            molecule = rnaml_tree.find('molecule')
+            molecule = next(parsers.iter_rnaml(xml_content, lower_case_orientations = True))
 
-            rna = RNA(name = tertiary_structure.rna.name, sequence = re.sub('\s+','',molecule.find('sequence').find('seq-data').text))
+            rna = RNA(name = tertiary_structure.rna.name, sequence = molecule['sequence'])
 
-            secondary_structure = SecondaryStructure(rna)
-            secondary_structure.source='tool:rnaview:N.A.'
             new_3D = None
 
             if len(rna) != len(tertiary_structure.rna): #RNAVIEW can have problems with some residues. Consequently, RNAVIEW produces an RNA molecule with a different sequence. We need to fit the 3D to this molecule.
                 new_3D = TertiaryStructure(rna)
                 new_3D.source = "tool:rnaview:N.A."
-                numbering_system = re.sub('\s{2,}', ' ', molecule.find('sequence').find('numbering-table').text).strip().split(' ')
                 #the strategy is the following:
                 #- the numbering-table in the XML output stores the labels of the 3D residues used by RNAVIEW
                 #- for each residue label, we recover its absolute position in the numbering system of the initial 3D
-                residue_absPos = 1
-                for residue_label in numbering_system:
-                    for absPos, label in tertiary_structure.numbering_system.items():
-                        if label == residue_label:
-                            new_3D.residues[residue_absPos] = tertiary_structure.residues[int(absPos)]
-                            break
-                    residue_absPos += 1
+                absolute_positions = {}
+                for absPos, label in tertiary_structure.numbering_system.items():
+                    absolute_positions.setdefault(label, absPos)
+                for residue_absPos, residue_label in enumerate(molecule['numbering_table'] or [], 1):
+                    if residue_label in absolute_positions:
+                        new_3D.residues[residue_absPos] = tertiary_structure.residues[int(absolute_positions[residue_label])]
             else: #no problem, then we can substitute the RNA of the 2D for the RNA of the 3D
-                secondary_structure.rna = tertiary_structure.rna
-
-            if not canonical_only:
-
-                for helix in molecule.find('structure').find('model').find('str-annotation').findall('helix'):
-                    secondary_structure.add_helix(helix.get('id'), int(helix.find('base-id-5p').find('base-id').find('position').text), int(helix.find('base-id-3p').find('base-id').find('position').text), int(helix.find('length').text));
-
-                #for single_strand in molecule.find('structure').find('model').find('str-annotation').findall('single-strand'):
-                #    end5 = int(single_strand.find('segment').find('base-id-5p').find('base-id').find('position').text)
-                #    end3 = int(single_strand.find('segment').find('base-id-3p').find('base-id').find('position').text)
-                #    secondary_structure.add_single_strand(single_strand.find('segment').find('seg-name').text, end5, end3-end5+1);
-
-                for base_pair in molecule.find('structure').find('model').find('str-annotation').findall('base-pair'):
-                    edge1 = '('
-                    edge2 = ')'
-                    if base_pair.find('edge-5p').text == 'H':
-                        edge1 = '['
-                    elif base_pair.find('edge-5p').text == 'S':
-                        edge1 = '{'
-                    elif base_pair.find('edge-5p').text == 's':
-                        edge1 = '{'
-                    elif base_pair.find('edge-5p').text == '!':
-                        edge1 = '!'
-
-                    if base_pair.find('edge-3p').text == 'H':
-                        edge2 = ']'
-                    elif base_pair.find('edge-3p').text == 'S':
-                        edge2 = '}'
-                    elif base_pair.find('edge-3p').text == 's':
-                        edge2 = '}'
-                    elif base_pair.find('edge-3p').text == '!':
-                        edge2 = '!'
-
-                    secondary_structure.add_base_pair(base_pair.find('bond-orientation').text.lower(), edge1, edge2, int(base_pair.find('base-id-5p').find('base-id').find('position').text), int(base_pair.find('base-id-3p').find('base-id').find('position').text));
+                rna = tertiary_structure.rna
 
-            else:
-                canonical_bps = []
-                non_canonical_bps = []
-                for base_pair in molecule.find('structure').find('model').find('str-annotation').findall('base-pair'):
-                    edge1 = '('
-                    edge2 = ')'
-                    if base_pair.find('edge-5p').text == 'H':
-                        edge1 = '['
-                    elif base_pair.find('edge-5p').text == 'S':
-                        edge1 = '{'
-                    elif base_pair.find('edge-5p').text == 's':
-                        edge1 = '{'
-                    elif base_pair.find('edge-5p').text == '!':
-                        edge1 = '!'
-
-                    if base_pair.find('edge-3p').text == 'H':
-                        edge2 = ']'
-                    elif base_pair.find('edge-3p').text == 'S':
-                        edge2 = '}'
-                    elif base_pair.find('edge-3p').text == 's':
-                        edge2 = '}'
-                    elif base_pair.find('edge-3p').text == '!':
-                        edge2 = '!'
-
-                    orientation = base_pair.find('bond-orientation').text.lower()
-
-                    pos1 = int(base_pair.find('base-id-5p').find('base-id').find('position').text)
-                    residue1 = secondary_structure.rna.sequence[pos1-1]
-                    pos2 = int(base_pair.find('base-id-3p').find('base-id').find('position').text)
-                    residue2 = secondary_structure.rna.sequence[pos2-1]
-
-                    canonical_bps.append([orientation, edge1, edge2, pos1, pos2]) if utils.is_canonical(residue1, residue2, orientation, edge1, edge2) else non_canonical_bps.append([orientation, edge1, edge2, pos1, pos2])
-
-                secondary_structure = base_pairs_to_secondary_structure(secondary_structure.rna, DataFrame(canonical_bps, columns=['orientation', 'edge1', 'edge2', 'pos1', 'pos2']))
-
-                for bp in non_canonical_bps: #the non-canonical interactions are tertiary ones
-                    secondary_structure.add_tertiary_interaction(bp[0], bp[1], bp[2], bp[3], bp[4])
-
-            secondary_structure.find_single_strands()
+            secondary_structure = parsers.rnaml_to_secondary_structure(rna, molecule, canonical_only)
+            secondary_structure.source='tool:rnaview:N.A.'
 
             if new_3D:
                 return (secondary_structure, new_3D)
@@ -2051,7 +2958,7 @@ class Samtools(Tool):
         if not self.use_docker:
             return commands.getoutput("samtools %s"%(" ".join(user_defined_options)))
         else:
-            return commands.getoutput("docker run -v %s:/data fjossinet/rnaseq bash -c 'samtools %s'"%(self.sam_dir, " ".join(user_defined_options)))
+            return self.run_command("fjossinet/rnaseq", "samtools %s"%" ".join(user_defined_options), data_dir = self.sam_dir)
 
     def sort_and_index(self):
         """
@@ -2131,7 +3038,7 @@ class SnoGPS(Tool):
         """
         fasta_file_name = self.cache_dir+'/'+utils.generate_random_name(7)+'.fasta'
         with open(fasta_file_name, 'w') as fasta_file:
-            fasta_file.write(parsers.to_fasta(target_molecules))
+            parsers.write_fasta(target_molecules, fasta_file)
         scores_file_name = self.download_file(scores_table_file)
         targets_file_name = self.download_file(targets_file)
         descr_file_name = self.download_file(descriptor_file)
@@ -2277,7 +3184,7 @@ class Snoreport(Tool):
         """
         fasta_file_name = self.cache_dir+'/'+utils.generate_random_name(7)+'.fasta'
         with open(fasta_file_name, 'w') as fasta_file:
-            fasta_file.write(parsers.to_fasta([molecule], single_line=True))
+            parsers.write_fasta([molecule], fasta_file, single_line=True)
         output = commands.getoutput("snoReport %s < %s"%("-r" if reverse_complement else "", fasta_file_name))
         hits = []
         lines = output.split('\n')
@@ -2360,7 +3267,7 @@ class Snoscan(Tool):
         fasta_file_name = self.cache_dir+'/'+utils.generate_random_name(7)+'.fasta'
 
         with open(fasta_file_name, 'w') as fasta_file:
-            fasta_file.write(parsers.to_fasta(target_molecules))
+            parsers.write_fasta(target_molecules, fasta_file)
 
         meth_file_name = self.download_file(meth_sites_file)
         rrna_file_name = self.download_file(r_rna_file)
@@ -2455,7 +3362,7 @@ class TrnaScanSE(Tool):
         """
         fasta_file_name = self.cache_dir+'/'+utils.generate_random_name(7)+'.fasta'
         fasta_file = open(fasta_file_name, 'w')
-        fasta_file.write(to_fasta(target_molecules))
+        parsers.write_fasta(target_molecules, fasta_file)
         fasta_file.close()
 
         output = commands.getoutput("tRNAscan-SE %s"%fasta_file_name)
@@ -2508,46 +3415,49 @@ class Tophat2(Bowtie2):
         -----------
         - target_molecules: the genomic sequences to be used for the alignment (an array of Molecule objects, see pyrna.features)
         - fastq_file: the full path for the fastq file containing the reads (as a String). This file HAS TO BE located in the cache_dir defined during the instanciation of Tophat2.
-        - bowtie2_index: the full path of the bowtie2 index. If None, a new index will be build before to do the alignment (as a String)
+        - bowtie2_index: the path of an existing bowtie2 index, relative to the cache_dir (plus the prefix of the index files). If None (or if the index does not exist), the index of the target molecules is looked up in the index store of Bowtie2 (and built if needed). The index cannot be evicted during the alignment.
         - no_convert_bam: do not convert to bam format (default: False)
-        - parsing: if no_convert_bam is set to True, this parameter set if the SAM file will be parsed to return the list of aligned reads as a pandas DataFrame (default: True)
+        - parsing: if no_convert_bam is set to True, this parameter set if the SAM file will be parsed to return the list of aligned reads as a pandas DataFrame (default: True). The SAM file is parsed incrementally (see parsers.iter_sam()) and removed once parsed.
 
         Returns:
         --------
-        The full path of the SAM file or a pandas DataFrame describing the reads. The columns are:
+        a tuple (result, output directory). The output directory is private to this alignment (it contains the file junctions.bed, see bed_to_juncs()). The result is the full path of the SAM (or BAM) file or a pandas DataFrame describing the reads. The columns are:
         - genomicStart (an int)
         - genomicEnd (an int)
         - genomicStrand ('+' or '-')
         - genomeName (a String)
         """
 
-        if not bowtie2_index:
-            bowtie2_index = Bowtie2(cache_dir = self.cache_dir).build_index(target_molecules)
-        elif not os.path.exists(bowtie2_index+".1.bt2"):
-            bowtie2_index = Bowtie2(cache_dir = self.cache_dir, index_path = bowtie2_index).build_index(target_molecules)
-
-        print "Reads alignment..."
-        self.docker_client.containers.run("fjossinet/rnaseq", "tophat2 %s %s -o /data/ /data/%s /data/%s"%(' '.join(user_defined_options), "--no-convert-bam" if no_convert_bam else "", bowtie2_index, fastq_file), volumes={self.cache_dir: {'bind': '/data', 'mode': 'rw'}})
+        if bowtie2_index and not glob.glob(os.path.join(self.cache_dir, bowtie2_index)+".1.bt2*"): #.bt2l for the large indexes
+            bowtie2_index = None #the index is looked up from the target molecules
+        with Bowtie2(cache_dir = self.cache_dir, index_path = bowtie2_index).use_index(target_molecules) as bowtie2_index: #the index cannot be evicted while tophat2 reads it
+            print "Reads alignment..."
+            output_dir = self.new_output_dir() #each alignment gets its own accepted_hits and junctions.bed files
+            self.run_command("fjossinet/rnaseq", "tophat2 %s %s -o /data/%s/ /data/%s /data/%s"%(' '.join(user_defined_options), "--no-convert-bam" if no_convert_bam else "", os.path.basename(output_dir), bowtie2_index, fastq_file))
 
         result_file = None
         if no_convert_bam:
-            result_file = self.cache_dir+'/accepted_hits.sam'
-            if parsing:
-                return self.parse_sam(result_file, target_molecules)
+            result_file = output_dir+'/accepted_hits.sam'
+            if parsing: #tophat2 cannot write to its stdout, but its output is parsed without loading it at once
+                with open(result_file) as h:
+                    reads = self.reads_to_frame(parsers.iter_sam(h))
+                os.remove(result_file)
+                return reads, output_dir
         else:
-            result_file = self.cache_dir+'/accepted_hits.bam'
+            result_file = output_dir+'/accepted_hits.bam'
 
-        return result_file
+        return result_file, output_dir
 
-    def bed_to_juncs(self, junc_file):
+    def bed_to_juncs(self, junc_file, output_dir):
         """
-        This function converts the file junctions.bed into the file junc_file given as parameter. This junc_file can be provided to tophat2 with the option -j.
+        This function converts the file junctions.bed produced by an alignment into the file junc_file given as parameter (in the cache_dir). This junc_file can be provided to tophat2 with the option -j.
 
         Parameters:
         -----------
         - junc_file: the name of the output file
+        - output_dir: the output directory of the alignment (as returned by align())
         """
         junc_file = os.path.basename(junc_file)
-        lines = open(self.cache_dir+"/junctions.bed").readlines()
-        open(self.cache_dir+"/junctions_without_header.bed", 'w').writelines(lines[1:]) #the first line seems to crash the process....
-        self.docker_client.containers.run("fjossinet/rnaseq", "bash -c 'bed_to_juncs < %s > %s'"%("junctions_without_header.bed", junc_file), volumes={self.cache_dir: {'bind': '/data', 'mode': 'rw'}})
+        lines = open(output_dir+"/junctions.bed").readlines()
+        open(output_dir+"/junctions_without_header.bed", 'w').writelines(lines[1:]) #the first line seems to crash the process....
+        self.run_command("fjossinet/rnaseq", "bed_to_juncs < %s/junctions_without_header.bed > %s"%(os.path.relpath(output_dir, self.cache_dir), junc_file), workdir = "/data")
@@ -0,0 +1,389 @@
+"""
+Execution of the commands of the tools (see pyrna.computations) in long-lived containers.
+
+Starting a container for each command costs far more than most of the computations themselves. A ContainerPool keeps warm containers for each image (and each mounted directory) and dispatches the commands to them with docker exec. The containers are checked regularly and recycled after a given number of jobs.
+
+A ContainerPool runs with a DockerBackend (the default) or with a LocalBackend that runs the commands directly on the host (useful when the tools are installed locally or to test without Docker).
+"""
+
+import os, subprocess, threading, time, atexit, uuid
+
+_docker_client = None
+_docker_client_lock = threading.Lock()
+
+def get_docker_client():
+    """
+    Returns:
+    --------
+    the Docker client shared by all the tools (created at the first call)
+    """
+    global _docker_client
+    with _docker_client_lock:
+        if _docker_client is None:
+            import docker
+            _docker_client = docker.from_env()
+    return _docker_client
+
+def killable_command(command, pid_file):
+    """
+    Wrap a bash command so that it runs in its own process group, whose id is written in pid_file. Killing the client running a command in a container (like docker exec) does not stop the command itself: the whole process group is killed with the command returned by kill_command().
+    """
+    return "set -m\nexec 3>&2 2>/dev/null\n(\n%s\n) 2>&3 3>&- &\necho $! > %s\nwait $!\nstatus=$?\nrm -f %s\nexit $status"%(command, pid_file, pid_file) #the messages of the job control go to /dev/null, the command keeps the original stderr
+
+def kill_command(pid_file):
+    """
+    Returns:
+    --------
+    the bash command killing the process group of a command wrapped with killable_command() (waiting a little for the pid_file if the command has just started)
+    """
+    return "for i in 1 2 3 4 5 6 7 8 9 10; do [ -s %s ] && break; sleep 0.1; done; kill -9 -- -$(cat %s) 2>/dev/null; rm -f %s"%(pid_file, pid_file, pid_file)
+
+def kill_host_command(pid_file):
+    """
+    Kill the process group of a command wrapped with killable_command() and run on the host.
+    """
+    subprocess.call(['bash', '-c', kill_command(pid_file)])
+
+def docker_kill(name):
+    """
+    Kill a container started with docker run --name name.
+    """
+    with open(os.devnull, 'w') as devnull:
+        subprocess.call(['docker', 'kill', name], stdout = devnull, stderr = subprocess.STDOUT)
+
+def stream_process(args, input = None, cwd = None, cancel_event = None, check = False, kill = None):
+    """
+    Run a process, feed its stdin and yield its output line by line, as soon as it is produced. The input is written from a separate thread, so that a large input and a large output cannot block each other. If the generator is closed before the end, the process is killed.
+
+    Parameters:
+    -----------
+    - args: the command line as a list of arguments
+    - input (default: None): the data to send on stdin, as a String or an iterable of Strings
+    - cwd (default: None): the working directory of the process
+    - cancel_event (default: None): a threading.Event. Once set, the process is killed.
+    - check (default: False): if True, an Exception is raised at the end of the output if the process failed (non-zero exit status)
+    - kill (default: None): a function stopping the command run by the process somewhere else (like in a container), called when the process is killed before its end
+
+    Returns:
+    --------
+    a generator of the lines of the output (stdout and stderr)
+    """
+    process = subprocess.Popen(args, stdin = subprocess.PIPE if input is not None else open(os.devnull), stdout = subprocess.PIPE, stderr = subprocess.STDOUT, cwd = cwd)
+    writer = None
+    if input is not None:
+        def write():
+            try:
+                for data in ([input] if isinstance(input, basestring) else input):
+                    process.stdin.write(data)
+            except IOError: #the process stopped reading its input
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except IOError:
+                    pass
+        writer = threading.Thread(target = write)
+        writer.daemon = True
+        writer.start()
+    if cancel_event is not None:
+        def watch():
+            while process.poll() is None:
+                if cancel_event.wait(0.1):
+                    if process.poll() is None:
+                        if kill:
+                            kill()
+                        process.kill()
+                    break
+        watcher = threading.Thread(target = watch)
+        watcher.daemon = True
+        watcher.start()
+    try:
+        for line in iter(process.stdout.readline, ''):
+            yield line
+        process.wait()
+        if check and process.returncode != 0:
+            raise Exception("The command failed with the exit status %i"%process.returncode)
+    finally:
+        if process.poll() is None:
+            if kill:
+                kill()
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        if writer:
+            writer.join()
+
+class DockerBackend:
+    """
+    Runs the commands in Docker containers.
+    """
+
+    def start(self, image, volumes):
+        """
+        Start a container that will stay alive until stop() is called.
+
+        Parameters:
+        -----------
+        - image: the name of the Docker image
+        - volumes: a dict whose keys are the directories of the host and the values the mount points in the container
+
+        Returns:
+        --------
+        the container
+        """
+        return get_docker_client().containers.run(image, "tail -f /dev/null", detach = True, auto_remove = True, volumes = dict((host_dir, {'bind': mount_point, 'mode': 'rw'}) for host_dir, mount_point in volumes.iteritems()))
+
+    def execute(self, container, command, workdir = None):
+        """
+        Run a command with bash in a container.
+
+        Returns:
+        --------
+        a tuple (exit code, output). The output mixes stdout and stderr.
+        """
+        result = container.exec_run(['bash', '-c', command], workdir = workdir)
+        return result.exit_code, result.output
+
+    def stream(self, container, command, input = None, workdir = None, cancel_event = None, check = False):
+        """
+        Run a command with bash in a container, feeding its stdin.
+
+        Returns:
+        --------
+        a generator of the lines of the output (see stream_process()). If the generator is closed or cancelled before the end, the command is killed in the container.
+        """
+        pid_file = "/tmp/pyrna_%s.pid"%uuid.uuid4().hex
+        return stream_process(['docker', 'exec', '-i']+(['-w', workdir] if workdir else [])+[container.id, 'bash', '-c', killable_command(command, pid_file)], input = input, cancel_event = cancel_event, check = check, kill = lambda: self.kill(container, pid_file))
+
+    def kill(self, container, pid_file):
+        """
+        Kill a command started by stream() in a container.
+        """
+        try:
+            container.exec_run(['bash', '-c', kill_command(pid_file)])
+        except Exception: #the container is gone, and the command with it
+            pass
+
+    def is_healthy(self, container):
+        try:
+            container.reload()
+            return container.status == 'running' and container.exec_run(['true']).exit_code == 0
+        except Exception:
+            return False
+
+    def stop(self, container):
+        try:
+            container.remove(force = True)
+        except Exception: #already removed (auto_remove)
+            pass
+
+class LocalBackend:
+    """
+    Runs the commands directly on the host, with the binaries installed locally. The mount points of the volumes are substituted for the directories of the host in the commands.
+    """
+
+    def start(self, image, volumes):
+        return {'image': image, 'volumes': dict(volumes)}
+
+    def __to_host(self, container, command, workdir):
+        for host_dir, mount_point in sorted(container['volumes'].iteritems(), key = lambda volume: -len(volume[1])):
+            command = command.replace(mount_point, host_dir)
+            if workdir and workdir.startswith(mount_point):
+                workdir = host_dir+workdir[len(mount_point):]
+        return command, workdir
+
+    def execute(self, container, command, workdir = None):
+        command, workdir = self.__to_host(container, command, workdir)
+        process = subprocess.Popen(['bash', '-c', command], stdout = subprocess.PIPE, stderr = subprocess.STDOUT, cwd = workdir)
+        output = process.communicate()[0]
+        return process.returncode, output
+
+    def stream(self, container, command, input = None, workdir = None, cancel_event = None, check = False):
+        command, workdir = self.__to_host(container, command, workdir)
+        pid_file = "/tmp/pyrna_%s.pid"%uuid.uuid4().hex
+        return stream_process(['bash', '-c', killable_command(command, pid_file)], input = input, cwd = workdir, cancel_event = cancel_event, check = check, kill = lambda: self.kill(container, pid_file))
+
+    def kill(self, container, pid_file):
+        kill_host_command(pid_file)
+
+    def is_healthy(self, container):
+        return True
+
+    def stop(self, container):
+        pass
+
+class _PooledContainer:
+
+    def __init__(self, container):
+        self.container = container
+        self.jobs = 0
+        self.active = 0
+        self.last_check = time.time()
+        self.retired = False
+
+class ContainerPool:
+    """
+    A pool of long-lived containers. For each image and each set of volumes, the pool starts up to max_containers containers, each one running up to max_concurrency commands at the same time. A container is checked before a command if it has not been checked for health_check_interval seconds, and replaced after max_jobs commands.
+
+    Parameters:
+    -----------
+    - backend (default: None): a DockerBackend or a LocalBackend object. If None, a DockerBackend is used.
+    - max_containers (default: 2): the number of containers per image and volumes
+    - max_concurrency (default: 4): the number of commands run at the same time in a container
+    - max_jobs (default: 500): the number of commands after which a container is recycled
+    - health_check_interval (default: 60): the delay (in seconds) between two health checks of a container
+    """
+
+    def __init__(self, backend = None, max_containers = 2, max_concurrency = 4, max_jobs = 500, health_check_interval = 60):
+        self.backend = backend or DockerBackend()
+        self.max_containers = max_containers
+        self.max_concurrency = max_concurrency
+        self.max_jobs = max_jobs
+        self.health_check_interval = health_check_interval
+        self.containers = {}
+        self.condition = threading.Condition()
+        self.closed = False
+        atexit.register(self.close)
+
+    def __acquire(self, key):
+        image, volumes = key[0], dict(key[1])
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise Exception("The container pool is closed")
+                pool = self.containers.setdefault(key, [])
+                available = [pooled for pooled in pool if pooled.container is not None and not pooled.retired and pooled.active < self.max_concurrency]
+                if available:
+                    pooled = min(available, key = lambda pooled: pooled.active)
+                    pooled.active += 1
+                    break
+                if len(pool) < self.max_containers:
+                    pooled = _PooledContainer(None)
+                    pooled.active = 1
+                    pool.append(pooled)
+                    break
+                self.condition.wait()
+        if pooled.container is None: #the container is started outside of the lock, it can take a while
+            try:
+                container = self.backend.start(image, volumes)
+            except:
+                with self.condition:
+                    pool.remove(pooled)
+                    self.condition.notify_all()
+                raise
+            with self.condition:
+                pooled.container = container
+                self.condition.notify_all()
+        elif time.time()-pooled.last_check > self.health_check_interval:
+            pooled.last_check = time.time()
+            if not self.backend.is_healthy(pooled.container):
+                self.__discard(key, pooled)
+                return self.__acquire(key)
+        return pooled
+
+    def __release(self, key, pooled):
+        with self.condition:
+            pooled.jobs += 1
+            pooled.active -= 1
+            if pooled.jobs >= self.max_jobs:
+                pooled.retired = True
+            stop = pooled.retired and not pooled.active
+            if stop and pooled in self.containers.get(key, []):
+                self.containers[key].remove(pooled)
+            self.condition.notify_all()
+        if stop:
+            self.backend.stop(pooled.container)
+
+    def __discard(self, key, pooled):
+        with self.condition:
+            pooled.retired = True
+            pooled.active -= 1
+            if pooled in self.containers.get(key, []):
+                self.containers[key].remove(pooled)
+            self.condition.notify_all()
+        self.backend.stop(pooled.container)
+
+    def execute(self, image, command, volumes = {}, workdir = None):
+        """
+        Run a command in a container of the pool.
+
+        Parameters:
+        -----------
+        - image: the name of the Docker image
+        - command: the command (run with bash)
+        - volumes (default: {}): a dict whose keys are the directories of the host and the values the mount points in the container
+        - workdir (default: None): the working directory of the command
+
+        Returns:
+        --------
+        a tuple (exit code, output). The output mixes stdout and stderr.
+        """
+        key = (image, tuple(sorted(volumes.iteritems())))
+        pooled = self.__acquire(key)
+        try:
+            return self.backend.execute(pooled.container, command, workdir = workdir)
+        finally:
+            self.__release(key, pooled)
+
+    def run(self, image, command, volumes = {}, workdir = None):
+        """
+        Like execute() but returns only the output.
+        """
+        return self.execute(image, command, volumes = volumes, workdir = workdir)[1]
+
+    def stream(self, image, command, input = None, volumes = {}, workdir = None, cancel_event = None, check = False):
+        """
+        Run a command in a container of the pool, feeding its stdin. The container is released when the output has been entirely read, or when the generator is closed (the command is then killed in the container before the release).
+
+        Parameters:
+        -----------
+        - image: the name of the Docker image
+        - command: the command (run with bash)
+        - input (default: None): the data to send on stdin, as a String or an iterable of Strings
+        - volumes (default: {}): a dict whose keys are the directories of the host and the values the mount points in the container
+        - workdir (default: None): the working directory of the command
+        - cancel_event (default: None): a threading.Event. Once set, the command is killed.
+        - check (default: False): if True, an Exception is raised at the end of the output if the command failed
+
+        Returns:
+        --------
+        a generator of the lines of the output (stdout and stderr)
+        """
+        key = (image, tuple(sorted(volumes.iteritems())))
+        pooled = self.__acquire(key)
+        try:
+            lines = self.backend.stream(pooled.container, command, input = input, workdir = workdir, cancel_event = cancel_event, check = check)
+            try:
+                for line in lines:
+                    yield line
+            finally:
+                lines.close() #kills the command if it is still running
+        finally:
+            self.__release(key, pooled)
+
+    def close(self):
+        """
+        Stop all the containers.
+        """
+        with self.condition:
+            self.closed = True
+            pooled_containers = [pooled for pool in self.containers.values() for pooled in pool]
+            self.containers = {}
+            self.condition.notify_all()
+        for pooled in pooled_containers:
+            if pooled.container is not None:
+                self.backend.stop(pooled.container)
+
+_container_pool = None
+
+def get_container_pool():
+    """
+    Returns:
+    --------
+    the ContainerPool shared by all the tools (created at the first call, with a DockerBackend)
+    """
+    global _container_pool
+    with _docker_client_lock:
+        if _container_pool is None:
+            _container_pool = ContainerPool()
+    return _container_pool
@@ -4,6 +4,36 @@ from pyrna.features import RNA
 import parsers, utils
 from pymongo import MongoClient
 
+def fetch_async(url, body = None, timeout = None):
+    """
+    Download the content of an URL without blocking the Tornado IOLoop (see the *_async() methods of the wrappers).
+
+    Parameters:
+    -----------
+    - url: the URL
+    - body (default: None): the data to POST. If None, the URL is fetched with GET.
+    - timeout (default: None): the maximal duration of the download (in seconds). If None, the default of the Tornado AsyncHTTPClient is used.
+
+    Returns:
+    --------
+    a Tornado Future resolved with the content as a String
+    """
+    from tornado import gen
+    from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPError
+
+    @gen.coroutine
+    def fetch():
+        options = {'method': 'POST', 'body': body} if body is not None else {}
+        if timeout:
+            options['request_timeout'] = timeout
+        try:
+            response = yield AsyncHTTPClient().fetch(HTTPRequest(url, **options))
+        except HTTPError, e:
+            raise Exception("Cannot fetch %s: %s"%(url, e))
+        raise gen.Return(str(response.body))
+
+    return fetch()
+
 class charnDB:
     """
     A class to connect to a charnDB instance (which is based on MongoDB)
@@ -58,10 +88,19 @@ class PDB:
         """
         Return the content of a PDB entry as a string
         """
-        response = urllib.urlopen("http://www.rcsb.org/pdb/download/downloadFile.do?fileFormat=pdb&compression=NO&structureId=%s"%pdb_id)
+        response = urllib.urlopen(self.__entry_url(pdb_id))
         content = str(response.read())
         return content
 
+    def get_entry_async(self, pdb_id, timeout = None):
+        """
+        Like get_entry() but returns a Tornado Future and does not block the IOLoop (see fetch_async())
+        """
+        return fetch_async(self.__entry_url(pdb_id), timeout = timeout)
+
+    def __entry_url(self, pdb_id):
+        return "http://www.rcsb.org/pdb/download/downloadFile.do?fileFormat=pdb&compression=NO&structureId=%s"%pdb_id
+
     def query(self, query):
         """
         Returns a list of PDB ids in answer to the query
@@ -337,6 +376,29 @@ class NCBI:
         """
         Wrapper for the Efetch Entrez Utilities
         """
+        url, body = self.__efetch_request(db, ids, rettype, retmode)
+        response = urllib.urlopen(url, body)
+
+        if header:
+            content = str(response.read(header))
+        else:
+            content = str(response.read())
+        response.close()
+        return content
+
+    def efetch_async(self, db, ids, rettype = None, retmode = "text", timeout = None):
+        """
+        Like efetch() but returns a Tornado Future and does not block the IOLoop (see fetch_async())
+        """
+        url, body = self.__efetch_request(db, ids, rettype, retmode)
+        return fetch_async(url, body = body, timeout = timeout)
+
+    def __efetch_request(self, db, ids, rettype, retmode):
+        """
+        Returns:
+        --------
+        a tuple (URL, POST data). The POST data is None for the GET requests.
+        """
         data = {
             'db': db,
             'id': ','.join(ids),
@@ -344,30 +406,29 @@ class NCBI:
         }
         if rettype:
             data['rettype'] = rettype
-
-        response = None
-
         if len(ids) > 200:
-            response = urllib.urlopen("%sefetch.fcgi"%self._eutils_base_url, urllib.urlencode(data))
+            return "%sefetch.fcgi"%self._eutils_base_url, urllib.urlencode(data)
         else:
-            response = urllib.urlopen("%sefetch.fcgi?%s"%(self._eutils_base_url, urllib.urlencode(data)))
-
-        if header:
-            content = str(response.read(header))
-        else:
-            content = str(response.read())
-        response.close()
-        return content
+            return "%sefetch.fcgi?%s"%(self._eutils_base_url, urllib.urlencode(data)), None
 
     def esearch(self, db, term, retstart = 0, retmax = 20):
         """
         Wrapper for the Esearch Entrez Utilities
         """
-        response = urllib.urlopen("%sesearch.fcgi?db=%s&term=%s&retstart=%i&retmax=%i"%(self._eutils_base_url, db, term, retstart, retmax))
+        response = urllib.urlopen(self.__esearch_url(db, term, retstart, retmax))
         content = str(response.read())
         response.close()
         return content
 
+    def esearch_async(self, db, term, retstart = 0, retmax = 20, timeout = None):
+        """
+        Like esearch() but returns a Tornado Future and does not block the IOLoop (see fetch_async())
+        """
+        return fetch_async(self.__esearch_url(db, term, retstart, retmax), timeout = timeout)
+
+    def __esearch_url(self, db, term, retstart, retmax):
+        return "%sesearch.fcgi?db=%s&term=%s&retstart=%i&retmax=%i"%(self._eutils_base_url, db, term, retstart, retmax)
+
     def esummary(self, db, ids, retstart = 0, retmax = 20):
         """
         Wrapper for the Esummary Entrez Utilities
@@ -389,6 +450,15 @@ class NCBI:
             response.close()
             return content
 
+    def esummary_async(self, db, ids, retstart = 0, retmax = 20, timeout = None):
+        """
+        Like esummary() but returns a Tornado Future and does not block the IOLoop (see fetch_async())
+        """
+        if len(ids) < 200:
+            return fetch_async("%sesummary.fcgi?db=%s&id=%s&retstart=%i&retmax=%i"%(self._eutils_base_url, db, ','.join(ids), retstart, retmax), timeout = timeout)
+        else:
+            return fetch_async("%sesummary.fcgi"%self._eutils_base_url, body = urllib.urlencode({'db': db, 'id': ','.join(ids)}), timeout = timeout)
+
     def elink(self, db, dbfrom, id):
         """
         Wrapper for the Elink Entrez Utilities
@@ -474,22 +544,50 @@ class Rfam:
         content = None
 
         if self.use_website:
-            response = urllib.urlopen("%s/family/%s/alignment?acc=%s&alnType=%s&nseLabels=%i&format=stockholm&download=1"%(self.base_url, rfam_id, rfam_id, aln_type, nse_labels))
+            response = urllib.urlopen(self.__entry_url(rfam_id, aln_type, nse_labels))
             content = str(response.read())
             response.close()
             if not content.startswith("# STOCKHOLM"):
                 raise Exception("Rfam family %s not found!!"%rfam_id)
         else:
-            path = os.path.join(self.cache_dir, aln_type, "%s.sto"%rfam_id)
+            content = self.__read_entry(rfam_id, aln_type)
+
+        return self.__format_entry(content, format)
 
-            if not os.path.exists(path):
-                raise Exception("file %s not found!!"%path)
+    def get_entry_async(self, rfam_id, aln_type = 'seed', nse_labels = 0, format = None, timeout = None):
+        """
+        Like get_entry() but returns a Tornado Future and does not block the IOLoop when the data are downloaded from the website (see fetch_async())
+        """
+        from tornado import gen
+
+        @gen.coroutine
+        def get_entry():
+            if self.use_website:
+                content = yield fetch_async(self.__entry_url(rfam_id, aln_type, nse_labels), timeout = timeout)
+                if not content.startswith("# STOCKHOLM"):
+                    raise Exception("Rfam family %s not found!!"%rfam_id)
             else:
-                with open(path) as h:
-                    content = h.read()
-                if not content.strip().split('\n')[-1].strip() == '//': #incomplete file
-                    raise Exception("file %s is incomplete!!"%path)
+                content = self.__read_entry(rfam_id, aln_type)
+            raise gen.Return(self.__format_entry(content, format))
+
+        return get_entry()
 
+    def __entry_url(self, rfam_id, aln_type, nse_labels):
+        return "%s/family/%s/alignment?acc=%s&alnType=%s&nseLabels=%i&format=stockholm&download=1"%(self.base_url, rfam_id, rfam_id, aln_type, nse_labels)
+
+    def __read_entry(self, rfam_id, aln_type):
+        path = os.path.join(self.cache_dir, aln_type, "%s.sto"%rfam_id)
+
+        if not os.path.exists(path):
+            raise Exception("file %s not found!!"%path)
+        else:
+            with open(path) as h:
+                content = h.read()
+            if not content.strip().split('\n')[-1].strip() == '//': #incomplete file
+                raise Exception("file %s is incomplete!!"%path)
+        return content
+
+    def __format_entry(self, content, format):
         if not format:
             return parsers.parse_stockholm(content)
         elif format == 'stockholm':
@@ -508,6 +606,19 @@ class Rfam:
                 content = ''.join(h.readlines())
         return content
 
+    def get_clanin(self):
+        """
+        Return the path of the file listing the families of each clan (Rfam.clanin), needed to resolve the overlaps between the hits of the families of a clan (see Cmscan in pyrna.computations). The file is downloaded from the FTP of Rfam at the first call.
+        """
+        directory = self.cache_dir+'/CMs/'
+        if not os.path.exists(directory):
+            shutil.os.mkdir(directory)
+        path = directory+'Rfam.clanin'
+        if not os.path.exists(path):
+            urllib.urlretrieve("ftp://ftp.ebi.ac.uk/pub/databases/Rfam/"+self.version+"/Rfam.clanin", path+'.tmp')
+            os.rename(path+'.tmp', path)
+        return path
+
 
     """
     This method returns the consensus sequence for an Rfam Entry
@@ -631,16 +742,33 @@ class Rfam:
                 organisms.append(organism)
         return DataFrame(organisms)
 
+    def get_ftp_file(self, sub_dir, file_name, uncompress = False):
+        """
+        Returns the path of a file from the FTP of Rfam, stored in the cache directory. The file is downloaded if it is not already available (compressed or not).
+
+        Parameters:
+        -----------
+        - sub_dir: the sub-directory of the cache directory for this file
+        - file_name: the name of the file on the FTP, without the .gz extension (like 'Rfam.seed')
+        - uncompress (default: False): if True, a downloaded file is stored uncompressed (needed for the files used by external tools, like Rfam.cm). Otherwise it is kept compressed and has to be read with pyrna.utils.open_input().
+        """
+        directory = self.cache_dir+'/'+sub_dir+'/'
+        if not os.path.exists(directory):
+            shutil.os.mkdir(directory)
+        for path in [directory+file_name, directory+file_name+'.gz']:
+            if os.path.exists(path):
+                return path
+        if uncompress:
+            subprocess.call([os.path.dirname(os.path.realpath(__file__))+"/../scripts/shell/getRfam_data.sh "+directory+" ftp://ftp.ebi.ac.uk/pub/databases/Rfam/"+self.version+"/ "+file_name+".gz"], shell=True)
+            return directory+file_name
+        urllib.urlretrieve("ftp://ftp.ebi.ac.uk/pub/databases/Rfam/"+self.version+"/"+file_name+".gz", directory+file_name+'.gz')
+        return directory+file_name+'.gz'
+
     def generate_seed_alignments(self):
         """
         This method has to be called if the Rfam wrapper uses data from the FTP. Seed alignments will be downloaded and stored locally.
         """
-        if not os.path.exists(self.cache_dir+'/seed/Rfam.seed'):
-            if not os.path.exists(self.cache_dir+'/seed/'):
-                shutil.os.mkdir(self.cache_dir+'/seed/')
-            subprocess.call([os.path.dirname(os.path.realpath(__file__))+"/../scripts/shell/getRfam_data.sh "+self.cache_dir+"/seed/ ftp://ftp.ebi.ac.uk/pub/databases/Rfam/"+self.version+"/ Rfam.seed.gz"], shell=True)
-
-        with open(self.cache_dir+'/seed/Rfam.seed') as h:
+        with utils.open_input(self.get_ftp_file('seed', 'Rfam.seed')) as h:
             currentAccession = None
             currentContent = None
 
@@ -663,12 +791,7 @@ class Rfam:
         """
         This method has to be called if the Rfam wrapper uses data from the FTP. Full alignments will be downloaded and stored locally.
         """
-        if not os.path.exists(self.cache_dir+'/full/Rfam.full'):
-            if not os.path.exists(self.cache_dir+'/full/'):
-                shutil.os.mkdir(self.cache_dir+'/full/')
-            subprocess.call([os.path.dirname(os.path.realpath(__file__))+"/../scripts/shell/getRfam_data.sh "+self.cache_dir+"/full/ ftp://ftp.ebi.ac.uk/pub/databases/Rfam/"+self.version+"/ Rfam.full.gz"], shell=True)
-
-        with open(self.cache_dir+'/full/Rfam.full') as h:
+        with utils.open_input(self.get_ftp_file('full', 'Rfam.full')) as h:
             currentAccession = None
             currentContent = None
 
@@ -691,12 +814,7 @@ class Rfam:
         """
         This method has to be called if you plan to use cmsearch (see pyrna.computations). The covariance models will be downloaded and stored locally.
         """
-        if not os.path.exists(self.cache_dir+'/CMs/Rfam.cm'):
-            if not os.path.exists(self.cache_dir+'/CMs/'):
-                shutil.os.mkdir(self.cache_dir+'/CMs/')
-            subprocess.call([os.path.dirname(os.path.realpath(__file__))+"/../scripts/shell/getRfam_data.sh "+self.cache_dir+"/CMs/ ftp://ftp.ebi.ac.uk/pub/databases/Rfam/"+self.version+"/ Rfam.cm.gz"], shell=True)
-
-        with open(self.cache_dir+'/CMs/Rfam.cm') as h:
+        with utils.open_input(self.get_ftp_file('CMs', 'Rfam.cm', uncompress = True)) as h:
 
             familyName = None
             rfamHeader = None
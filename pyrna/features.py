@@ -148,16 +148,10 @@ class Molecule:
         return positions
 
     def to_fasta(self, single_line=False):
-        lines = []
-        lines.append(">" + self.name)
         if single_line:
-            lines.append(self.sequence)
-        else:
-            c = 0
-            while c < len(self.sequence):
-                d = min(len(self.sequence), c + 79)
-                lines.append(self.sequence[c:d])
-                c += 79
+            return ">%s\n%s"%(self.name, self.sequence)
+        lines = [">" + self.name]
+        lines.extend(self.sequence[c:c+79] for c in xrange(0, len(self.sequence), 79))
         return '\n'.join(lines)
 
     def _repr_html_(self):
@@ -1012,6 +1006,397 @@ class TertiaryStructure:
         else:
             return str(absolute_position)
 
+class FeatureTable:
+    """
+    A table of genomic features indexed on their genomic positions.
+
+    For each genome and each strand, the features are split into classes of length (from 2^k to 2^(k+1)-1 nts) and, for each class, sorted by start. Since the length of the features of a class is bounded, all the features overlapping a range are found with two binary searches per class (an implicit interval tree). The queries are vectorized with numpy: a single call can process millions of ranges.
+
+    The features can be:
+    - a pandas DataFrame, like those produced by the parsers (see pyrna.parsers) or the tools (see pyrna.computations)
+    - a list of dicts, like the documents stored in the MongoDB collections ('annotations', 'ncRNAs',...)
+
+    Each feature needs a genome (column 'genomeName', 'genome' or 'target_name'), genomic positions (column 'genomicPositions' or 'target_positions', or columns 'target_start' and 'target_end') and a strand (column 'genomicStrand' or 'target_strand', optional).
+    """
+
+    def __init__(self, features):
+        import numpy as np
+        if not isinstance(features, DataFrame):
+            features = DataFrame(list(features))
+        self.features = features
+        self.index = {}
+        self.keys = {}
+
+        if not len(features):
+            self.starts = self.ends = np.array([], dtype = np.int64)
+            self.genomes = self.strands = np.array([], dtype = object)
+            return
+
+        genome_column = self.__find_column(['genomeName', 'genome', 'target_name'])
+        strand_column = self.__find_column(['genomicStrand', 'target_strand'], mandatory = False)
+
+        if 'target_start' in features and 'target_end' in features:
+            starts = features['target_start'].values.astype(np.int64)
+            ends = features['target_end'].values.astype(np.int64)
+            self.starts, self.ends = np.minimum(starts, ends), np.maximum(starts, ends)
+        else:
+            positions_column = self.__find_column(['genomicPositions', 'target_positions'])
+            bounds = [FeatureTable.__bounds(positions) for positions in features[positions_column]]
+            self.starts = np.array([bound[0] for bound in bounds], dtype = np.int64)
+            self.ends = np.array([bound[1] for bound in bounds], dtype = np.int64)
+
+        self.genomes = features[genome_column].values
+        if strand_column:
+            self.strands = features[strand_column].fillna('.').values
+        else:
+            self.strands = np.array(['.']*len(features), dtype = object)
+
+        length_classes = np.floor(np.log2(self.ends-self.starts+1)).astype(np.int64)
+        groups = DataFrame({'genome': self.genomes, 'strand': self.strands}).groupby(['genome', 'strand']).indices
+        for key, ids in groups.iteritems():
+            ids = ids[np.lexsort((self.starts[ids], length_classes[ids]))]
+            strata = []
+            for length_class in np.unique(length_classes[ids]):
+                _ids = ids[length_classes[ids] == length_class]
+                strata.append((_ids, self.starts[_ids], self.ends[_ids], int((self.ends[_ids]-self.starts[_ids]).max())+1))
+            by_start = ids[np.argsort(self.starts[ids], kind = 'mergesort')]
+            by_end = ids[np.argsort(self.ends[ids], kind = 'mergesort')]
+            self.index[key] = (strata, by_start, self.starts[by_start], by_end, self.ends[by_end])
+            self.keys.setdefault(key[0], []).append(key)
+
+    def __find_column(self, names, mandatory = True):
+        for name in names:
+            if name in self.features:
+                return name
+        if mandatory:
+            raise Exception("No column %s in the features"%" or ".join(names))
+        return None
+
+    @staticmethod
+    def __bounds(positions):
+        if isinstance(positions[0], (list, tuple)): #a list of blocks, like the target_positions from cmsearch
+            ends = [end for block in positions for end in block]
+            return min(ends), max(ends)
+        return min(positions), max(positions)
+
+    def __len__(self):
+        return len(self.features)
+
+    def __keys(self, genome, strand, strandedness):
+        """
+        Returns the keys of the index to be searched for a query range located on a genome and a strand.
+        """
+        keys = self.keys.get(genome, [])
+        if strandedness == 'any' or not strand in ['+', '-']:
+            return keys
+        if strandedness == 'opposite':
+            strand = '-' if strand == '+' else '+'
+        return [key for key in keys if key[1] == strand or not key[1] in ['+', '-']]
+
+    def __overlaps(self, key, query_starts, query_ends):
+        """
+        Returns two numpy arrays (indices of the query ranges, row positions of the features) for all the overlapping pairs.
+        """
+        import numpy as np
+        query_ids, feature_ids = [], []
+        strata = self.index[key][0]
+        for ids, starts, ends, max_length in strata:
+            lower_bounds = np.searchsorted(starts, query_starts-max_length+1, 'left')
+            upper_bounds = np.searchsorted(starts, query_ends, 'right')
+            counts = upper_bounds-lower_bounds
+            total = counts.sum()
+            if not total:
+                continue
+            _query_ids = np.repeat(np.arange(len(query_starts)), counts)
+            candidates = np.repeat(lower_bounds, counts)+np.arange(total)-np.repeat(np.cumsum(counts)-counts, counts)
+            mask = ends[candidates] >= query_starts[_query_ids]
+            query_ids.append(_query_ids[mask])
+            feature_ids.append(ids[candidates[mask]])
+        if not query_ids:
+            return np.array([], dtype = np.int64), np.array([], dtype = np.int64)
+        return np.concatenate(query_ids), np.concatenate(feature_ids)
+
+    def window(self, genome, start, end, strand = None):
+        """
+        Parameters:
+        ---------
+        - genome: the genome name
+        - start: the first position of the window
+        - end: the last position of the window
+        - strand (default: None): the strand ('+' or '-'). If None, the features on both strands are returned.
+
+        Returns:
+        ------
+        the features overlapping the window, as a pandas DataFrame (sorted by start).
+        """
+        import numpy as np
+        feature_ids = []
+        for key in self.__keys(genome, strand, 'any' if strand is None else 'same'):
+            feature_ids.append(self.__overlaps(key, np.array([start], dtype = np.int64), np.array([end], dtype = np.int64))[1])
+        feature_ids = np.concatenate(feature_ids) if feature_ids else np.array([], dtype = np.int64)
+        feature_ids = feature_ids[np.argsort(self.starts[feature_ids], kind = 'mergesort')]
+        return self.features.iloc[feature_ids]
+
+    def join(self, other, strandedness = 'any', min_overlap = 1):
+        """
+        Computes all the overlaps between the features of another FeatureTable (the queries) and those of this table.
+
+        Parameters:
+        ---------
+        - other: a FeatureTable (or anything that can be used to build a FeatureTable)
+        - strandedness (default: 'any'): 'any' to ignore the strands, 'same' to keep only the overlaps between features on the same strand, 'opposite' for features on opposite strands. The features with no strand ('.') overlap both strands.
+        - min_overlap (default: 1): the minimal number of positions shared by two features
+
+        Returns:
+        ------
+        a pandas DataFrame with a row per overlap. The columns are 'query' (index of the feature in the other table), 'feature' (index of the feature in this table) and 'overlap' (the number of positions shared).
+        """
+        import numpy as np
+        if not strandedness in ['any', 'same', 'opposite']:
+            raise Exception("Unknown strandedness %s"%strandedness)
+        if not isinstance(other, FeatureTable):
+            other = FeatureTable(other)
+        query_ids, feature_ids = [], []
+        for query_key, (strata, by_start, _, _, _) in other.index.iteritems():
+            query_starts, query_ends = other.starts[by_start], other.ends[by_start]
+            for key in self.__keys(query_key[0], query_key[1], strandedness):
+                _query_ids, _feature_ids = self.__overlaps(key, query_starts, query_ends)
+                query_ids.append(by_start[_query_ids])
+                feature_ids.append(_feature_ids)
+        query_ids = np.concatenate(query_ids) if query_ids else np.array([], dtype = np.int64)
+        feature_ids = np.concatenate(feature_ids) if feature_ids else np.array([], dtype = np.int64)
+        overlaps = np.minimum(other.ends[query_ids], self.ends[feature_ids]) - np.maximum(other.starts[query_ids], self.starts[feature_ids]) + 1
+        mask = overlaps >= min_overlap
+        query_ids, feature_ids, overlaps = query_ids[mask], feature_ids[mask], overlaps[mask]
+        order = np.lexsort((feature_ids, query_ids))
+        return DataFrame({
+            'query': other.features.index.values[query_ids[order]],
+            'feature': self.features.index.values[feature_ids[order]],
+            'overlap': overlaps[order]
+        }, columns = ['query', 'feature', 'overlap'])
+
+    def nearest(self, other, strandedness = 'any'):
+        """
+        Finds, for each feature of another FeatureTable (the queries), the closest feature in this table. An overlapping feature is at a distance of 0.
+
+        Parameters:
+        ---------
+        - other: a FeatureTable (or anything that can be used to build a FeatureTable)
+        - strandedness (default: 'any'): 'any', 'same' or 'opposite' (see join())
+
+        Returns:
+        ------
+        a pandas DataFrame indexed like the other table. The columns are 'feature' (the index of the closest feature in this table, None if no feature on the same genome) and 'distance'.
+        """
+        import numpy as np
+        if not strandedness in ['any', 'same', 'opposite']:
+            raise Exception("Unknown strandedness %s"%strandedness)
+        if not isinstance(other, FeatureTable):
+            other = FeatureTable(other)
+        best_ids = np.full(len(other), -1, dtype = np.int64)
+        best_distances = np.full(len(other), np.iinfo(np.int64).max, dtype = np.int64)
+
+        for query_key, (strata, query_ids, _, _, _) in other.index.iteritems():
+            query_starts, query_ends = other.starts[query_ids], other.ends[query_ids]
+            for key in self.__keys(query_key[0], query_key[1], strandedness):
+                _, by_start, sorted_starts, by_end, sorted_ends = self.index[key]
+                #the closest feature ending before each query
+                upstream = np.searchsorted(sorted_ends, query_starts, 'left')-1
+                has_upstream = upstream >= 0
+                distances = np.where(has_upstream, query_starts-sorted_ends[np.maximum(upstream, 0)], np.iinfo(np.int64).max)
+                candidates = by_end[np.maximum(upstream, 0)]
+                #the closest feature starting after each query
+                downstream = np.searchsorted(sorted_starts, query_ends, 'right')
+                has_downstream = downstream < len(sorted_starts)
+                downstream_distances = np.where(has_downstream, sorted_starts[np.minimum(downstream, len(sorted_starts)-1)]-query_ends, np.iinfo(np.int64).max)
+                closer = downstream_distances < distances
+                distances = np.where(closer, downstream_distances, distances)
+                candidates = np.where(closer, by_start[np.minimum(downstream, len(sorted_starts)-1)], candidates)
+                #the overlapping features
+                _query_ids, _feature_ids = self.__overlaps(key, query_starts, query_ends)
+                distances[_query_ids] = 0
+                candidates[_query_ids] = _feature_ids
+                better = distances < best_distances[query_ids]
+                best_ids[query_ids[better]] = candidates[better]
+                best_distances[query_ids[better]] = distances[better]
+
+        found = best_ids >= 0
+        return DataFrame({
+            'feature': np.where(found, self.features.index.values[np.maximum(best_ids, 0)] if len(self) else None, None),
+            'distance': np.where(found, best_distances, -1)
+        }, index = other.features.index, columns = ['feature', 'distance'])
+
+class BasePairProbabilities:
+    """
+    The base-pair probabilities of a molecule, like those computed by RNAfold -p (see Rnafold.fold() in pyrna.computations), stored in a sparse matrix.
+
+    Only the base-pairs above the probability cutoff of the parser are stored (see pyrna.parsers.parse_dot_plot()). The probabilities per position, the entropies and the centroid structure are computed with vectorized operations on the stored base-pairs, the L x L matrix is never densified.
+
+    Parameters:
+    -----------
+    - molecule: the Molecule object (RNA or DNA)
+    - matrix: a scipy sparse matrix of shape (L, L). The probability of the base-pair between the positions i and j (1-based, i < j) is stored at [i-1, j-1].
+    """
+
+    def __init__(self, molecule, matrix):
+        from scipy import sparse
+        self.molecule = molecule
+        self.matrix = sparse.triu(matrix, k = 1, format = 'csr')
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def to_frame(self):
+        """
+        Returns:
+        ------
+        the base-pairs stored in a pandas DataFrame with the columns 'pos1', 'pos2' (1-based) and 'probability', sorted by positions
+        """
+        import numpy as np
+        pairs = self.matrix.tocoo()
+        order = np.lexsort((pairs.col, pairs.row))
+        return DataFrame({
+            'pos1': pairs.row[order]+1,
+            'pos2': pairs.col[order]+1,
+            'probability': pairs.data[order]
+        }, columns = ['pos1', 'pos2', 'probability'])
+
+    def paired_probabilities(self):
+        """
+        Returns:
+        ------
+        a numpy array giving, for each position, its probability to be paired (the sum of the probabilities of its base-pairs)
+        """
+        import numpy as np
+        return np.asarray(self.matrix.sum(axis = 0)).ravel()+np.asarray(self.matrix.sum(axis = 1)).ravel()
+
+    def unpaired_probabilities(self):
+        """
+        Returns:
+        ------
+        a numpy array giving, for each position, its probability to be unpaired
+        """
+        import numpy as np
+        return np.clip(1.0-self.paired_probabilities(), 0.0, 1.0)
+
+    def positional_entropy(self):
+        """
+        The positional entropy of a position i is S(i) = -sum_j p(i,j)*ln(p(i,j)) - q(i)*ln(q(i)), with p(i,j) the probability of the base-pair (i,j) and q(i) the probability of i to be unpaired. A low entropy denotes a well-defined position.
+
+        Returns:
+        ------
+        a numpy array giving the positional entropy of each position
+        """
+        import numpy as np
+        pairs = self.matrix.tocoo()
+        plogp = pairs.data*np.log(pairs.data)
+        entropies = np.bincount(pairs.row, weights = plogp, minlength = len(self))+np.bincount(pairs.col, weights = plogp, minlength = len(self))
+        unpaired = self.unpaired_probabilities()
+        entropies += np.where(unpaired > 0, unpaired*np.log(np.where(unpaired > 0, unpaired, 1.0)), 0.0)
+        return 0.0-entropies
+
+    def centroid(self):
+        """
+        The centroid structure is made with all the base-pairs whose probability is above 0.5 (they are compatible by construction).
+
+        Returns:
+        ------
+        the secondary structure as a list of base-pairs in a pandas DataFrame (like pyrna.parsers.parse_bn())
+        """
+        pairs = self.matrix.tocoo()
+        mask = pairs.data > 0.5
+        return self.__to_base_pairs(pairs.row[mask]+1, pairs.col[mask]+1)
+
+    def mea(self, gamma = 1.0, max_span = None):
+        """
+        Compute the maximum expected accuracy (MEA) structure: the structure maximizing sum(2*gamma*p(i,j)) over its base-pairs plus sum(q(i)) over its unpaired positions.
+
+        The dynamic programming only considers the stored base-pairs whose weight is greater than the probability of their positions to be unpaired (the other ones can never improve a structure). The scores of the regions enclosed by a base-pair are stored in a band of the width of the longest base-pair (the span W), and the structure is assembled along the molecule with a single row of scores: the tables need (L+1)*(W+2) floats instead of (L+1)^2. Each column of the band is computed at once with numpy.
+
+        Parameters:
+        ---------
+        - gamma (default: 1.0): the weight of the base-pairs. A higher value gives more base-pairs.
+        - max_span (default: None): if not None, the base-pairs (i,j) with j-i > max_span are ignored, to bound the width of the band
+
+        Returns:
+        ------
+        the secondary structure as a list of base-pairs in a pandas DataFrame (like pyrna.parsers.parse_bn())
+        """
+        import numpy as np
+        from scipy import sparse
+        length = len(self)
+        unpaired = self.unpaired_probabilities()
+        pairs = self.matrix.tocoo()
+        weights = 2*gamma*pairs.data
+        mask = weights > unpaired[pairs.row]+unpaired[pairs.col]
+        if max_span is not None:
+            mask &= pairs.col-pairs.row <= max_span
+        candidates = sparse.csc_matrix((weights[mask], (pairs.row[mask], pairs.col[mask])), shape = (length, length))
+        band = int((pairs.col[mask]-pairs.row[mask]).max())+1 if mask.any() else 1
+
+        def column_pairs(j): #the candidate base-pairs (k, j) closed at the position j
+            return zip(candidates.indices[candidates.indptr[j]:candidates.indptr[j+1]], candidates.data[candidates.indptr[j]:candidates.indptr[j+1]])
+
+        #scores[j, l] is the best score for the l positions j-l to j-1 (0-based), for l <= band
+        scores = np.zeros((length+1, band+1))
+        #exterior[j] is the best score for the positions 0 to j-1
+        exterior = np.zeros(length+1)
+        for j in xrange(length):
+            width = min(band, j+1)
+            column = scores[j+1, :width+1]
+            column[1:] = scores[j, :width]+unpaired[j]
+            exterior[j+1] = exterior[j]+unpaired[j]
+            for k, weight in column_pairs(j):
+                span = j-k
+                enclosed = weight+scores[j, span-1]
+                np.maximum(column[span+1:], scores[k, :width-span]+enclosed, out = column[span+1:])
+                exterior[j+1] = max(exterior[j+1], exterior[k]+enclosed)
+
+        pos1, pos2 = [], []
+        intervals = []
+        j = length
+        while j > 0:
+            last = j-1
+            if exterior[j] == exterior[last]+unpaired[last]:
+                j = last
+                continue
+            for k, weight in column_pairs(last):
+                if exterior[j] == exterior[k]+(weight+scores[last, last-k-1]):
+                    pos1.append(k+1)
+                    pos2.append(last+1)
+                    intervals.append((k+1, last))
+                    j = k
+                    break
+        while intervals:
+            i, j = intervals.pop()
+            if j <= i:
+                continue
+            last = j-1
+            if scores[j, j-i] == scores[last, last-i]+unpaired[last]:
+                intervals.append((i, last))
+                continue
+            for k, weight in column_pairs(last):
+                if k >= i and scores[j, j-i] == scores[k, k-i]+(weight+scores[last, last-k-1]):
+                    pos1.append(k+1)
+                    pos2.append(last+1)
+                    intervals.append((i, k))
+                    intervals.append((k+1, last))
+                    break
+        return self.__to_base_pairs(np.array(pos1, dtype = np.int64), np.array(pos2, dtype = np.int64))
+
+    def __to_base_pairs(self, pos1, pos2):
+        import numpy as np
+        if not len(pos1):
+            return DataFrame()
+        order = np.argsort(pos2, kind = 'mergesort')
+        return DataFrame({
+            'orientation': 'c',
+            'edge1': '(',
+            'edge2': ')',
+            'pos1': pos1[order],
+            'pos2': pos2[order]
+        }, columns = ['orientation', 'edge1', 'edge2', 'pos1', 'pos2'])
+
 modified_aminoacids = {
     "ALA": "A",
     "ARG": "R",
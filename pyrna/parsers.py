@@ -1,8 +1,16 @@
-import re
+import re, os
 from pandas import DataFrame
 from pyrna.features import RNA, DNA, Protein, TertiaryStructure, SecondaryStructure
 from pyrna import utils
 
+def _lines(data, strip = False):
+    """
+    Returns the lines of data given as a String or as an open file (like the file-like objects returned by pyrna.utils.open_input()). An open file is read lazily.
+    """
+    if isinstance(data, basestring):
+        return (data.strip() if strip else data).split('\n')
+    return (line.rstrip('\r\n') for line in data)
+
 def consensus2d_to_base_pairs(aligned_rna, consensus_2d):
     """
     Parameters:
@@ -420,9 +428,84 @@ def to_ct(base_pairs, rna):
 
     return '\n'.join(lines)
 
+class _Output:
+    """
+    Buffered output to an open file or to a file path (see the write_* functions). The pieces of text are collected and written by blocks of buffer_size characters.
+    """
+
+    def __init__(self, output, buffer_size = 1024*1024):
+        if hasattr(output, 'write'):
+            self.handle = output
+            self.close_handle = False
+        else:
+            self.handle = open(output, 'w')
+            self.close_handle = True
+        self.buffer_size = buffer_size
+        self.pieces = []
+        self.size = 0
+        self.first_line = True
+
+    def write(self, text):
+        self.pieces.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def write_line(self, line):
+        """
+        Write a line. The lines are separated with '\\n' (no newline after the last one).
+        """
+        if self.first_line:
+            self.first_line = False
+        else:
+            self.write('\n')
+        self.write(line)
+
+    def flush(self):
+        if self.pieces:
+            self.handle.write(''.join(self.pieces))
+            self.pieces = []
+            self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.flush()
+        if self.close_handle:
+            self.handle.close()
+
+def _output_to_string(writer, *args, **kwargs):
+    from StringIO import StringIO
+    output = StringIO()
+    writer(*args+(output,), **kwargs)
+    return output.getvalue()
+
+def _sequence_chunks(sequence, length = 79):
+    return (sequence[c:c+length] for c in xrange(0, len(sequence), length))
+
+def write_fasta(molecules, output, single_line = False):
+    """
+    Write a list of Molecule objects as FASTA data. The records are written one after the other, with buffered writes.
+
+    Parameters:
+    ---------
+    - molecules: a list (or any iterable) of Molecule objects (see pyrna.features)
+    - output: an open file or the path of the file to write
+    - single_line (default: False): if True, each molecular sequence will we exported into a single line
+    """
+    with _Output(output) as output:
+        for molecule in molecules:
+            output.write_line(">"+molecule.name)
+            if single_line:
+                output.write_line(molecule.sequence)
+            else:
+                for chunk in _sequence_chunks(molecule.sequence):
+                    output.write_line(chunk)
+
 def to_fasta(molecules, single_line=False):
     """
-    Convert a list of Molecule objects into FASTA data
+    Convert a list of Molecule objects into FASTA data. To write large data, see write_fasta().
 
     Parameters:
     ---------
@@ -433,81 +516,97 @@ def to_fasta(molecules, single_line=False):
     ------
     the FASTA data as a String
     """
-    outputs = []
-    for molecule in molecules:
-        outputs.append(molecule.to_fasta(single_line))
-    return '\n'.join(outputs)
+    return _output_to_string(write_fasta, molecules, single_line = single_line)
 
-def to_vienna(base_pairs, molecules, single_line=False):
+def write_vienna(base_pairs, molecules, output, single_line = False):
     """
-    Convert lists of base pairs and Molecule objects into Vienna data.
+    Write lists of base pairs and Molecule objects as Vienna data, with buffered writes.
 
     Parameters:
     ---------
     - base_pairs: a list of pandas Dataframes, each one listing base pairs. This list should contain either a single Dataframe or as many Dataframes as Molecule objects provided in the second parameter.
     - molecules: a list of Molecule objects (gapped or ungapped) (see pyrna.features)
+    - output: an open file or the path of the file to write
     - single_line (default: False): if True, each molecular sequence will we exported into a single line
-
-    Returns:
-    ------
-    the Vienna data as a String
     """
     if len(base_pairs) != 1 and len(molecules) != len(base_pairs):
         raise Exception("You need to provide either a single Dataframe or as many Dataframes as Molecule objects")
 
-    if single_line:
-        lines =[]
+    with _Output(output) as output:
         if len(base_pairs) == 1:
-            for molecule in molecules:
-                lines.append(">"+molecule.name)
-                lines.append(molecule.sequence)
-            lines.append(to_bn(base_pairs[0], len(molecules[0])))
-        else:
-            for i in range(0, len(molecules)):
-                lines.append(">"+molecules[i].name)
-                lines.append(molecules[i].sequence)
-                lines.append(to_bn(base_pairs[i], len(molecules[i])))
-        return '\n'.join(lines)
-    else:
-        if len(base_pairs) == 1:
-            sequence_lines = []
-            bn_lines = []
             bn = to_bn(base_pairs[0], len(molecules[0]))
             for molecule in molecules:
-                c = 0
-                sequence_lines.append(">"+molecule.name)
-                while c < len(molecule):
-                    d = min(len(molecule), c + 79)
-                    sequence_lines.append(molecule[c:d])
-                    c += 79
-            c = 0
-            while c < len(molecules[0]):
-                d = min(len(molecules[0]), c + 79)
-                bn_lines.append(bn[c:d])
-                c += 79
-            return '\n'.join(sequence_lines)+'\n'+'\n'.join(bn_lines)
+                output.write_line(">"+molecule.name)
+                if single_line:
+                    output.write_line(molecule.sequence)
+                else:
+                    for chunk in _sequence_chunks(molecule.sequence):
+                        output.write_line(chunk)
+            if single_line:
+                output.write_line(bn)
+            elif len(molecules[0]):
+                for chunk in _sequence_chunks(bn):
+                    output.write_line(chunk)
+            else:
+                output.write('\n')
         else:
-            lines = []
-            for i in range(0, len(molecules)):
+            for i in xrange(0, len(molecules)):
                 bn = to_bn(base_pairs[i], len(molecules[i]))
+                output.write_line(">"+molecules[i].name)
+                if single_line:
+                    output.write_line(molecules[i].sequence)
+                    output.write_line(bn)
+                else:
+                    for chunk in _sequence_chunks(molecules[i].sequence):
+                        output.write_line(chunk)
+                    for chunk in _sequence_chunks(bn):
+                        output.write_line(chunk)
+
+def to_vienna(base_pairs, molecules, single_line=False):
+    """
+    Convert lists of base pairs and Molecule objects into Vienna data. To write large data, see write_vienna().
+
+    Parameters:
+    ---------
+    - base_pairs: a list of pandas Dataframes, each one listing base pairs. This list should contain either a single Dataframe or as many Dataframes as Molecule objects provided in the second parameter.
+    - molecules: a list of Molecule objects (gapped or ungapped) (see pyrna.features)
+    - single_line (default: False): if True, each molecular sequence will we exported into a single line
 
-                c = 0
-                lines.append(">"+molecules[i].name)
-                while c < len(molecules[i]):
-                    d = min(len(molecules[i]), c + 79)
-                    lines.append(molecules[i][c:d])
-                    c += 79
+    Returns:
+    ------
+    the Vienna data as a String
+    """
+    return _output_to_string(write_vienna, base_pairs, molecules, single_line = single_line)
 
-                c = 0
-                while c < len(bn):
-                    d = min(len(bn), c + 79)
-                    lines.append(bn[c:d])
-                    c += 79
-            return '\n'.join(lines)
+def write_stockholm(base_pairs, molecules, output, rfam_accession_number = None, family_id = None):
+    """
+    Write a list of base pairs and a list of Molecule objects as Stockholm data. The alignment is written block by block, with buffered writes.
+
+    Parameters:
+    ---------
+    - base_pairs: a pandas Dataframe listing the base pairs.
+    - molecules: a list of Molecule objects (gapped or ungapped) (see pyrna.features)
+    - output: an open file or the path of the file to write
+    - rfam_accession_number (default: None): the RFAM ID to export (corresponding to the line starting with #=GF AC)
+    - family_id (default: None): the family ID to export (corresponding to the line starting with #=GF ID)
+    """
+    bn = to_bn(base_pairs, len(molecules[0]))
+    with _Output(output) as output:
+        output.write_line("# STOCKHOLM 1.0")
+        if rfam_accession_number:
+            output.write_line("#=GF AC %s"%rfam_accession_number)
+        if family_id:
+            output.write_line("#=GF ID  %s"%family_id)
+        for c in xrange(0, len(bn), 80):
+            for molecule in molecules:
+                output.write_line("%s\t%s"%(molecule.name, molecule.sequence[c:c+80]))
+            output.write_line("#=GC SS_cons\t%s"%bn[c:c+80])
+            output.write_line("")
+        output.write_line("//")
 
 def to_stockholm(base_pairs, molecules, rfam_accession_number = None, family_id = None):
     """
-    Convert a list of base pairs and a list of Molecule objects into Stockholm data.
+    Convert a list of base pairs and a list of Molecule objects into Stockholm data. To write large alignments, see write_stockholm().
 
     Parameters:
     ---------
@@ -520,110 +619,75 @@ def to_stockholm(base_pairs, molecules, rfam_accession_number = None, family_id
     ------
     the Stockholm data as a String
     """
-    bn = to_bn(base_pairs, len(molecules[0]))
-    lines = []
-    lines.append("# STOCKHOLM 1.0")
-    if rfam_accession_number:
-        lines.append("#=GF AC %s"%rfam_accession_number)
-    if family_id:
-        lines.append("#=GF ID  %s"%family_id)
-    c = 0
-    alignment_length = len(bn)
-
-    while c < alignment_length:
-        d = min(alignment_length, c + 80)
-        for molecule in molecules:
-            lines.append("%s\t%s"%(molecule.name, molecule.sequence[c:d]))
-        lines.append("#=GC SS_cons\t%s"%bn[c:d])
-        lines.append("")
-        c += 80
+    return _output_to_string(write_stockholm, base_pairs, molecules, rfam_accession_number = rfam_accession_number, family_id = family_id)
 
-    lines.append("//")
-    return '\n'.join(lines)
-
-def to_clustalw(base_pairs, molecules, curate = False):
+def write_clustalw(base_pairs, molecules, output, curate = False):
     """
-    Convert a list of base pairs and a list of Molecule objects into Clustalw data.
+    Write a list of base pairs and a list of Molecule objects as Clustalw data. The alignment is written block by block, with buffered writes.
+
     Parameters:
     ---------
     - base_pairs: a pandas Dataframe listing the base-pairs. This can be a consensus 2D.
     - molecules: an list of Molecule objects (gapped or ungapped) (see pyrna.features)
+    - output: an open file or the path of the file to write
     - curate (default: False): remove the columns filled with gaps
 
-    Returns:
-    ------
-    the clustalw data as a String. The name of the molecules will be non-redundant and will not contain any spaces characters.
+    The name of the molecules will be non-redundant and will not contain any spaces characters.
     """
-
-    sequence_lines = []
     bn = to_bn(base_pairs, len(molecules[0]))
-    c = 0
-    gaps_positions = None
-    while c < len(molecules[0]):
-        names = []
-        for molecule in molecules:
-            if gaps_positions == None: #and not "if not gaps_positions:". The intersection of gap positions could lead to an empty set (no columns to remove in the alignment). And then, such condition would become true and we will restart with a list of positions corresponding to those of the next molecule processed!!
-                gaps_positions = set(molecule.get_gaps_positions())
-            else: #we search the same gap positions
-                gaps_positions = gaps_positions.intersection(molecule.get_gaps_positions())
-            d = min(len(molecule), c + 60)
-            name = molecule.name.replace(' ', '_') #molecule name without any space
-            if names.count(name): #and non-redundant
-                sequence_lines.append('%s.%i'%(name,names.count(name))+"\t"+molecule[c:d]+'\n')
-            else:
-                sequence_lines.append(name+"\t"+molecule[c:d]+'\n')#if already non-redundant, not .0 as suffix
-            names.append(name)
-        sequence_lines.append('\n')
-        c += 60
+    sequences = [molecule.sequence for molecule in molecules]
 
     if curate:
-        sequence_lines = []
-        chars = list(molecules[0].sequence)
-        for pos in gaps_positions:
-            chars[pos]=""
-        curated_sequence = ''.join(chars)
-
-        c = 0
-        while c < len(curated_sequence):
-            names = []
-            for molecule in molecules:
-                chars = list(molecule.sequence)
-                for pos in gaps_positions:
-                    chars[pos]=""
-                curated_sequence = ''.join(chars)
-                d = min(len(curated_sequence), c + 60)
-                name = molecule.name.replace(' ', '_') #molecule name without any space
-                if names.count(name): #and non-redundant
-                    sequence_lines.append('%s.%i'%(name,names.count(name))+"\t"+curated_sequence[c:d]+'\n')
-                else:
-                    sequence_lines.append(name+"\t"+curated_sequence[c:d]+'\n') #if already non-redundant, not .0 as suffix
-                names.append(name)
-            sequence_lines.append('\n')
-            c += 60
+        gaps_positions = None
+        for sequence in sequences:
+            if gaps_positions == None: #and not "if not gaps_positions:". The intersection of gap positions could lead to an empty set (no columns to remove in the alignment).
+                gaps_positions = set(i for i, c in enumerate(sequence) if c == '-')
+            else: #we search the same gap positions
+                gaps_positions.intersection_update(i for i, c in enumerate(sequence) if c == '-')
+        kept_positions = [i for i in xrange(0, len(sequences[0])) if not i in gaps_positions]
+        sequences = [''.join(sequence[i] for i in kept_positions if i < len(sequence)) for sequence in sequences]
 
         chars = list(bn)
-
-        i = 0
         left_positions = []
-        base_pairs = []
-        for char in chars:
+        for i, char in enumerate(chars):
             if char == '(':
                 left_positions.append(i)
             elif char == ')':
-                base_pairs.append([left_positions.pop(), i])
-            i+=1
-
-        for base_pair in base_pairs:
-            if base_pair[0] in gaps_positions or base_pair[1] in gaps_positions: #this means that one of the paired column will be removed, then the partner column becomes a single-strand (otherwise the curated bracket notation will be unbalanced)
-                chars[base_pair[0]] = '.'
-                chars[base_pair[1]] = '.'
-
-        for pos in gaps_positions:
-            chars[pos]=""
+                left_position = left_positions.pop()
+                if left_position in gaps_positions or i in gaps_positions: #this means that one of the paired column will be removed, then the partner column becomes a single-strand (otherwise the curated bracket notation will be unbalanced)
+                    chars[left_position] = '.'
+                    chars[i] = '.'
+        bn = ''.join(char for i, char in enumerate(chars) if not i in gaps_positions)
+
+    names = []
+    name_counts = {}
+    for molecule in molecules:
+        name = molecule.name.replace(' ', '_') #molecule name without any space
+        count = name_counts.get(name, 0)
+        names.append('%s.%i'%(name, count) if count else name) #if already non-redundant, not .0 as suffix
+        name_counts[name] = count+1
+
+    with _Output(output) as output:
+        for c in xrange(0, len(sequences[0]), 60):
+            for name, sequence in zip(names, sequences):
+                output.write(name+"\t"+sequence[c:c+60]+'\n')
+            output.write('\n')
+        output.write("2D\t"+bn)
 
-        bn = ''.join(chars)
+def to_clustalw(base_pairs, molecules, curate = False):
+    """
+    Convert a list of base pairs and a list of Molecule objects into Clustalw data. To write large alignments, see write_clustalw().
+    Parameters:
+    ---------
+    - base_pairs: a pandas Dataframe listing the base-pairs. This can be a consensus 2D.
+    - molecules: an list of Molecule objects (gapped or ungapped) (see pyrna.features)
+    - curate (default: False): remove the columns filled with gaps
 
-    return ''.join(sequence_lines)+"2D\t"+bn
+    Returns:
+    ------
+    the clustalw data as a String. The name of the molecules will be non-redundant and will not contain any spaces characters.
+    """
+    return _output_to_string(write_clustalw, base_pairs, molecules, curate = curate)
 
 def to_bn(base_pairs, length):
     """
@@ -653,23 +717,480 @@ def to_bn(base_pairs, length):
 
     return ''.join(bn)
 
+def parse_gff(gff_data):
+    """
+    Parse GFF data (GFF3 or GTF).
+
+    Parameters:
+    ---------
+    - gff_data: the GFF data as a String or an open file
+
+    Returns:
+    ------
+    a pandas DataFrame listing the features. The columns are genomeName, source, class, genomicPositions, score, genomicStrand, phase and attributes (a dict). This DataFrame can be given to count_reads().
+    """
+    features = []
+    for line in _lines(gff_data, strip = True):
+        if not line.strip() or line.startswith('#'):
+            if line.startswith('##FASTA'):
+                break
+            continue
+        tokens = line.rstrip('\r').split('\t')
+        if len(tokens) < 8:
+            continue
+        attributes = {}
+        if len(tokens) > 8:
+            for attribute in tokens[8].strip().split(';'):
+                attribute = attribute.strip()
+                if not attribute:
+                    continue
+                if '=' in attribute: #GFF3
+                    key, value = attribute.split('=', 1)
+                else: #GTF
+                    key, value = (attribute.split(None, 1)+[''])[:2]
+                attributes[key.strip()] = value.strip().strip('"')
+        features.append({
+            'genomeName': tokens[0],
+            'source': tokens[1],
+            'class': tokens[2],
+            'genomicPositions': [int(tokens[3]), int(tokens[4])],
+            'score': float(tokens[5]) if tokens[5] != '.' else None,
+            'genomicStrand': tokens[6],
+            'phase': tokens[7],
+            'attributes': attributes
+        })
+    return DataFrame(features, columns = ['genomeName', 'source', 'class', 'genomicPositions', 'score', 'genomicStrand', 'phase', 'attributes'])
+
 def read_counts_to_tsv(file_name, sam_file, chromosome_name, start, end, step = 1, restrict_to_plus_strand = False, restrict_to_minus_strand = False):
-    from pyrna.computations import Samtools
-    samtools = Samtools(sam_file = sam_file)
+    """
+    Write the number of reads aligned over consecutive bins of a chromosome into a TSV file. The reads are counted from the sorted BAM file produced with Samtools.sort_and_index() (see pyrna.computations).
+
+    Parameters:
+    ---------
+    - file_name: the full path of the TSV file
+    - sam_file: the full path of the SAM file. The sorted and indexed BAM file ${sam_file}.sorted.bam has to be available.
+    - chromosome_name: the name of the chromosome
+    - start: the first position of the first bin
+    - end: the last position to count
+    - step (default: 1): the size of each bin
+    - restrict_to_plus_strand (default: False): count only the reads aligned on the plus strand
+    - restrict_to_minus_strand (default: False): count only the reads aligned on the minus strand
+    """
+    sorted_bam_file = "%s.sorted.bam"%os.path.realpath(sam_file).split('.sam')[0]
+    strand = '.'
+    strandedness = 'both'
+    if restrict_to_plus_strand:
+        strand = '+'
+        strandedness = 'same'
+    if restrict_to_minus_strand:
+        strand = '-'
+        strandedness = 'same'
+    bins = range(start, end+1, step)
+    regions = DataFrame({
+        'genomeName': [chromosome_name]*len(bins),
+        'genomicPositions': [[i, i+step-1] for i in bins],
+        'genomicStrand': [strand]*len(bins)
+    })
+    counts = count_reads(regions, [sorted_bam_file], strandedness = strandedness, processes = 1).iloc[:,0].values
     with open(file_name, 'w') as tsv_file:
-        for i in range(start, end+1, step):
+        for i, count in zip(bins, counts):
             if step != 1:
-                tsv_file.write("%i-%i\t%i\n"%(i, i+step-1, samtools.count(chromosome_name, i, i+step-1, restrict_to_plus_strand, restrict_to_minus_strand)))
+                tsv_file.write("%i-%i\t%i\n"%(i, i+step-1, count))
             else:
-                tsv_file.write("%i\t%i\n"%(i, samtools.count(chromosome_name, i, i+step-1, restrict_to_plus_strand, restrict_to_minus_strand)))
+                tsv_file.write("%i\t%i\n"%(i, count))
+
+def count_reads(regions, bam_files, strandedness = 'both', overlap_mode = 'union', processes = None):
+    """
+    Count the reads aligned over a set of genomic regions for several BAM files. Each BAM file is read in a single sweep (one pass per chromosome carrying regions) and the counts are computed from the sorted read intervals. The BAM files are processed in parallel processes.
+
+    Parameters:
+    ---------
+    - regions: the genomic regions as a pandas DataFrame (or as a list of dicts, like the documents of a Mongo 'annotations' collection). The columns needed are genomeName, genomicPositions and genomicStrand (optional). The DataFrame produced by parse_gff() can be used directly.
+    - bam_files: a list of full paths of sorted and indexed BAM files
+    - strandedness (default: 'both'): 'both' counts the reads whatever their strand, 'same' counts only the reads on the strand of the region and 'opposite' only the reads on the opposite strand (like for dUTP libraries). A region without strand ('.') is always counted on both strands.
+    - overlap_mode (default: 'union'): 'union' counts each read overlapping the region, 'within' counts only the reads fully enclosed in the region and 'start' counts the reads whose 5' end is located in the region.
+    - processes (default: None): the number of BAM files processed at the same time. If None, one process per CPU.
+
+    Returns:
+    ------
+    a pandas DataFrame with one row per region (sharing the index of the regions) and one column per BAM file (named after the BAM file).
+    """
+    import numpy as np
+    from multiprocessing import Pool, cpu_count
+
+    if not strandedness in ['both', 'same', 'opposite']:
+        raise Exception("Unknown strandedness %s"%strandedness)
+    if not overlap_mode in ['union', 'within', 'start']:
+        raise Exception("Unknown overlap mode %s"%overlap_mode)
+
+    if not isinstance(regions, DataFrame):
+        regions = DataFrame(list(regions))
+
+    genome_names = regions['genomeName'].values
+    starts = np.array([positions[0] for positions in regions['genomicPositions']], dtype = np.int64)
+    ends = np.array([positions[-1] for positions in regions['genomicPositions']], dtype = np.int64)
+    if 'genomicStrand' in regions:
+        strands = regions['genomicStrand'].values
+    else:
+        strands = np.array(['.']*len(regions))
+
+    regions_per_genome = {}
+    for genome_name in set(genome_names):
+        ids = np.flatnonzero(genome_names == genome_name)
+        regions_per_genome[genome_name] = (ids, starts[ids], ends[ids], strands[ids])
+
+    jobs = [(bam_file, regions_per_genome, strandedness, overlap_mode, len(regions)) for bam_file in bam_files]
+
+    if len(jobs) == 1 or processes == 1:
+        results = map(_count_reads_in_bam, jobs)
+    else:
+        pool = Pool(processes = processes or min(len(jobs), cpu_count()))
+        try:
+            results = pool.map(_count_reads_in_bam, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    columns = [os.path.basename(bam_file) for bam_file in bam_files]
+    return DataFrame(dict(zip(columns, results)), index = regions.index, columns = columns)
+
+def _count_reads_in_bam(job):
+    """
+    Count the reads of a single BAM file for all the regions (see count_reads()). This function is executed in a child process.
+    """
+    import numpy as np
+    from array import array
+    from pysam import Samfile
+
+    bam_file, regions_per_genome, strandedness, overlap_mode, total_regions = job
+    counts = np.zeros(total_regions, dtype = np.int64)
+    bam = Samfile(bam_file, 'rb')
+    references = set(bam.references)
+
+    for genome_name, (ids, starts, ends, strands) in regions_per_genome.iteritems():
+        if not genome_name in references:
+            continue
+        read_starts = {'+': array('l'), '-': array('l')}
+        read_ends = {'+': array('l'), '-': array('l')}
+        for read in bam.fetch(genome_name):
+            if read.is_unmapped or read.aend is None:
+                continue
+            read_strand = '-' if read.is_reverse else '+'
+            read_starts[read_strand].append(read.pos+1)
+            read_ends[read_strand].append(read.aend)
+
+        sorted_reads = {}
+        for read_strand in ['+', '-']:
+            _starts = np.array(read_starts[read_strand], dtype = np.int64)
+            _ends = np.array(read_ends[read_strand], dtype = np.int64)
+            order = np.argsort(_starts, kind = 'mergesort')
+            sorted_reads[read_strand] = (_starts[order], _ends[order], np.sort(_ends), np.sort(_starts) if read_strand == '+' else np.sort(_ends))
+
+        for region_strand in set(strands):
+            mask = strands == region_strand
+            if region_strand not in ['+', '-'] or strandedness == 'both':
+                read_strands = ['+', '-']
+            elif strandedness == 'same':
+                read_strands = [region_strand]
+            else:
+                read_strands = ['-' if region_strand == '+' else '+']
+            for read_strand in read_strands:
+                counts[ids[mask]] += _count_overlaps(sorted_reads[read_strand], starts[mask], ends[mask], overlap_mode)
+
+    bam.close()
+    return counts
+
+def _count_overlaps(sorted_reads, starts, ends, overlap_mode):
+    """
+    Count the reads overlapping each region [starts[i], ends[i]] (1-based, inclusive).
+
+    Parameters:
+    ---------
+    - sorted_reads: a tuple (read starts sorted, read ends in the same order, read ends sorted, read 5' ends sorted)
+    - starts: the starts of the regions as a numpy array
+    - ends: the ends of the regions as a numpy array
+    - overlap_mode: 'union', 'within' or 'start' (see count_reads())
+    """
+    import numpy as np
+    read_starts, read_ends_by_start, sorted_read_ends, sorted_five_primes = sorted_reads
+    if overlap_mode == 'union':
+        #the reads ending before a region are a subset of those starting before its end
+        return np.searchsorted(read_starts, ends, 'right') - np.searchsorted(sorted_read_ends, starts, 'left')
+    elif overlap_mode == 'start':
+        return np.searchsorted(sorted_five_primes, ends, 'right') - np.searchsorted(sorted_five_primes, starts, 'left')
+    else:
+        lower_bounds = np.searchsorted(read_starts, starts, 'left')
+        upper_bounds = np.searchsorted(read_starts, ends, 'right')
+        counts = np.zeros(len(starts), dtype = np.int64)
+        for i in xrange(len(starts)):
+            if upper_bounds[i] > lower_bounds[i]:
+                counts[i] = np.count_nonzero(read_ends_by_start[lower_bounds[i]:upper_bounds[i]] <= ends[i])
+        return counts
+
+_LOCATION_TOKENS = re.compile(r'[A-Za-z_]+\(|\)|,|[A-Za-z][\w.]*:|[<>]?\d+(?:(?:\.\.|\^|\.)[<>]?\d+)?')
+_LOCATION_RANGE = re.compile(r'[<>]?(\d+)(?:(?:\.\.|\^|\.)[<>]?(\d+))?')
+
+def parse_location(location):
+    """
+    Parse a feature location from a Genbank or EMBL file (like "complement(join(3300..4037,4047..5222))").
+
+    Parameters:
+    ---------
+    - location: the location as a String
+
+    Returns:
+    ------
+    a list of blocks as tuples (start, end, strand), in the order of the location. The ranges located in other entries (like "J00194.1:100..202") are skipped.
+    """
+    tokens = _LOCATION_TOKENS.findall(location)
+    try:
+        blocks, i = _parse_location_tokens(tokens, 0)
+    except IndexError:
+        raise Exception("Unparsable location %s"%location)
+    return blocks
+
+def _parse_location_tokens(tokens, i):
+    token = tokens[i]
+    if token.endswith('('): #complement(, join(, order(,...
+        operator = token[:-1]
+        blocks = []
+        i += 1
+        while tokens[i] != ')':
+            _blocks, i = _parse_location_tokens(tokens, i)
+            blocks += _blocks
+            if tokens[i] == ',':
+                i += 1
+        if operator == 'complement':
+            blocks = [(start, end, '-' if strand == '+' else '+') for (start, end, strand) in reversed(blocks)]
+        return blocks, i+1
+    elif token.endswith(':'): #a range in another entry
+        blocks, i = _parse_location_tokens(tokens, i+1)
+        return [], i
+    else:
+        ends = _LOCATION_RANGE.match(token).groups()
+        start = int(ends[0])
+        end = int(ends[1]) if ends[1] else start
+        return [(min(start, end), max(start, end), '+')], i+1
+
+class FlatFileRecord:
+    """
+    The genomic sequence and the features of a single record from a Genbank or EMBL file, filled line by line (see iter_genbank() and iter_embl()). The features are stored as columns.
+    """
+
+    def __init__(self):
+        self.accession = None
+        self.organism = None
+        self.lineage = []
+        self.pieces_of_seq = []
+        self.columns = {'type': [], 'genomicPositions': [], 'genomicStrand': []}
+        self.rows = 0
+        self.feature_type = None
+        self.location = None
+        self.in_location = False
+        self.qualifiers = {}
+        self.qualifier_type = None
+        self.qualifier_content = None
+
+    def feature_line(self, key, content):
+        """
+        Add a line from the features table.
+
+        Parameters:
+        ---------
+        - key: the feature key (an empty String for a continuation line)
+        - content: the location, a qualifier or the continuation of one of them
+        """
+        if key:
+            self.store_feature()
+            self.feature_type = key
+            self.location = content
+            self.in_location = True
+        elif self.feature_type is None:
+            return
+        elif content.startswith('/'):
+            self.store_qualifier()
+            self.in_location = False
+            if '=' in content:
+                self.qualifier_type, self.qualifier_content = content[1:].split('=', 1)
+                self.qualifier_content = self.qualifier_content.strip().replace('"', '')
+        elif self.in_location:
+            self.location += content
+        elif self.qualifier_type:
+            self.qualifier_content += " "+content.replace('"', '')
+
+    def store_qualifier(self):
+        if self.qualifier_type and self.qualifier_content:
+            if self.qualifier_type == 'translation':
+                self.qualifier_content = self.qualifier_content.replace(" ", "")
+            self.qualifiers[self.qualifier_type] = self.qualifier_content
+        self.qualifier_type = None
+        self.qualifier_content = None
+
+    def store_feature(self):
+        self.store_qualifier()
+        if self.feature_type and not self.feature_type in ['source', 'intron']:
+            blocks = parse_location(self.location)
+            if blocks:
+                genomic_strand = '-' if all(block[2] == '-' for block in blocks) else '+'
+                if self.feature_type == 'CDS' and 'join(' in self.location:
+                    blocks = sorted(blocks)
+                    for i in xrange(1, len(blocks)):
+                        if blocks[i][0]-blocks[i-1][1] > 1:
+                            self.add_row({
+                                'type': 'intron',
+                                'genomicPositions': [blocks[i-1][1]+1, blocks[i][0]-1],
+                                'genomicStrand': genomic_strand
+                            })
+                feature = {
+                    'type': self.feature_type,
+                    'genomicPositions': [min(block[0] for block in blocks), max(block[1] for block in blocks)],
+                    'genomicStrand': genomic_strand
+                }
+                feature.update(self.qualifiers)
+                self.add_row(feature)
+        self.feature_type = None
+        self.location = None
+        self.in_location = False
+        self.qualifiers = {}
+
+    def add_row(self, feature):
+        for key in feature:
+            if not key in self.columns:
+                self.columns[key] = [None]*self.rows
+        for key, column in self.columns.iteritems():
+            column.append(feature.get(key))
+        self.rows += 1
+
+    def to_dna(self):
+        dna = DNA(name = self.accession, sequence = ''.join(self.pieces_of_seq).upper())
+        dna.lineage = ' '.join(self.lineage)
+        if self.organism:
+            dna.organism = self.organism
+        if 'ncRNA_class' in self.columns:
+            sequences = [None]*self.rows
+            for i, ncRNA_class in enumerate(self.columns['ncRNA_class']):
+                if ncRNA_class is not None:
+                    start, end = self.columns['genomicPositions'][i]
+                    if self.columns['genomicStrand'][i] == '+':
+                        sequences[i] = dna.sequence[start-1:end]
+                    else:
+                        sequences[i] = DNA(name = dna.name, sequence = dna.sequence[start-1:end]).get_complement()[::-1]
+            self.columns['sequence'] = sequences
+        return dna
+
+    def batches(self, batch_size = None):
+        """
+        Returns:
+        ------
+        a generator of tuples (DNA object, pandas DataFrame listing at most batch_size features). If batch_size is None, all the features are in a single DataFrame.
+        """
+        self.store_feature()
+        dna = self.to_dna()
+        if not batch_size or self.rows <= batch_size:
+            yield dna, DataFrame(self.columns)
+        else:
+            for start in xrange(0, self.rows, batch_size):
+                yield dna, DataFrame(dict((key, column[start:start+batch_size]) for key, column in self.columns.iteritems()))
+
+def iter_genbank(handle, batch_size = None):
+    """
+    Parse Genbank data one record at a time. The data are read line by line and only the current record is kept in memory.
+
+    Parameters:
+    ---------
+    - handle: an open file (or any iterable of lines) with Genbank data
+    - batch_size (default: None): the maximum number of features in each DataFrame generated. If None, all the features of a record are in a single DataFrame.
+
+    Returns:
+    ------
+    a generator of tuples (DNA object (see pyrna.features), pandas Dataframe listing the genomic features). If batch_size is set, a record can produce several tuples sharing the same DNA object. The columns of the DataFrame are described in parse_genbank().
+    """
+    record = None
+    in_organism = False
+    in_features = False
+    in_sequence = False
+    for line in handle:
+        line = line.rstrip('\r\n')
+        if record is None:
+            if not line.strip():
+                continue
+            record = FlatFileRecord()
+            in_organism = in_features = in_sequence = False
+        if line.startswith('//'):
+            for batch in record.batches(batch_size):
+                yield batch
+            record = None
+        elif in_sequence:
+            record.pieces_of_seq.append(''.join(line.split()[1:]))
+        elif line.startswith('ORIGIN'):
+            record.store_feature()
+            in_features = False
+            in_sequence = True
+        elif in_features and line.startswith(' '):
+            record.feature_line(line[5:21].strip(), line[21:].strip())
+        elif line.startswith('  ORGANISM'):
+            record.organism = line.split('ORGANISM')[1].strip()
+            in_organism = True
+        elif in_organism and line.startswith(' '):
+            record.lineage.append(line.strip())
+        elif not line.startswith(' '):
+            in_organism = False
+            in_features = line.startswith('FEATURES')
+            if line.startswith('ACCESSION') and len(line.split()) > 1:
+                record.accession = line.split()[1]
+    if record is not None:
+        raise Exception("Uncomplete file")
+
+def iter_embl(handle, batch_size = None):
+    """
+    Parse EMBL data one record at a time. The data are read line by line and only the current record is kept in memory.
+
+    Parameters:
+    ---------
+    - handle: an open file (or any iterable of lines) with EMBL data
+    - batch_size (default: None): the maximum number of features in each DataFrame generated. If None, all the features of a record are in a single DataFrame.
+
+    Returns:
+    ------
+    a generator of tuples (DNA object (see pyrna.features), pandas Dataframe listing the genomic features). If batch_size is set, a record can produce several tuples sharing the same DNA object. The columns of the DataFrame are described in parse_embl().
+    """
+    record = None
+    in_sequence = False
+    for line in handle:
+        line = line.rstrip('\r\n')
+        if record is None:
+            if not line.strip():
+                continue
+            record = FlatFileRecord()
+            in_sequence = False
+        code = line[:2]
+        if code == '//':
+            for batch in record.batches(batch_size):
+                yield batch
+            record = None
+        elif in_sequence:
+            record.pieces_of_seq.append(''.join(line.split()[:-1]))
+        elif code == 'FT':
+            record.feature_line(line[5:21].strip(), line[21:].strip())
+        elif code == 'SQ':
+            record.store_feature()
+            in_sequence = True
+        elif code == 'AC' and record.accession is None:
+            record.accession = line[5:].split(';')[0].strip()
+        elif code == 'OS' and record.organism is None:
+            record.organism = line[5:].strip()
+        elif code == 'OC':
+            record.lineage.append(line[5:].strip())
+    if record is not None:
+        raise Exception("Uncomplete file")
 
 def parse_genbank(genbank_data):
     """
-    Parse Genbank data.
+    Parse Genbank data. To parse large files without loading them in memory, see iter_genbank().
 
    Parameters:
    ---------
-    - genbank_data: the Genbank data as a String
+    - genbank_data: the Genbank data as a String or an open file
 
     Returns:
     ------
@@ -680,490 +1201,136 @@ def parse_genbank(genbank_data):
     - a sequence if it is a ncRNA
     - a column for each qualifier attached to the feature (/qualifier=)
     """
-
-    dnas = []
-    
-    pieces_of_seq=[]
-    start_of_sequence = False
-    accession = None
-    feature_type = None
-    qualifer_type = None
-    qualifier_content = None
-    qualifiers = []
-    genomic_strand = '+'
-    genomic_positions = None
-    features = []
-    organism = None
-    inOrganism = False
-    lineage = ""
-    location = None
-    lines = genbank_data.strip().split('\n')
-    if not lines[-1].strip() == '//':
-        raise Exception("Uncomplete file")
-    for line in lines:
-        tokens = re.split('\s+', line)
-        if line.startswith('//'):
-            dna = DNA( name = accession, sequence=''.join(pieces_of_seq))
-            dna.lineage = lineage.strip()
-            if organism:
-                dna.organism = organism
-            
-            for feature in features:
-                if feature.has_key('ncRNA_class'):
-                    if feature['genomicStrand'] == '+':
-                        feature['sequence'] = dna.sequence[feature['genomicPositions'][0]-1:feature['genomicPositions'][-1]]
-                    else:
-                        feature['sequence'] = DNA(name = dna.name, sequence = dna.sequence[feature['genomicPositions'][0]-1:feature['genomicPositions'][-1]]).get_complement()[::-1]
-            
-            dnas.append((dna,DataFrame(features)))
-            
-            #fresh restart if several sequences stored in the file
-            pieces_of_seq=[]
-            start_of_sequence = False
-            accession = None
-            feature_type = None
-            qualifer_type = None
-            qualifier_content = None
-            qualifiers = []
-            genomic_strand = '+'
-            genomic_positions = None
-            features = []
-            organism = None
-            inOrganism = False
-            lineage = ""
-            location = None
-        elif line.startswith('ACCESSION'):
-            accession = re.split('\s+', line)[1]
-        elif line.strip().startswith('ORGANISM'):
-            organism = line.strip().split('ORGANISM')[1].strip()
-            inOrganism = True
-        elif line.strip().startswith('REFERENCE'):
-            inOrganism = False
-        elif line.startswith('ORIGIN'): #the genomic sequence
-            start_of_sequence = True
-            #we store the last feature
-            #the last
-            if feature_type and not feature_type == "source" and not feature_type == "intron":
-                if location.startswith("complement(join("):#a joined location on the Crick strand
-                    genomic_strand = '-'
-                    ends = location.split('complement(join(')[1][:-2].replace("join(", "").replace(')','').replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                    if feature_type == 'CDS':
-                        for i in range(1, len(ends)-2, 2):
-                            intron = {
-                                'type': 'intron',
-                                'genomicPositions': [ends[i]+1, ends[i+1]-1],
-                                'genomicStrand': genomic_strand,
-                            }
-                            features.append(intron)
-                elif location.startswith("join(complement("):#a joined location on the Crick strand
-                    genomic_strand = '-'
-                    ends = location.split('join(complement(')[1][:-2].replace("complement(", "").replace(')', '').replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                    if feature_type == 'CDS':
-                        for i in range(1, len(ends)-2, 2):
-                            intron = {
-                                'type': 'intron',
-                                'genomicPositions': [ends[i]+1, ends[i+1]-1],
-                                'genomicStrand': genomic_strand,
-                            }
-                            features.append(intron)
-                elif location.startswith("complement(order("):
-                    genomic_strand = '-'
-                    ends = location.split('complement(order(')[1][:-2].replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                elif location.startswith("order("):
-                    ends = location.split('order(')[1][:-1].replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                elif location.startswith("complement("): #a location on the Crick strand
-                    genomic_strand = '-'
-                    ends = location.split('complement(')[1][:-1].split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                elif location.startswith("join("): #a joined location
-                    ends = location.split('join(')[1][:-1].replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                    if feature_type == 'CDS':
-                        for i in range(1, len(ends)-2, 2):
-                            intron = {
-                                'type': 'intron',
-                                'genomicPositions': [ends[i]+1, ends[i+1]-1],
-                                'genomicStrand': genomic_strand,
-                            }
-                            features.append(intron)
-                else: #a regular location
-                    ends = location.split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-
-                feature = {
-                    'type': feature_type,
-                    'genomicPositions': genomic_positions,
-                    'genomicStrand': genomic_strand,
-                }
-                if qualifer_type and qualifier_content:
-                    if qualifer_type == 'translation':
-                        qualifier_content = qualifier_content.replace(" ","")
-                    qualifiers.append({
-                        "type": qualifer_type,
-                        "content": qualifier_content
-                         })
-                for qualifier in qualifiers:
-                    feature[qualifier['type']] = qualifier['content']
-                features.append(feature)
-        elif len(tokens) == 3 and re.findall('\.\.>?[0-9]+', tokens[2]) and not tokens[1].startswith('/'): #Last condition is due to the fact that in NC_004354.4 i have found lines like /gene_synonym="BcDNA:GH10432; chrX:3706836..3706970;
-            #new feature
-            #we store the previous one (if any)
-            if feature_type and not feature_type == "source" and not feature_type == "intron":
-                if location.startswith("complement(join("):#a joined location on the Crick strand
-                    genomic_strand = '-'
-                    ends = location.split('complement(join(')[1][:-2].replace("join(", "").replace(')','').replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                    if feature_type == 'CDS':
-                        for i in range(1, len(ends)-2, 2):
-                            intron = {
-                                'type': 'intron',
-                                'genomicPositions': [ends[i]+1, ends[i+1]-1],
-                                'genomicStrand': genomic_strand,
-                            }
-                            features.append(intron)
-                elif location.startswith("join(complement("):#a joined location on the Crick strand
-                    genomic_strand = '-'
-                    ends = location.split('join(complement(')[1][:-2].replace("complement(", "").replace(')', '').replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                    if feature_type == 'CDS':
-                        for i in range(1, len(ends)-2, 2):
-                            intron = {
-                                'type': 'intron',
-                                'genomicPositions': [ends[i]+1, ends[i+1]-1],
-                                'genomicStrand': genomic_strand,
-                            }
-                            features.append(intron)
-                elif location.startswith("complement(order("):
-                    genomic_strand = '-'
-                    ends = location.split('complement(order(')[1][:-2].replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                elif location.startswith("order("):
-                    ends = location.split('order(')[1][:-1].replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                elif location.startswith("complement("): #a location on the Crick strand
-                    genomic_strand = '-'
-                    ends = location.split('complement(')[1][:-1].split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                elif location.startswith("join("): #a joined location
-                    ends = location.split('join(')[1][:-1].replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                    if feature_type == 'CDS':
-                        for i in range(1, len(ends)-2, 2):
-                            intron = {
-                                'type': 'intron',
-                                'genomicPositions': [ends[i]+1, ends[i+1]-1],
-                                'genomicStrand': genomic_strand,
-                            }
-                            features.append(intron)
-                else: #a regular location
-                    ends = location.split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-
-                feature = {
-                    'type': feature_type,
-                    'genomicPositions': genomic_positions,
-                    'genomicStrand': genomic_strand,
-                }
-
-                if qualifer_type and qualifier_content:
-                    if qualifer_type == 'translation':
-                        qualifier_content = qualifier_content.replace(" ","")
-                    qualifiers.append({
-                        "type": qualifer_type,
-                        "content": qualifier_content
-                         })
-                for qualifier in qualifiers:
-                    feature[qualifier['type']] = qualifier['content']
-                features.append(feature)
-            feature_type = None
-            genomic_strand = '+'
-            genomic_positions = None
-            qualifer_type = None
-            qualifier_content = None
-            qualifiers = []
-            feature_type = tokens[1].strip()
-            location = tokens[2].strip()
-        elif not qualifer_type and not qualifier_content and len(tokens) == 2 and re.findall('\.\.',tokens[1]) : #still the content of the current location.
-            location += tokens[1].strip()
-        elif re.findall('^\s+/.+=', line): # a new qualifier /bla_bla=
-            if qualifer_type and qualifier_content:
-                if qualifer_type == 'translation':
-                    qualifier_content = qualifier_content.replace(" ","")
-                qualifiers.append({
-                    "type": qualifer_type,
-                    "content": qualifier_content
-                     })
-            qualifer_type = line.strip()[1:].split('=')[0].strip()[0:]
-            qualifier_content = line.strip()[1:].split('=')[1].strip().replace('"','')
-        elif re.findall('^\s+/.+', line): # a qualifier like /manual => ignore
-            pass
-        elif not start_of_sequence and qualifer_type and qualifier_content : #still the content of the current qualifier
-            qualifier_content += " "+line.strip().replace('"','')
-        elif line.startswith('//'): #end of the genomic sequence
-            start_of_sequence = False
-        elif start_of_sequence:
-            pieces_of_seq.append(''.join(re.split('\s+',line.strip())[1:]).upper())
-        elif inOrganism:
-            lineage += " "+line.strip()
-
-    return dnas
+    if isinstance(genbank_data, basestring):
+        genbank_data = genbank_data.strip().split('\n')
+        if not genbank_data[-1].strip() == '//':
+            raise Exception("Uncomplete file")
+    return list(iter_genbank(genbank_data))
 
 def parse_embl(embl_data):
     """
-    Parse EMBL data.
+    Parse EMBL data. To parse large files or files with several records, see iter_embl().
 
     Parameters:
    ---------
-     - embl_data:  EMBL data as a String
+     - embl_data:  EMBL data as a String or an open file
 
     Returns:
     -------
-    a DNA object (see pyrna.features) and a pandas Dataframe listing the genomic features. The columns are:
+    a DNA object (see pyrna.features) and a pandas Dataframe listing the genomic features of the first record. The columns are:
     - feature type
     - genomicStrand ('+' or '-')
     - genomicPositions
     - a sequence if it is a ncRNA
     - a column for each qualifier attached to the feature (/qualifier=)
     """
+    if isinstance(embl_data, basestring):
+        embl_data = embl_data.strip().split('\n')
+        if not embl_data[-1].strip() == '//':
+            raise Exception("Uncomplete file")
+    return iter_embl(embl_data).next()
 
-    pieces_of_seq=[]
-    start_of_sequence = False
-    accession = None
-    feature_type = None
-    qualifer_type = None
-    qualifier_content = None
-    qualifiers = []
-    genomic_strand = '+'
-    genomic_positions = None
-    features = []
-    organism = None
-    location = None
-    lineage = ""
-    lines = embl_data.strip().split('\n')
-    if not lines[-1].strip() == '//':
-        raise Exception("Uncomplete file")
-    for line in lines:
-        tokens = re.split('\s+', line)
-        if line.startswith('AC'):
-            accession = re.split('\s+', line)[-1]
-        elif line.strip().startswith('OS'):
-            organism = line.strip().split('OS')[1].strip()
-        elif line.strip().startswith('OC'):
-            lineage += line.strip().split('OC')[1].strip().replace('.','; ')
-        elif line.startswith('SQ'): #the genomic sequence
-            start_of_sequence = True
-            #we store the last feature
-            if feature_type and not feature_type == "source" and not feature_type == "intron":
-                if location.startswith("complement(join("):#a joined location on the Crick strand
-                    genomic_strand = '-'
-                    ends = location.split('complement(join(')[1][:-2].replace("join(", "").replace(')','').replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                    if feature_type == 'CDS':
-                        for i in range(1, len(ends)-2, 2):
-                            intron = {
-                                'type': 'intron',
-                                'genomicPositions': [ends[i]+1, ends[i+1]-1],
-                                'genomicStrand': genomic_strand,
-                            }
-                            features.append(intron)
-                elif location.startswith("join(complement("):#a joined location on the Crick strand
-                    genomic_strand = '-'
-                    ends = location.split('join(complement(')[1][:-2].replace("complement(", "").replace(')', '').replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                    if feature_type == 'CDS':
-                        for i in range(1, len(ends)-2, 2):
-                            intron = {
-                                'type': 'intron',
-                                'genomicPositions': [ends[i]+1, ends[i+1]-1],
-                                'genomicStrand': genomic_strand,
-                            }
-                            features.append(intron)
-                elif location.startswith("complement(order("):
-                    genomic_strand = '-'
-                    ends = location.split('complement(order(')[1][:-2].replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                elif location.startswith("order("):
-                    ends = location.split('order(')[1][:-1].replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                elif location.startswith("complement("): #a location on the Crick strand
-                    genomic_strand = '-'
-                    ends = location.split('complement(')[1][:-1].split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                elif location.startswith("join("): #a joined location
-                    ends = location.split('join(')[1][:-1].replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                    if feature_type == 'CDS':
-                        for i in range(1, len(ends)-2, 2):
-                            intron = {
-                                'type': 'intron',
-                                'genomicPositions': [ends[i]+1, ends[i+1]-1],
-                                'genomicStrand': genomic_strand,
-                            }
-                            features.append(intron)
-                else: #a regular location
-                    ends = location.split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                feature = {
-                    'type': feature_type,
-                    'genomicPositions': genomic_positions,
-                    'genomicStrand': genomic_strand,
-                }
-                if qualifer_type and qualifier_content:
-                    if qualifer_type == 'translation':
-                        qualifier_content = qualifier_content.replace(" ","")
-                    qualifiers.append({
-                        "type": qualifer_type,
-                        "content": qualifier_content
-                         })
-                for qualifier in qualifiers:
-                    feature[qualifier['type']] = qualifier['content']
-                features.append(feature)
-        elif re.findall('^FT\s+/.+=', line): # a new qualifier /bla_bla=
-            if qualifer_type and qualifier_content:
-                if qualifer_type == 'translation':
-                    qualifier_content = qualifier_content.replace(" ","")
-                qualifiers.append({
-                    "type": qualifer_type,
-                    "content": qualifier_content
-                     })
-            qualifer_type = line.strip()[2:].split('=')[0].strip()[1:]
-            qualifier_content = line.strip()[2:].split('=')[1].strip().replace('"','')
-        elif re.findall('^FT\s+/.+', line): # a qualifier like /manual => ignore
-            pass
-        elif len(tokens) == 3 and re.findall('\.\.>?[0-9]+',tokens[2]):
-            #new feature
-            #we store the previous one (if any)
-            if feature_type and not feature_type == "source" and not feature_type == "intron" :
-                if location.startswith("complement(join("):#a joined location on the Crick strand
-                    genomic_strand = '-'
-                    ends = location.split('complement(join(')[1][:-2].replace("join(", "").replace(')','').replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                    if feature_type == 'CDS':
-                        for i in range(1, len(ends)-2, 2):
-                            intron = {
-                                'type': 'intron',
-                                'genomicPositions': [ends[i]+1, ends[i+1]-1],
-                                'genomicStrand': genomic_strand,
-                            }
-                            features.append(intron)
-                elif location.startswith("join(complement("):#a joined location on the Crick strand
-                    genomic_strand = '-'
-                    ends = location.split('join(complement(')[1][:-2].replace("complement(", "").replace(')', '').replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                    if feature_type == 'CDS':
-                        for i in range(1, len(ends)-2, 2):
-                            intron = {
-                                'type': 'intron',
-                                'genomicPositions': [ends[i]+1, ends[i+1]-1],
-                                'genomicStrand': genomic_strand,
-                            }
-                            features.append(intron)
-                elif location.startswith("complement(order("):
-                    genomic_strand = '-'
-                    ends = location.split('complement(order(')[1][:-2].replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                elif location.startswith("order("):
-                    ends = location.split('order(')[1][:-1].replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                elif location.startswith("complement("): #a location on the Crick strand
-                    genomic_strand = '-'
-                    ends = location.split('complement(')[1][:-1].split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                elif location.startswith("join("): #a joined location
-                    ends = location.split('join(')[1][:-1].replace(',','..').split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
-                    if feature_type == 'CDS':
-                        for i in range(1, len(ends)-2, 2):
-                            intron = {
-                                'type': 'intron',
-                                'genomicPositions': [ends[i]+1, ends[i+1]-1],
-                                'genomicStrand': genomic_strand,
-                            }
-                            features.append(intron)
-                else: #a regular location
-                    ends = location.split('..')
-                    ends = map(lambda end: int(end.replace('>','').replace('<','')), ends)
-                    genomic_positions = [min(ends), max(ends)]
+_RNAML_EDGES_5P = {'H': '[', 'S': '{', 's': '{', '!': '!'}
+_RNAML_EDGES_3P = {'H': ']', 'S': '}', 's': '}', '!': '!'}
+_RNAML_ORIENTATIONS = {'c': 'C', 'C': 'C', 't': 'T', 'T': 'T'}
 
-                feature = {
-                    'type': feature_type,
-                    'genomicPositions': genomic_positions,
-                    'genomicStrand': genomic_strand,
+def iter_rnaml(rnaml_input, lower_case_orientations = False):
+    """
+    Parse RNAML data molecule by molecule. The XML elements are discarded as soon as they have been read, which keeps the memory low for large RNAML files (like the RNAVIEW annotations of ribosomes).
+
+    Parameters:
+    ---------
+     - rnaml_input: the RNAML data as a String or an open file
+     - lower_case_orientations (default: False): if True, the orientations of the base-pairs are in lower case ('c' or 't'). Otherwise they are in upper case ('C' or 'T').
+
+    Returns:
+    ------
+    a generator of dicts, one for each molecule. The keys are:
+    - id: the id of the molecule
+    - sequence: the sequence of the molecule
+    - numbering_table: the labels of the residues as a list (None if no numbering table)
+    - helices: a pandas DataFrame with the columns name, pos1, pos2 and length
+    - base_pairs: a pandas DataFrame with the columns orientation, edge1, edge2, pos1 and pos2
+    """
+    import xml.etree.ElementTree as ET
+    if isinstance(rnaml_input, basestring):
+        from StringIO import StringIO
+        rnaml_input = StringIO(rnaml_input)
+
+    orientations = dict((key, value.lower() if lower_case_orientations else value) for key, value in _RNAML_ORIENTATIONS.iteritems())
+    molecule = None
+
+    for event, element in ET.iterparse(rnaml_input, events = ('start', 'end')):
+        tag = element.tag
+        if event == 'start':
+            if tag == 'molecule':
+                molecule = {
+                    'id': element.get('id'),
+                    'sequence': '',
+                    'numbering_table': None,
+                    'helices': {'name': [], 'pos1': [], 'pos2': [], 'length': []},
+                    'base_pairs': {'orientation': [], 'edge1': [], 'edge2': [], 'pos1': [], 'pos2': []}
                 }
-                if qualifer_type and qualifier_content:
-                    if qualifer_type == 'translation':
-                        qualifier_content = qualifier_content.replace(" ","")
-                    qualifiers.append({
-                        "type": qualifer_type,
-                        "content": qualifier_content
-                         })
-                for qualifier in qualifiers:
-                    feature[qualifier['type']] = qualifier['content']
-                features.append(feature)
-            feature_type = None
-            genomic_strand = '+'
-            genomic_positions = None
-            qualifer_type = None
-            qualifier_content = None
-            qualifiers = []
-            feature_type = tokens[1].strip()
-            location = tokens[2].strip()
-        elif not qualifer_type and not qualifier_content and len(tokens) == 2 and re.findall('\.\.',tokens[1]): #still the content of the current location
-            location += tokens[1].strip()
-        elif not start_of_sequence and qualifer_type and qualifier_content : # still the content of the current qualifier
-            qualifier_content += " "+line.strip().replace('"','')
-        elif line.startswith('//'): #end of the genomic sequence
-            start_of_sequence = False
-        elif start_of_sequence:
-            pieces_of_seq.append(''.join(re.split('\s+',line.strip())[:-1]).upper())
-
-    dna = DNA( name = accession, sequence=''.join(pieces_of_seq))
-
-    tokens = lineage.split('; ')
-    dna.lineage = '; '.join(tokens[:-2])+'.'
-
-    if organism:
-        dna.organism = organism
-
-    for feature in features:
-        if feature.has_key('ncRNA_class'):
-            if feature['genomicStrand'] == '+':
-                feature['sequence'] = dna.sequence[feature['genomicPositions'][0]-1:feature['genomicPositions'][-1]]
-            else:
-                feature['sequence'] = DNA(name = dna.name, sequence = dna.sequence[feature['genomicPositions'][0]-1:feature['genomicPositions'][-1]]).get_complement()[::-1]
+        elif molecule is None:
+            continue
+        elif tag == 'base-pair':
+            base_pairs = molecule['base_pairs']
+            orientation = element.findtext('bond-orientation')
+            base_pairs['orientation'].append(orientations.get(orientation) or (orientation.lower() if lower_case_orientations else orientation.upper()))
+            base_pairs['edge1'].append(_RNAML_EDGES_5P.get(element.findtext('edge-5p'), '('))
+            base_pairs['edge2'].append(_RNAML_EDGES_3P.get(element.findtext('edge-3p'), ')'))
+            base_pairs['pos1'].append(int(element.findtext('base-id-5p/base-id/position')))
+            base_pairs['pos2'].append(int(element.findtext('base-id-3p/base-id/position')))
+            element.clear()
+        elif tag == 'helix':
+            helices = molecule['helices']
+            helices['name'].append(element.get('id'))
+            helices['pos1'].append(int(element.findtext('base-id-5p/base-id/position')))
+            helices['pos2'].append(int(element.findtext('base-id-3p/base-id/position')))
+            helices['length'].append(int(element.findtext('length')))
+            element.clear()
+        elif tag == 'seq-data':
+            molecule['sequence'] = re.sub('\s+', '', element.text or '')
+        elif tag == 'numbering-table':
+            molecule['numbering_table'] = (element.text or '').split()
+        elif tag == 'molecule':
+            molecule['helices'] = DataFrame(molecule['helices'], columns = ['name', 'pos1', 'pos2', 'length'])
+            molecule['base_pairs'] = DataFrame(molecule['base_pairs'], columns = ['orientation', 'edge1', 'edge2', 'pos1', 'pos2'])
+            yield molecule
+            molecule = None
+            element.clear()
+
+def rnaml_to_secondary_structure(rna, molecule, canonical_only = False):
+    """
+    Build a secondary structure from a molecule produced by iter_rnaml().
+
+    Parameters:
+    ---------
+     - rna: the RNA object (see pyrna.features) for the secondary structure
+     - molecule: a molecule produced by iter_rnaml()
+     - canonical_only (default: False): if True, the helices will be made exclusively with canonical base-pairs: AU c( ), GC c( ) or GU c( ).
+
+    Returns:
+    ------
+    a SecondaryStructure object (see pyrna.features)
+    """
+    base_pairs = molecule['base_pairs']
+    if not canonical_only:
+        secondary_structure = SecondaryStructure(rna)
+        for name, pos1, pos2, length in zip(*[molecule['helices'][column].values for column in ['name', 'pos1', 'pos2', 'length']]):
+            secondary_structure.add_helix(name, int(pos1), int(pos2), int(length))
+        for orientation, edge1, edge2, pos1, pos2 in zip(*[base_pairs[column].values for column in ['orientation', 'edge1', 'edge2', 'pos1', 'pos2']]):
+            secondary_structure.add_base_pair(orientation, edge1, edge2, int(pos1), int(pos2))
+    else:
+        import numpy as np
+        sequence = rna.sequence
+        canonical = np.array([utils.is_canonical(sequence[pos1-1], sequence[pos2-1], orientation, edge1, edge2) for orientation, edge1, edge2, pos1, pos2 in zip(*[base_pairs[column].values for column in ['orientation', 'edge1', 'edge2', 'pos1', 'pos2']])], dtype = bool)
+        secondary_structure = base_pairs_to_secondary_structure(rna, base_pairs[canonical])
+        for orientation, edge1, edge2, pos1, pos2 in base_pairs[~canonical].values: #the non-canonical interactions are tertiary ones
+            secondary_structure.add_tertiary_interaction(orientation, edge1, edge2, int(pos1), int(pos2))
 
-    return dna, DataFrame(features)
+    secondary_structure.find_single_strands()
+    return secondary_structure
 
 def parse_rnaml(rnaml_data, canonical_only = False):
     """
@@ -1171,7 +1338,7 @@ def parse_rnaml(rnaml_data, canonical_only = False):
 
     Parameters:
     ---------
-     - rnaml_data: the RNAML data as a String
+     - rnaml_data: the RNAML data as a String or an open file
      - canonical_only (default: False): if True, the helices will be made exclusively with canonical base-pairs: AU c( ), GC c( ) or GU c( ).
 
     Returns:
@@ -1179,90 +1346,9 @@ def parse_rnaml(rnaml_data, canonical_only = False):
     a list of SecondaryStructure objects (see pyrna.features)
     """
     secondary_structures = []
-    import xml.etree.ElementTree as ET
-    rnaml_tree = ET.fromstring(rnaml_data)
-
-    for molecule in rnaml_tree.findall('molecule'):
-
-        rna = RNA(name = molecule.get('id'), sequence = re.sub('\s+','', molecule.find('sequence').find('seq-data').text))
-
-        secondary_structure = SecondaryStructure(rna)
-
-        if not canonical_only:
-
-            for helix in molecule.find('structure').find('model').find('str-annotation').findall('helix'):
-                secondary_structure.add_helix(helix.get('id'), int(helix.find('base-id-5p').find('base-id').find('position').text), int(helix.find('base-id-3p').find('base-id').find('position').text), int(helix.find('length').text));
-
-            #for single_strand in molecule.find('structure').find('model').find('str-annotation').findall('single-strand'):
-            #    end5 = int(single_strand.find('segment').find('base-id-5p').find('base-id').find('position').text)
-            #    end3 = int(single_strand.find('segment').find('base-id-3p').find('base-id').find('position').text)
-            #    secondary_structure.add_single_strand(single_strand.find('segment').find('seg-name').text, end5, end3-end5+1);
-
-            for base_pair in molecule.find('structure').find('model').find('str-annotation').findall('base-pair'):
-                edge1 = '('
-                edge2 = ')'
-                if base_pair.find('edge-5p').text == 'H':
-                    edge1 = '['
-                elif base_pair.find('edge-5p').text == 'S':
-                    edge1 = '{'
-                elif base_pair.find('edge-5p').text == 's':
-                    edge1 = '{'
-                elif base_pair.find('edge-5p').text == '!':
-                    edge1 = '!'
-
-                if base_pair.find('edge-3p').text == 'H':
-                    edge2 = ']'
-                elif base_pair.find('edge-3p').text == 'S':
-                    edge2 = '}'
-                elif base_pair.find('edge-3p').text == 's':
-                    edge2 = '}'
-                elif base_pair.find('edge-3p').text == '!':
-                    edge2 = '!'
-
-                secondary_structure.add_base_pair(base_pair.find('bond-orientation').text.upper(), edge1, edge2, int(base_pair.find('base-id-5p').find('base-id').find('position').text), int(base_pair.find('base-id-3p').find('base-id').find('position').text));
-
-        else:
-            canonical_bps = []
-            non_canonical_bps = []
-            for base_pair in molecule.find('structure').find('model').find('str-annotation').findall('base-pair'):
-                edge1 = '('
-                edge2 = ')'
-                if base_pair.find('edge-5p').text == 'H':
-                    edge1 = '['
-                elif base_pair.find('edge-5p').text == 'S':
-                    edge1 = '{'
-                elif base_pair.find('edge-5p').text == 's':
-                    edge1 = '{'
-                elif base_pair.find('edge-5p').text == '!':
-                    edge1 = '!'
-
-                if base_pair.find('edge-3p').text == 'H':
-                    edge2 = ']'
-                elif base_pair.find('edge-3p').text == 'S':
-                    edge2 = '}'
-                elif base_pair.find('edge-3p').text == 's':
-                    edge2 = '}'
-                elif base_pair.find('edge-3p').text == '!':
-                    edge2 = '!'
-
-                orientation = base_pair.find('bond-orientation').text.upper()
-
-                pos1 = int(base_pair.find('base-id-5p').find('base-id').find('position').text)
-                residue1 = secondary_structure.rna.sequence[pos1-1]
-                pos2 = int(base_pair.find('base-id-3p').find('base-id').find('position').text)
-                residue2 = secondary_structure.rna.sequence[pos2-1]
-
-                canonical_bps.append([orientation, edge1, edge2, pos1, pos2]) if utils.is_canonical(residue1, residue2, orientation, edge1, edge2) else non_canonical_bps.append([orientation, edge1, edge2, pos1, pos2])
-
-            secondary_structure = base_pairs_to_secondary_structure(secondary_structure.rna, DataFrame(canonical_bps, columns=['orientation', 'edge1', 'edge2', 'pos1', 'pos2']))
-
-            for bp in non_canonical_bps: #the non-canonical interactions are tertiary ones
-                secondary_structure.add_tertiary_interaction(bp[0], bp[1], bp[2], bp[3], bp[4])
-
-        secondary_structure.find_single_strands()
-
-        secondary_structures.append(secondary_structure)
-
+    for molecule in iter_rnaml(rnaml_data):
+        rna = RNA(name = molecule['id'], sequence = molecule['sequence'])
+        secondary_structures.append(rnaml_to_secondary_structure(rna, molecule, canonical_only))
     return secondary_structures
 
 
@@ -1272,7 +1358,7 @@ def parse_fasta(fasta_data, type='RNA'):
 
     Parameters:
     ---------
-    - fasta_data: the Fasta data as a String
+    - fasta_data: the Fasta data as a String or an open file
     - type (default: 'RNA'): can be equal to 'DNA' or 'RNA'
 
     Returns:
@@ -1282,7 +1368,7 @@ def parse_fasta(fasta_data, type='RNA'):
     molecules = []
     pieces = []
     molecule_name = None
-    for line in fasta_data.split('\n'):
+    for line in _lines(fasta_data):
         if re.match('>',line):
             if molecule_name and len(pieces) > 0:
                 if type == 'RNA':
@@ -1317,7 +1403,7 @@ def parse_vienna(vienna_data):
 
     Parameters:
     ---------
-     - vienna_data: the Vienna data as a String
+     - vienna_data: the Vienna data as a String or an open file
 
     Returns:
     ------
@@ -1328,7 +1414,7 @@ def parse_vienna(vienna_data):
     rnas = []
     current_bn = []
     current_sequence = []
-    for line in vienna_data.split('\n'):
+    for line in _lines(vienna_data):
         if re.match('^[\.()\{\}\[\]]+$', line):
             current_bn.append(line)
         elif re.match('^>', line):
@@ -1380,13 +1466,64 @@ def parse_bn(bn):
     else:
         return DataFrame()
 
+def bn_to_pair_table(bn):
+    """
+    Parse a bracket notation made with '(', ')' and '.' into a pair table, without building a DataFrame. The brackets are matched with vectorized operations: the n-th '(' at a given depth is paired with the n-th ')' closing this depth.
+
+    Parameters:
+    ---------
+     - bn: the bracket notation as a String
+
+    Returns:
+    ------
+    a numpy array (uint16, or uint32 for the molecules longer than 65535 nts) giving, for each position, the position (1-based) of its partner, or 0 if the position is unpaired
+    """
+    import numpy as np
+    characters = np.frombuffer(bn, dtype = np.uint8)
+    opening, closing = characters == ord('('), characters == ord(')')
+    depths = np.cumsum(opening.astype(np.int64)-closing)
+    if len(depths) and (depths[-1] != 0 or depths.min() < 0):
+        raise Exception("Unbalanced bracket notation: %s"%bn)
+    opening_positions, closing_positions = np.flatnonzero(opening), np.flatnonzero(closing)
+    opening_positions = opening_positions[np.lexsort((opening_positions, depths[opening_positions]))]
+    closing_positions = closing_positions[np.lexsort((closing_positions, depths[closing_positions]+1))]
+    pair_table = np.zeros(len(characters), dtype = np.uint16 if len(characters) < 65536 else np.uint32)
+    pair_table[opening_positions] = closing_positions+1
+    pair_table[closing_positions] = opening_positions+1
+    return pair_table
+
+def pair_table_to_base_pairs(pair_table):
+    """
+    Parameters:
+    ---------
+     - pair_table: a pair table (see bn_to_pair_table())
+
+    Returns:
+    ------
+    a pandas Dataframe listing the base pairs, like parse_bn(). Returns an empty Dataframe if no base-pairs are found.
+    """
+    import numpy as np
+    pair_table = np.asarray(pair_table, dtype = np.int64)
+    pos1 = np.flatnonzero(pair_table > np.arange(1, len(pair_table)+1))+1
+    if not len(pos1):
+        return DataFrame()
+    pos2 = pair_table[pos1-1]
+    order = np.argsort(pos2, kind = 'mergesort')
+    return DataFrame({
+        'orientation': 'c',
+        'edge1': '(',
+        'edge2': ')',
+        'pos1': pos1[order],
+        'pos2': pos2[order]
+    }, columns = ['orientation', 'edge1', 'edge2', 'pos1', 'pos2'])
+
 def parse_clustalw(clustalw_data):
     """
     Parse Clustalw data
 
     Parameters:
     ---------
-     - clustalw_data: the Clustalw data as a String
+     - clustalw_data: the Clustalw data as a String or an open file
 
     Returns:
     ------
@@ -1397,7 +1534,7 @@ def parse_clustalw(clustalw_data):
 
     bn = None
     alignedSequences = {}
-    lines = clustalw_data.strip().split('\n')
+    lines = _lines(clustalw_data, strip = True)
     for line in lines:
         line = line.strip()
         if line.startswith('2D'):
@@ -1420,7 +1557,7 @@ def parse_stockholm(stockholm_data):
 
     Parameters:
     ---------
-     - stockholm_data: the Stockholm data as a String
+     - stockholm_data: the Stockholm data as a String or an open file
 
     Returns:
     ------
@@ -1433,7 +1570,7 @@ def parse_stockholm(stockholm_data):
     organisms={}
     aligned2D = ""
     rfam_id = None
-    lines = stockholm_data.strip().split('\n')
+    lines = _lines(stockholm_data, strip = True)
     for line in lines:
         tokens = re.split('\s+', line)
         if len(line) != 0 and not re.match('^#', line) and len(tokens) == 2:
@@ -1465,7 +1602,7 @@ def parse_pdb(pdb_data):
 
     Parameters:
     ---------
-     - pdb_data: the PDB data as a String
+     - pdb_data: the PDB data as a String or an open file
 
     Returns:
     ------
@@ -1483,7 +1620,7 @@ def parse_pdb(pdb_data):
     current_3D = None
     title = "N.A."
 
-    for line in pdb_data.split('\n'):
+    for line in _lines(pdb_data):
         header = line[0:6].strip()
         atom_name = line[12:16].strip()
         residue_name = line[17:20].strip().upper()
@@ -1545,6 +1682,135 @@ def parse_pdb(pdb_data):
 
     return tertiary_structures
 
+def iter_records(data, format):
+    """
+    Split data into records without parsing them.
+
+    Parameters:
+    ---------
+     - data: the data as a String or an open file
+     - format: 'fasta' (a record starts with a '>' header), 'stockholm' (a record ends with '//') or 'pdb' (a record ends with END)
+
+    Returns:
+    ------
+    a generator of Strings, one per record
+    """
+    if not format in ['fasta', 'stockholm', 'pdb']:
+        raise Exception("Unknown format %s"%format)
+    record = []
+    in_record = False
+    for line in _lines(data):
+        if format == 'fasta':
+            if line.startswith('>'):
+                if in_record:
+                    yield '\n'.join(record)
+                    record = []
+                in_record = True #the lines before the first header are kept with the first record
+            record.append(line)
+        else:
+            record.append(line)
+            if format == 'stockholm' and line.strip() == '//' or format == 'pdb' and line[0:6].strip() == 'END':
+                yield '\n'.join(record)
+                record = []
+    if record and (format == 'fasta' or any(line.strip() for line in record)):
+        yield '\n'.join(record)
+
+def _parse_records_chunk(job):
+    """
+    Parse a chunk of records (see iter_parse()). This function is executed in a child process.
+    """
+    format, type, records = job
+    results = []
+    for record in records:
+        if format == 'fasta':
+            results += parse_fasta(record, type)
+        elif format == 'stockholm':
+            results.append(parse_stockholm(record))
+        else:
+            results += parse_pdb(record)
+    return results
+
+def iter_parse(data, format, processes = None, ordered = True, chunk_size = 100, type = 'RNA'):
+    """
+    Parse a large collection of records with a pool of processes. The data are split at the record boundaries (see iter_records()) and the records are parsed by chunks in child processes. Only a few chunks are in flight at the same time, so the data are read as the results are consumed.
+
+    Parameters:
+    ---------
+     - data: the data as a String or an open file (see pyrna.utils.open_input())
+     - format: 'fasta', 'stockholm' or 'pdb'
+     - processes (default: None): the number of processes. If None, one process per CPU. If 1, the records are parsed in the current process.
+     - ordered (default: True): if True, the results are generated in the order of the records. Otherwise, they are generated as soon as they are available.
+     - chunk_size (default: 100): the number of records sent to a process at once
+     - type (default: 'RNA'): the type of molecules for the FASTA format ('RNA', 'DNA' or 'Protein')
+
+    Returns:
+    ------
+    a generator of:
+    - RNA, DNA or Protein objects for the FASTA format (the same objects as parse_fasta())
+    - tuples (as returned by parse_stockholm()) for the Stockholm format, one per alignment
+    - TertiaryStructure objects for the PDB format (the same objects as parse_pdb(), entry after entry)
+    """
+    from multiprocessing import Pool, cpu_count
+    from collections import deque
+    from itertools import islice
+
+    records = iter_records(data, format)
+    chunks = iter(lambda: list(islice(records, chunk_size)), [])
+    processes = processes or cpu_count()
+
+    if processes == 1:
+        for chunk in chunks:
+            for result in _parse_records_chunk((format, type, chunk)):
+                yield result
+        return
+
+    def next_done(pending):
+        if ordered:
+            return pending.popleft()
+        while True:
+            for async_result in pending:
+                if async_result.ready():
+                    pending.remove(async_result)
+                    return async_result
+            pending[0].wait(0.01)
+
+    pool = Pool(processes = processes)
+    max_in_flight = 2*processes
+    pending = deque()
+    try:
+        for chunk in chunks:
+            pending.append(pool.apply_async(_parse_records_chunk, ((format, type, chunk),)))
+            if len(pending) >= max_in_flight:
+                for result in next_done(pending).get():
+                    yield result
+        while pending:
+            for result in next_done(pending).get():
+                yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def parse_records(data, format, processes = None, chunk_size = 100, type = 'RNA'):
+    """
+    Parse a large collection of FASTA, Stockholm or PDB records with a pool of processes (see iter_parse()). The result is the same as the serial parsers.
+
+    Parameters:
+    ---------
+     - data: the data as a String or an open file (see pyrna.utils.open_input())
+     - format: 'fasta', 'stockholm' or 'pdb'
+     - processes (default: None): the number of processes. If None, one process per CPU.
+     - chunk_size (default: 100): the number of records sent to a process at once
+     - type (default: 'RNA'): the type of molecules for the FASTA format ('RNA', 'DNA' or 'Protein')
+
+    Returns:
+    ------
+    a list of molecules (FASTA), of tuples (Stockholm, one per alignment) or of TertiaryStructure objects (PDB). See iter_parse().
+    """
+    return list(iter_parse(data, format, processes = processes, ordered = True, chunk_size = chunk_size, type = type))
+
 def parse_sam(sam_file):
     """
     This method parses a SAM file. It delegates the low-level parsing to the pysam library (https://code.google.com/p/pysam/). At now, this method is not able to handle oriented and paired-ends reads.
@@ -1619,3 +1885,343 @@ def parse_sam(sam_file):
             reads[alignedread.rname-1].append(read)
     sam_file_content.close()
     return reads, total_read_nb, tid_dic
+
+def parse_plfold(plfold_data):
+    """
+    Parse an output file of RNAplfold (the file _lunp of the probabilities to be unpaired or the file _openen of the opening energies). The values are read at once into float32 columns.
+
+    Parameters:
+    ---------
+     - plfold_data: the path of the file or an open file
+
+    Returns:
+    ------
+    a pandas DataFrame whose index lists the positions in the molecule and the columns the lengths of the regions (from 1 to the width given to RNAplfold). The values reported as NA by RNAplfold are NaN.
+    """
+    import numpy as np, pandas
+    handle = open(plfold_data) if isinstance(plfold_data, basestring) else plfold_data
+    try:
+        widths = None
+        position = handle.tell()
+        line = handle.readline()
+        while line.lstrip().startswith('#'): #RNAplfold writes its headers with a leading space
+            if line.lstrip().startswith('#i$'): #like ' #i$\tl=1\t2\t3'
+                widths = [int(width) for width in line.lstrip().split('l=')[1].split()]
+            position = handle.tell()
+            line = handle.readline()
+        handle.seek(position)
+        if widths is None:
+            raise Exception("No RNAplfold header found")
+        dtype = dict((width, np.float32) for width in widths)
+        dtype['position'] = np.int64
+        table = pandas.read_csv(handle, sep = '\t', header = None, names = ['position']+widths, usecols = range(len(widths)+1), index_col = 'position', na_values = ['NA'], dtype = dtype) #usecols ignores a trailing tab
+    finally:
+        if handle is not plfold_data:
+            handle.close()
+    table.index.name = None
+    return table
+
+_DOT_PLOT_SEQUENCE = re.compile(r'/sequence\s*\{\s*\((.*?)\)\s*\}\s*def', re.S)
+_DOT_PLOT_PAIR = re.compile(r'^\s*(\d+)\s+(\d+)\s+(\S+)\s+ubox\s*$', re.M)
+
+def parse_dot_plot(dot_plot_data, length = None, cutoff = 1e-5):
+    """
+    Parse a dot plot produced by RNAfold -p (the file _dp.ps) into a sparse matrix of base-pair probabilities. The dot plot stores the square roots of the probabilities in its "ubox" lines, the "lbox" lines (the MFE structure) are ignored.
+
+    Parameters:
+    ---------
+     - dot_plot_data: the content of the dot plot as a String or an open file
+     - length (default: None): the length of the molecule. If None, it is read from the sequence stored in the dot plot.
+     - cutoff (default: 1e-5): the base-pairs with a lower probability are dropped
+
+    Returns:
+    ------
+    a scipy.sparse.csr_matrix of shape (length, length). The probability of the base-pair between the positions i and j (1-based, i < j) is stored at [i-1, j-1], the lower triangle is empty.
+    """
+    import numpy as np
+    from scipy import sparse
+    content = dot_plot_data if isinstance(dot_plot_data, basestring) else dot_plot_data.read()
+    if length is None:
+        match = _DOT_PLOT_SEQUENCE.search(content)
+        if not match:
+            raise Exception("No sequence found in the dot plot")
+        length = len(re.sub(r'[\s\\]', '', match.group(1)))
+    pairs = np.array(_DOT_PLOT_PAIR.findall(content), dtype = np.float64).reshape(-1, 3)
+    probabilities = np.square(pairs[:, 2])
+    kept = probabilities >= cutoff
+    return sparse.coo_matrix((probabilities[kept], (pairs[kept, 0].astype(np.int64)-1, pairs[kept, 1].astype(np.int64)-1)), shape = (length, length)).tocsr()
+
+_CIGAR_OPERATION = re.compile(r'(\d+)([MIDNSHP=X])')
+
+def iter_sam(sam_data, mapped_only = True):
+    """
+    Parse SAM records one by one, as soon as they are read. Unlike parse_sam(), the SAM data are never loaded at once and don't need to be stored in a file: they can be read from the output of an aligner while it is running (see Bowtie2.align() in pyrna.computations). The lines that are not SAM records (headers, messages of the aligner) are skipped.
+
+    Parameters:
+    ---------
+     - sam_data: the SAM content as a String, an open file or an iterable of lines
+     - mapped_only (default: True): if True, the unmapped reads are skipped
+
+    Returns:
+    ------
+    a generator of dicts like: {'name': String, 'flag': int, 'genomeName': String, 'genomicStart': int, 'genomicEnd': int, 'genomicStrand': ['+', '-'], 'mapq': int, 'cigar': String}. The positions of an unmapped read are None.
+    """
+    for line in _lines(sam_data):
+        if not line or line[0] == '@':
+            continue
+        fields = line.split('\t', 11)
+        if len(fields) < 11:
+            continue
+        flag = int(fields[1])
+        if flag & 4:
+            if mapped_only:
+                continue
+            start, end = None, None
+        else:
+            start = int(fields[3])
+            end = start+sum(int(length) for length, operation in _CIGAR_OPERATION.findall(fields[5]) if operation in 'MDN=X')-1 #the operations consuming the reference
+        yield {
+            'name': fields[0],
+            'flag': flag,
+            'genomeName': fields[2],
+            'genomicStart': start,
+            'genomicEnd': end,
+            'genomicStrand': '-' if flag & 16 else '+',
+            'mapq': int(fields[4]),
+            'cigar': fields[5]
+        }
+
+_TBLOUT_COLUMNS = {
+    1: ['target_name', 'target_accession', 'query_name', 'query_accession', 'mdl', 'mdl_from', 'mdl_to', 'seq_from', 'seq_to', 'strand', 'trunc', 'pass', 'gc', 'bias', 'score', 'e_value', 'inc', 'description'],
+    2: ['idx', 'target_name', 'target_accession', 'query_name', 'query_accession', 'clan_name', 'mdl', 'mdl_from', 'mdl_to', 'seq_from', 'seq_to', 'strand', 'trunc', 'pass', 'gc', 'bias', 'score', 'e_value', 'inc', 'olp', 'anyidx', 'afrct1', 'afrct2', 'winidx', 'wfrct1', 'wfrct2', 'description']
+}
+_TBLOUT_INTEGERS = ['idx', 'mdl_from', 'mdl_to', 'seq_from', 'seq_to', 'pass']
+_TBLOUT_FLOATS = ['gc', 'bias', 'score', 'e_value']
+
+def parse_tblout(tblout_data, fmt = 1):
+    """
+    Parse the tabular output of the Infernal programs cmsearch and cmscan (option --tblout). The whole table is split and typed column by column.
+
+    Parameters:
+    ---------
+     - tblout_data: the content as a String or an open file
+     - fmt (default: 1): the format of the table (option --fmt of cmscan). 1 for 18 columns, 2 for 27 columns (with the clans and the overlaps).
+
+    Returns:
+    ------
+    a tuple containing:
+    - a pandas DataFrame with one row per hit. The columns are named after the Infernal documentation (target_name, query_name, seq_from, seq_to, strand, score, e_value,...). The positions are integers and the scores floats.
+    - a dict of the metadata listed at the end of the file (like 'Program' or 'Version')
+    """
+    from pandas import Series
+    columns = _TBLOUT_COLUMNS[fmt]
+    rows = []
+    metadata = {}
+    for line in _lines(tblout_data):
+        if line.startswith('#'):
+            if ':' in line: #the column headers have no ':'
+                key, value = line[1:].split(':', 1)
+                metadata[key.strip()] = value.strip()
+        elif line.strip():
+            rows.append(line)
+    if not rows:
+        return DataFrame(columns = columns), metadata
+    table = Series(rows).str.split(n = len(columns)-1, expand = True)
+    table = table.reindex(columns = range(len(columns))) #the description can be missing
+    table.columns = columns
+    for column in _TBLOUT_INTEGERS:
+        if column in table:
+            table[column] = table[column].astype(int)
+    for column in _TBLOUT_FLOATS:
+        table[column] = table[column].astype(float)
+    table['inc'] = table['inc'] == '!'
+    return table, metadata
+
+_HITS_CATEGORIES = ['target_name', 'target_strand', 'RFAM_family', 'organism', 'source', 'cm_file', 'genome', 'genomeName', 'genomicStrand', 'class', 'name']
+_HITS_FLOATS = ['score', 'e_value', 'p_value', 'evalue', 'bitscore', 'identity']
+_HITS_BLOCKS = ['target_positions', 'query_positions'] #lists of (start, end) tuples
+_HITS_RANGES = ['genomicPositions'] #[start, end] lists
+
+def normalize_hits(hits):
+    """
+    Convert hits or genomic annotations into a typed columnar table, ready to be stored with write_hits():
+    - the names (genomes, families, organisms, sources, strands, classes) become categorical columns
+    - the scores and e-values become float columns
+    - the columns target_start/target_end (from target_positions) and genomicStart/genomicEnd (from genomicPositions) are added as integer columns
+    - the genomic positions are stored as lists of integers
+    - the other structured values (dicts, lists) are serialized as JSON
+
+    Parameters:
+    ---------
+    - hits: a pandas DataFrame (like those produced by Cmsearch, Blast, Snoscan,... (see pyrna.computations)) or a list of dicts (like the documents of the 'ncRNAs' or 'annotations' MongoDB collections)
+
+    Returns:
+    ------
+    a new pandas DataFrame
+    """
+    import json, numpy as np
+    import pandas as pd
+    hits = DataFrame(list(hits)) if not isinstance(hits, DataFrame) else hits.copy()
+
+    for column in _HITS_BLOCKS:
+        if column in hits:
+            hits[column] = [[[int(end) for end in block] for block in blocks] if isinstance(blocks, (list, tuple)) else None for blocks in hits[column]]
+    for column in _HITS_RANGES:
+        if column in hits:
+            hits[column] = [[int(end) for end in positions] if isinstance(positions, (list, tuple)) else None for positions in hits[column]]
+
+    if 'target_positions' in hits and not 'target_start' in hits:
+        hits['target_start'] = np.array([min(block[0] for block in blocks) if blocks else -1 for blocks in hits['target_positions']], dtype = np.int64)
+        hits['target_end'] = np.array([max(block[-1] for block in blocks) if blocks else -1 for blocks in hits['target_positions']], dtype = np.int64)
+    if 'genomicPositions' in hits and not 'genomicStart' in hits:
+        hits['genomicStart'] = np.array([positions[0] if positions else -1 for positions in hits['genomicPositions']], dtype = np.int64)
+        hits['genomicEnd'] = np.array([positions[-1] if positions else -1 for positions in hits['genomicPositions']], dtype = np.int64)
+
+    for column in hits.columns:
+        if column in _HITS_CATEGORIES:
+            hits[column] = hits[column].astype('category')
+        elif column in _HITS_FLOATS:
+            hits[column] = pd.to_numeric(hits[column], errors = 'coerce').astype(np.float64)
+        elif not column in _HITS_BLOCKS+_HITS_RANGES and hits[column].dtype == object:
+            if any(isinstance(value, (dict, list, tuple)) for value in hits[column]):
+                hits[column] = [json.dumps(value) if value is not None else None for value in hits[column]]
+    return hits
+
+def write_hits(hits, path, format = 'parquet', row_group_size = 100000, compression = 'snappy'):
+    """
+    Store hits or genomic annotations in a Parquet or Feather file (this needs the library pyarrow). The hits are normalized (see normalize_hits()) and sorted by genome and position. With Parquet, the file is split into row groups whose statistics allow parse_hits() to skip the row groups not matching the filters.
+
+    Parameters:
+    ---------
+    - hits: a pandas DataFrame or a list of dicts (see normalize_hits())
+    - path: the path of the file to write
+    - format (default: 'parquet'): 'parquet' or 'feather'
+    - row_group_size (default: 100000): the number of hits per row group (Parquet only)
+    - compression (default: 'snappy'): the compression codec (Parquet only)
+    """
+    import pyarrow as pa
+    hits = normalize_hits(hits)
+    if not hits.index.name:
+        hits.index.name = 'hit_id'
+    hits = hits.reset_index()
+    sort_columns = [column for column in ['target_name', 'genomeName', 'target_start', 'genomicStart'] if column in hits]
+    if sort_columns:
+        hits = hits.sort_values(by = sort_columns, kind = 'mergesort').reset_index(drop = True)
+    if format == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(pa.Table.from_pandas(hits, preserve_index = False), path, row_group_size = row_group_size, compression = compression)
+    elif format == 'feather':
+        import pyarrow.feather as feather
+        feather.write_feather(hits, path)
+    else:
+        raise Exception("Unknown format %s"%format)
+
+def _row_group_may_match(statistics, operator, value):
+    """
+    Test if a row group may contain values matching a filter, from the min/max statistics of a column.
+    """
+    if statistics is None or not statistics.has_min_max:
+        return True
+    minimum, maximum = statistics.min, statistics.max
+    try:
+        if operator in ['=', '==']:
+            return minimum <= value <= maximum
+        elif operator == 'in':
+            return any(minimum <= _value <= maximum for _value in value)
+        elif operator == '<':
+            return minimum < value
+        elif operator == '<=':
+            return minimum <= value
+        elif operator == '>':
+            return maximum > value
+        elif operator == '>=':
+            return maximum >= value
+    except TypeError: #values not comparable with the statistics
+        pass
+    return True
+
+def parse_hits(path, columns = None, filters = None, format = None):
+    """
+    Load hits or genomic annotations stored with write_hits().
+
+    Parameters:
+    ---------
+    - path: the path of the Parquet or Feather file
+    - columns (default: None): the columns to load. If None, all the columns are loaded.
+    - filters (default: None): a list of tuples (column, operator, value) that the hits have to match (all of them). The operators are '=', '!=', '<', '<=', '>', '>=', 'in' and 'not in'. With Parquet, the row groups that cannot match are not read (predicate pushdown).
+    - format (default: None): 'parquet' or 'feather'. If None, the format is deduced from the file extension.
+
+    Returns:
+    ------
+    a pandas DataFrame indexed by hit id. The genomic positions are restored as lists ([start, end] for genomicPositions and lists of (start, end) tuples for target_positions and query_positions).
+    """
+    import numpy as np
+    filters = filters or []
+    if format is None:
+        format = 'feather' if path.endswith('.feather') else 'parquet'
+    columns_to_read = None
+    if columns is not None:
+        columns_to_read = list(columns)
+        for column in ['hit_id']+[_filter[0] for _filter in filters]:
+            if not column in columns_to_read:
+                columns_to_read.append(column)
+
+    if format == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        metadata = parquet_file.metadata
+        tables = []
+        for i in xrange(0, metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            statistics = {}
+            for j in xrange(0, row_group.num_columns):
+                statistics[row_group.column(j).path_in_schema] = row_group.column(j).statistics
+            if all(_row_group_may_match(statistics.get(column), operator, value) for column, operator, value in filters if column in statistics):
+                tables.append(parquet_file.read_row_group(i, columns = columns_to_read))
+        if tables:
+            hits = pa.concat_tables(tables).to_pandas()
+        else:
+            hits = parquet_file.schema.to_arrow_schema().empty_table().to_pandas()
+            if columns_to_read is not None:
+                hits = hits[[column for column in columns_to_read if column in hits]]
+    elif format == 'feather':
+        import pyarrow.feather as feather
+        hits = feather.read_feather(path, columns = columns_to_read)
+    else:
+        raise Exception("Unknown format %s"%format)
+
+    mask = np.ones(len(hits), dtype = bool)
+    for column, operator, value in filters:
+        values = hits[column]
+        if operator in ['=', '==']:
+            mask &= (values == value).values
+        elif operator == '!=':
+            mask &= (values != value).values
+        elif operator == '<':
+            mask &= (values < value).values
+        elif operator == '<=':
+            mask &= (values <= value).values
+        elif operator == '>':
+            mask &= (values > value).values
+        elif operator == '>=':
+            mask &= (values >= value).values
+        elif operator == 'in':
+            mask &= values.isin(value).values
+        elif operator == 'not in':
+            mask &= ~values.isin(value).values
+        else:
+            raise Exception("Unknown operator %s"%operator)
+    hits = hits[mask]
+
+    if 'hit_id' in hits:
+        hits = hits.set_index('hit_id')
+    if columns is not None:
+        hits = hits[[column for column in columns if column in hits and column != 'hit_id']]
+    for column in _HITS_BLOCKS:
+        if column in hits:
+            hits[column] = [[tuple(int(end) for end in block) for block in blocks] if blocks is not None else None for blocks in hits[column]]
+    for column in _HITS_RANGES:
+        if column in hits:
+            hits[column] = [[int(end) for end in positions] if positions is not None else None for positions in hits[column]]
+    return hits
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-import ujson, sys, datetime, os, random, string, json, commands
+import ujson, sys, datetime, os, random, string, json, commands, threading
 
 from pyrna.features import RNA
 from pyrna.db import Rfam
@@ -16,6 +16,7 @@ import tornado.ioloop
 import tornado.options
 import tornado.web
 import tornado.websocket
+from tornado import gen
 from tornado.escape import json_encode, native_str, xhtml_escape
 
 static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../website')
@@ -31,6 +32,7 @@ logs_db = None
 webserver_db = None
 enabled_algorithms = ['rnafold', 'rnaplot', 'contrafold', 'rnaview']
 enable_accounts = True
+tool_timeout = 300 #the maximal duration (in seconds) of a tool run by a webservice
 
 def is_registered_user(secret_key):
     return logs_db['user_keys'].find_one({'key': secret_key}) != None
@@ -206,8 +208,25 @@ class ServerLoad(tornado.web.RequestHandler):
                 }).count()
         self.write(str(usage))   
 
+class ToolHandler(tornado.web.RequestHandler):
+    """
+    A webservice running the tools without blocking the IOLoop (see Tool.call_async()). The tools still running when the client disconnects are killed.
+    """
+
+    def prepare(self):
+        self.cancel_event = threading.Event()
+
+    def on_connection_close(self):
+        self.cancel_event.set()
+
+    def call_tool(self, tool, method, *args, **kwargs):
+        kwargs['timeout'] = tool_timeout
+        kwargs['cancel_event'] = self.cancel_event
+        return tool.call_async(method, *args, **kwargs)
+
 #webservice to run RNAfold
-class RNAfoldTool(tornado.web.RequestHandler):
+class RNAfoldTool(ToolHandler):
+    @gen.coroutine
     def post(self):
         log = {
             '_id': str(ObjectId()),
@@ -234,13 +253,15 @@ class RNAfoldTool(tornado.web.RequestHandler):
                 constraints = self.get_argument('constraints', default = None)
                 bp_probabilities = self.get_argument('bp_probabilities', default = "False") == "True"
                 logs_db['webservices'].update({ '_id': log['_id'] }, {'$set': { 'status' : 'done', 'date':datetime.datetime.now()}})
-                self.write(rnafold.fold(RNA(name=name, sequence=sequence), bp_probabilities = bp_probabilities, constraints = constraints, raw_output = True))
+                output = yield self.call_tool(rnafold, 'fold', RNA(name=name, sequence=sequence), bp_probabilities = bp_probabilities, constraints = constraints, raw_output = True)
+                self.write(output)
             else:
                 logs_db['webservices'].update({ '_id': log['_id'] }, {'$set': { 'status' : 'error', 'date':datetime.datetime.now()}})
                 self.send_error(status_code=401)
 
 #webservice to run RNAplot
-class RNAplotTool(tornado.web.RequestHandler):
+class RNAplotTool(ToolHandler):
+    @gen.coroutine
     def post(self):
         log = {
             '_id': str(ObjectId()),
@@ -263,10 +284,12 @@ class RNAplotTool(tornado.web.RequestHandler):
         else:
             rnas, secondary_structures = parse_vienna(secondary_structure)
             logs_db['webservices'].update({ '_id': log['_id'] }, {'$set': { 'status' : 'done', 'date':datetime.datetime.now()}})
-            self.write(Rnaplot().plot(secondary_structures[0], rnas[0], raw_output = True))
+            output = yield self.call_tool(Rnaplot(), 'plot', secondary_structures[0], rnas[0], raw_output = True)
+            self.write(output)
 
 #webservice to run Contrafold
-class ContrafoldTool(tornado.web.RequestHandler):
+class ContrafoldTool(ToolHandler):
+    @gen.coroutine
     def post(self):
         log = {
             '_id': str(ObjectId()),
@@ -290,10 +313,12 @@ class ContrafoldTool(tornado.web.RequestHandler):
             self.send_error(status_code=401)
         else:
             logs_db['webservices'].update({ '_id': log['_id'] }, {'$set': { 'status' : 'done', 'date':datetime.datetime.now()}})
-            self.write(Contrafold().fold(RNA(name=name, sequence=sequence), raw_output = True))
+            output = yield self.call_tool(Contrafold(), 'fold', RNA(name=name, sequence=sequence), raw_output = True)
+            self.write(output)
 
 #webservice to run RNAVIEW
-class RnaviewTool(tornado.web.RequestHandler):
+class RnaviewTool(ToolHandler):
+    @gen.coroutine
     def post(self):
         log = {
             '_id': str(ObjectId()),
@@ -316,17 +341,19 @@ class RnaviewTool(tornado.web.RequestHandler):
             self.send_error(status_code=401)
         else:
             logs_db['webservices'].update({ '_id': log['_id'] }, {'$set': { 'status' : 'done', 'date':datetime.datetime.now()}})
-            self.write(Rnaview().annotate(pdb_content = tertiary_structure, canonical_only = canonical_only, raw_output = True))
+            output = yield self.call_tool(Rnaview(), 'annotate', pdb_content = tertiary_structure, canonical_only = canonical_only, raw_output = True)
+            self.write(output)
 
 ##########################################################
 # Here starts the high-level webservices...
 ##########################################################
 
-class Compute2d(tornado.web.RequestHandler):
+class Compute2d(ToolHandler):
 
     def get(self):
-        self.post(self)
+        return self.post()
 
+    @gen.coroutine
     def post(self):
         data = self.get_argument('data', default = None)
         tool = self.get_argument('tool', default = None)
@@ -353,12 +380,15 @@ class Compute2d(tornado.web.RequestHandler):
                 rna = rnas[0]
                 secondary_structures = []
                 if tool == 'rnafold':
-                    secondary_structures.append(base_pairs_to_secondary_structure(rna, Rnafold().fold(rna)))
+                    base_pairs = yield self.call_tool(Rnafold(), 'fold', rna)
+                    secondary_structures.append(base_pairs_to_secondary_structure(rna, base_pairs))
                 elif tool == 'contrafold':
-                    secondary_structures.append(base_pairs_to_secondary_structure(rna, Contrafold().fold(rna)))
+                    base_pairs = yield self.call_tool(Contrafold(), 'fold', rna)
+                    secondary_structures.append(base_pairs_to_secondary_structure(rna, base_pairs))
                 elif tool == 'rnasubopt':
                     random_sample = int(self.get_argument('random_sample', default = 20))
-                    for _result in Rnasubopt().fold(rna, random_sample = random_sample):
+                    results = yield self.call_tool(Rnasubopt(), 'fold', rna, random_sample = random_sample)
+                    for _result in results:
                         secondary_structures.append(base_pairs_to_secondary_structure(rna, _result))
                 for ss in secondary_structures:
                     _result = {
@@ -422,32 +452,32 @@ class Compute2d(tornado.web.RequestHandler):
                     self.write(json_encode(result))
             elif len(rnas) >= 2: #structural alignment
                 if tool == 'mlocarna':
-                    aligned_molecules, consensus2D = Mlocarna().align(rnas)
+                    aligned_molecules, consensus2D = yield self.call_tool(Mlocarna(), 'align', rnas)
                     logs_db['webservices'].update({ '_id': log['_id'] }, {'$set': { 'status' : 'done', 'date':datetime.datetime.now()}})
                     self.write(to_clustalw(consensus2D, aligned_molecules))
         elif tool == 'rnalifold' and data and data.startswith('CLUSTAL'): #computation of consensus structure from sequence alignment
             logs_db['webservices'].update({ '_id': log['_id'] }, {'$set': { 'status' : 'done', 'date':datetime.datetime.now()}})
-            self.write(RnaAlifold().align(data))
+            output = yield self.call_tool(RnaAlifold(), 'align', data)
+            self.write(output)
         elif tool == 'rnaview': #3D annotation
             from pyrna.db import PDB
             rnaview = Rnaview()
 
+            if pdbid:
+                data = yield PDB().get_entry_async(pdbid, timeout = tool_timeout)
+
             if output == 'rnaml':
-                if pdbid:
-                    self.write(rnaview.annotate(pdb_content = PDB().get_entry(pdbid), raw_output = True))
-                elif data:
-                    self.write(rnaview.annotate(pdb_content = data, raw_output = True))
+                if data:
+                    output = yield self.call_tool(rnaview, 'annotate', pdb_content = data, raw_output = True)
+                    self.write(output)
 
             else:
-                if pdbid:
-                    tertiary_structures = parse_pdb(PDB().get_entry(pdbid))
-                elif data:
-                    tertiary_structures = parse_pdb(data)
+                tertiary_structures = parse_pdb(data) if data else []
 
                 result = []
 
                 for ts in tertiary_structures:
-                    (ss, ts) = rnaview.annotate(ts, canonical_only = False)
+                    (ss, ts) = yield self.call_tool(rnaview, 'annotate', ts, canonical_only = False)
 
                     ss.find_junctions()
 
@@ -1,4 +1,4 @@
-import uuid, string, random, datetime, difflib,commands
+import uuid, string, random, datetime, difflib,commands, contextlib
 import math, re
 from features import RNA, DNA
 from bson.objectid import ObjectId
@@ -233,3 +233,466 @@ def renumber_pdb_atoms(pdb_file):
             else:
                 new_lines.append(line)
     return ''.join(new_lines)
+
+def open_input(path, buffer_size = 1024*1024):
+    """
+    Open a file for reading, whatever its compression. The compression is detected from the first bytes of the file:
+    - gzip
+    - BGZF (the blocked gzip produced by bgzip or samtools). The file is returned as a BgzfReader, allowing random access.
+    - bzip2
+
+    The data are decompressed on the fly and never written to disk. The parsers of pyrna.parsers accept the file-like object returned.
+
+    Parameters:
+    ---------
+    - path: the path of the file. If an open file is given, it is returned unchanged.
+    - buffer_size (default: 1Mb): the size of the read buffer
+
+    Returns:
+    ------
+    a file-like object returning the uncompressed data
+    """
+    if hasattr(path, 'read'):
+        return path
+    with open(path, 'rb') as h:
+        magic = h.read(18)
+    if magic[:2] == '\x1f\x8b':
+        if is_bgzf(magic):
+            return BgzfReader(path)
+        import gzip, io
+        return io.BufferedReader(gzip.open(path, 'rb'), buffer_size)
+    elif magic[:3] == 'BZh':
+        import bz2
+        return bz2.BZ2File(path, 'rb', buffer_size)
+    return open(path, 'rb', buffer_size)
+
+def is_bgzf(header):
+    """
+    Test if the first bytes of a gzip file describe a BGZF block (a gzip member with an extra subfield 'BC').
+    """
+    import struct
+    if len(header) < 18 or header[:2] != '\x1f\x8b' or not ord(header[3]) & 4:
+        return False
+    extra_length = struct.unpack('<H', header[10:12])[0]
+    return extra_length >= 6 and header[12:14] == 'BC'
+
+class BgzfReader:
+    """
+    A reader for BGZF files (like the files produced by bgzip or the BAM files). The file is decompressed block by block and supports random access with virtual offsets (as used by tabix and BAM indexes): the 48 high bits give the position of a block in the compressed file, the 16 low bits the position within the uncompressed block.
+    """
+
+    def __init__(self, path):
+        self.handle = open(path, 'rb')
+        self.closed = False
+        self.__load_block(0)
+
+    def __load_block(self, block_start):
+        import struct, zlib
+        self.handle.seek(block_start)
+        self.block_start = block_start
+        self.within_block = 0
+        header = self.handle.read(12)
+        if len(header) < 12: #end of file
+            self.buffer = ''
+            self.next_block_start = block_start
+            return
+        if header[:2] != '\x1f\x8b' or not ord(header[3]) & 4:
+            raise Exception("Not a BGZF block at offset %i"%block_start)
+        extra_length = struct.unpack('<H', header[10:12])[0]
+        extra = self.handle.read(extra_length)
+        block_size = None
+        i = 0
+        while i < len(extra):
+            subfield_length = struct.unpack('<H', extra[i+2:i+4])[0]
+            if extra[i:i+2] == 'BC':
+                block_size = struct.unpack('<H', extra[i+4:i+6])[0]+1
+            i += 4+subfield_length
+        if block_size is None:
+            raise Exception("Not a BGZF block at offset %i"%block_start)
+        data = self.handle.read(block_size-12-extra_length)
+        self.buffer = zlib.decompress(data[:-8], -15)
+        self.next_block_start = block_start+block_size
+
+    def __next_block(self):
+        """
+        Load the next non-empty block. Returns False at the end of the file.
+        """
+        while True:
+            if self.next_block_start == self.block_start:
+                return False
+            self.__load_block(self.next_block_start)
+            if self.buffer:
+                return True
+
+    def tell(self):
+        """
+        Returns the current virtual offset.
+        """
+        if self.within_block == len(self.buffer) and self.buffer: #at the end of a block, the next one starts
+            return self.next_block_start << 16
+        return (self.block_start << 16) | self.within_block
+
+    def seek(self, virtual_offset):
+        """
+        Move to a virtual offset (as returned by tell()).
+        """
+        block_start, within_block = virtual_offset >> 16, virtual_offset & 0xFFFF
+        if block_start != self.block_start:
+            self.__load_block(block_start)
+        if within_block > len(self.buffer):
+            raise Exception("Invalid virtual offset %i"%virtual_offset)
+        self.within_block = within_block
+
+    def read(self, size = -1):
+        pieces = []
+        while size != 0:
+            if self.within_block >= len(self.buffer) and not self.__next_block():
+                break
+            piece = self.buffer[self.within_block:] if size < 0 else self.buffer[self.within_block:self.within_block+size]
+            self.within_block += len(piece)
+            pieces.append(piece)
+            if size > 0:
+                size -= len(piece)
+        return ''.join(pieces)
+
+    def readline(self):
+        pieces = []
+        while True:
+            if self.within_block >= len(self.buffer) and not self.__next_block():
+                break
+            end = self.buffer.find('\n', self.within_block)
+            if end != -1:
+                pieces.append(self.buffer[self.within_block:end+1])
+                self.within_block = end+1
+                break
+            pieces.append(self.buffer[self.within_block:])
+            self.within_block = len(self.buffer)
+        return ''.join(pieces)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        self.handle.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+def hash_content(*values):
+    """
+    Compute a stable SHA1 digest for a set of values. The values can be strings, numbers, lists, tuples, dicts, pandas DataFrames or any object (Molecule, TertiaryStructure,...) whose public attributes can themselves be hashed. A string that is the path of an existing file is hashed with the content of this file.
+
+    Returns:
+    --------
+    the digest as an hexadecimal String
+    """
+    import hashlib
+    hasher = hashlib.sha1()
+    for value in values:
+        _feed_hash(hasher, value)
+    return hasher.hexdigest()
+
+def _feed_hash(hasher, value):
+    import os
+    from pandas import DataFrame, Series
+    if value is None or isinstance(value, (bool, int, long, float)):
+        hasher.update("%s:%r;"%(type(value).__name__, value))
+    elif isinstance(value, basestring):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        if value.startswith('file://'):
+            value = value[len('file://'):]
+        if value.startswith('/') and len(value) < 4096 and os.path.isfile(value):
+            hasher.update("file:")
+            with open(value, 'rb') as h:
+                for block in iter(lambda: h.read(1024*1024), ''):
+                    hasher.update(block)
+            hasher.update(";")
+        else:
+            hasher.update("str:%i:"%len(value))
+            hasher.update(value)
+    elif isinstance(value, (DataFrame, Series)):
+        hasher.update("frame:")
+        hasher.update(value.to_csv())
+    elif isinstance(value, (list, tuple)):
+        hasher.update("list:%i:"%len(value))
+        for item in value:
+            _feed_hash(hasher, item)
+    elif isinstance(value, dict):
+        hasher.update("dict:%i:"%len(value))
+        for key in sorted(value.keys()):
+            _feed_hash(hasher, key)
+            _feed_hash(hasher, value[key])
+    elif hasattr(value, '__dict__'):
+        hasher.update("object:%s:"%value.__class__.__name__)
+        _feed_hash(hasher, dict((name, attribute) for name, attribute in vars(value).iteritems() if not name.startswith('_'))) #the private attributes (like the _id of the Molecules) don't describe the content
+    else:
+        hasher.update("repr:%r;"%(value,))
+
+class ResultCache:
+    """
+    A two-tier cache for the results of computations: the most recent results are kept in memory (LRU) and all the results are stored on disk (in the directory cache_dir/results) up to a maximal size. The oldest files are evicted first.
+
+    The results are stored pickled. Each hit returns a new copy of the result.
+
+    Parameters:
+    -----------
+    - cache_dir: the directory where the directory 'results' will be created
+    - max_entries (default: 256): the number of results kept in memory
+    - max_disk_size (default: 1GB): the maximal size of the directory cache_dir/results (in bytes)
+    """
+
+    def __init__(self, cache_dir, max_entries = 256, max_disk_size = 1024*1024*1024):
+        import collections, os
+        self.results_dir = os.path.join(cache_dir, 'results')
+        if not os.path.exists(self.results_dir):
+            os.makedirs(self.results_dir)
+        self.max_entries = max_entries
+        self.max_disk_size = max_disk_size
+        self.memory = collections.OrderedDict()
+        self.disk_size = None
+
+    def __path(self, key):
+        import os
+        return os.path.join(self.results_dir, key[:2], key+'.pickle')
+
+    def get(self, key):
+        """
+        Returns:
+        --------
+        a tuple (found, result)
+        """
+        import cPickle, os
+        data = self.memory.pop(key, None)
+        if data is None:
+            path = self.__path(key)
+            try:
+                with open(path, 'rb') as h:
+                    data = h.read()
+                os.utime(path, None) #the eviction on disk is based on the modification times
+            except (IOError, OSError):
+                return False, None
+        self.__remember(key, data)
+        return True, cPickle.loads(data)
+
+    def set(self, key, result):
+        import cPickle, os
+        data = cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL)
+        self.__remember(key, data)
+        path = self.__path(key)
+        if not os.path.exists(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError: #created meanwhile by another process
+                pass
+        tmp_path = "%s.%s"%(path, generate_random_name(7))
+        with open(tmp_path, 'wb') as h:
+            h.write(data)
+        os.rename(tmp_path, path) #atomic, concurrent readers never see a partial file
+        if self.disk_size is not None:
+            self.disk_size += len(data)
+        self.evict()
+
+    def __remember(self, key, data):
+        self.memory[key] = data
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last = False)
+
+    def evict(self):
+        """
+        Remove the oldest files until the directory cache_dir/results fits within max_disk_size.
+        """
+        import os
+        if self.disk_size is not None and self.disk_size <= self.max_disk_size:
+            return
+        files = []
+        for dir_path, dir_names, file_names in os.walk(self.results_dir):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        self.disk_size = sum(size for mtime, size, path in files)
+        files.sort()
+        for mtime, size, path in files:
+            if self.disk_size <= self.max_disk_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.disk_size -= size
+
+    def clear(self):
+        import shutil, os
+        self.memory.clear()
+        shutil.rmtree(self.results_dir, ignore_errors = True)
+        os.makedirs(self.results_dir)
+        self.disk_size = 0
+
+class IndexStore:
+    """
+    A store for the indexes built by the external tools (Blast databases, Bowtie2 indexes,...). Each index is a directory cache_dir/name/key, where key describes the content indexed (like the hash of the sequences, see hash_content()). An index is built once and then shared by all the calls and all the processes using the same cache_dir.
+
+    An index is built in a temporary directory and published with a rename, so that an index is either complete or absent. The build is done under a file lock, so that concurrent calls for the same key wait for the first one instead of building the index again. The least recently used indexes are removed when the store holds too many indexes or uses too much disk space, except the indexes read within use(), protected by a shared lock.
+
+    Parameters:
+    -----------
+    - cache_dir: the directory where the directory of the store will be created
+    - name: the name of the directory of the store (like 'blast_dbs')
+    - max_entries (default: None): the maximal number of indexes. If None, no limit.
+    - max_disk_size (default: None): the maximal size of the store (in bytes). If None, no limit.
+    """
+
+    def __init__(self, cache_dir, name, max_entries = None, max_disk_size = None):
+        import os
+        self.store_dir = os.path.join(cache_dir, name)
+        if not os.path.exists(self.store_dir):
+            try:
+                os.makedirs(self.store_dir)
+            except OSError: #created meanwhile by another process
+                pass
+        self.max_entries = max_entries
+        self.max_disk_size = max_disk_size
+
+    def get(self, key, build):
+        """
+        Returns the directory of an index, built if needed. The index is not protected from the eviction once returned: use use() to read an index while other calls can evict it.
+
+        Parameters:
+        -----------
+        - key: the key of the index (a String usable as a file name)
+        - build: a function building the index in the (empty) directory given as argument
+
+        Returns:
+        --------
+        the full path of the directory of the index
+        """
+        import os
+        path = os.path.join(self.store_dir, key)
+        try:
+            os.utime(path, None) #the last use, for the eviction
+            return path
+        except OSError: #not built yet (or evicted)
+            pass
+        self.__build(key, build)
+        self.evict(keep = key)
+        return path
+
+    @contextlib.contextmanager
+    def use(self, key, build):
+        """
+        A context manager providing the directory of an index, built if needed (see get()). A shared lock is held on the index until the exit, so that no call or process can evict it while it is used.
+
+        Parameters:
+        -----------
+        - key: the key of the index (a String usable as a file name)
+        - build: a function building the index in the (empty) directory given as argument
+        """
+        import os, fcntl
+        path = os.path.join(self.store_dir, key)
+        built = False
+        with open(path+'.lock', 'a') as lock:
+            while True:
+                fcntl.flock(lock, fcntl.LOCK_SH)
+                if os.path.exists(path):
+                    break
+                fcntl.flock(lock, fcntl.LOCK_UN) #the build needs the exclusive lock
+                self.__build(key, build)
+                built = True
+            try:
+                os.utime(path, None) #the last use, for the eviction
+                if built:
+                    self.evict(keep = key)
+                yield path
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def __build(self, key, build):
+        """
+        Build an index under an exclusive lock, unless it has been built meanwhile.
+        """
+        import os, fcntl, shutil, tempfile
+        path = os.path.join(self.store_dir, key)
+        with open(path+'.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if not os.path.exists(path):
+                    tmp_path = tempfile.mkdtemp(prefix = key+'.', suffix = '.tmp', dir = self.store_dir)
+                    try:
+                        build(tmp_path)
+                        os.rename(tmp_path, path)
+                    except:
+                        shutil.rmtree(tmp_path, ignore_errors = True)
+                        raise
+                os.utime(path, None)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def evict(self, keep = None):
+        """
+        Remove the least recently used indexes until the store fits within max_entries and max_disk_size. An index is removed only if its lock can be taken at once: an index being built or used (see use()) is never removed.
+
+        Parameters:
+        -----------
+        - keep (default: None): the key of an index that cannot be removed
+        """
+        import os, fcntl, shutil
+        if self.max_entries is None and self.max_disk_size is None:
+            return
+        indexes = []
+        for key in os.listdir(self.store_dir):
+            path = os.path.join(self.store_dir, key)
+            if key.endswith('.lock') or key.endswith('.tmp') or key.endswith('.evicted') or not os.path.isdir(path):
+                continue
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError: #removed meanwhile
+                continue
+            size = sum(os.path.getsize(os.path.join(dir_path, file_name)) for dir_path, dir_names, file_names in os.walk(path) for file_name in file_names)
+            indexes.append((mtime, size, key))
+        indexes.sort()
+        disk_size = sum(size for mtime, size, key in indexes)
+        count = len(indexes)
+        for mtime, size, key in indexes:
+            if (self.max_entries is None or count <= self.max_entries) and (self.max_disk_size is None or disk_size <= self.max_disk_size):
+                break
+            if key == keep:
+                continue
+            path = os.path.join(self.store_dir, key)
+            with open(path+'.lock', 'a') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError: #built or used by another call
+                    continue
+                try:
+                    evicted_path = "%s.%s.evicted"%(path, generate_random_name(7))
+                    try:
+                        os.rename(path, evicted_path) #unpublished at once, then removed
+                    except OSError: #removed meanwhile
+                        continue
+                    shutil.rmtree(evicted_path, ignore_errors = True)
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+            count -= 1
+            disk_size -= size
+
+    def clear(self):
+        """
+        Remove all the indexes.
+        """
+        import shutil, os
+        shutil.rmtree(self.store_dir, ignore_errors = True)
+        os.makedirs(self.store_dir)
@@ -1,20 +1,20 @@
 #!/usr/bin/env python
 
 import os, sys
-from pyrna import parsers
+from pyrna import parsers, utils
 
 def convert(working_dir):
 
     genomic_sequences = []
 
     for f in os.listdir(working_dir):
-        if f.endswith('embl'):
-            with open(os.path.join(working_dir,f)) as h:
-                genomic_sequence, features =  parsers.parse_embl(h.read())
-                genomic_sequences.append(genomic_sequence)
+        if f.endswith('embl') or f.endswith('embl.gz') or f.endswith('embl.bz2'):
+            with utils.open_input(os.path.join(working_dir,f)) as h:
+                for genomic_sequence, features in parsers.iter_embl(h):
+                    genomic_sequences.append(genomic_sequence)
 
     with open(os.path.join(working_dir,'scaffolds.fasta'), 'w') as h:
-        h.write(parsers.to_fasta(genomic_sequences))
+        parsers.write_fasta(genomic_sequences, h)
 
 if __name__ == '__main__':
     
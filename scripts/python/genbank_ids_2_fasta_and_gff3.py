@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-from pyrna.parsers import parse_genbank, to_fasta
+from pyrna.parsers import parse_genbank, write_fasta
 from pyrna.db import NCBI
 from bson.objectid import ObjectId
 
@@ -16,21 +16,21 @@ ncbi = NCBI()
 for genome_id in genome_ids:
     print "Processing %s..."%genome_id
     gb_content = ncbi.efetch(ids = [genome_id], db='nucleotide', rettype='gbwithparts')
-    dna, features = parse_genbank(gb_content)
-    genomic_sequences.append(dna)
-    for (index, row) in features.iterrows():
-        annotation = {
-            '_id': str(ObjectId()),
-            'class': row['type'],
-            'genomeName': dna.name,
-            'genomicStrand': row['genomicStrand'],
-            'genomicPositions': row['genomicPositions'],
-            'product': row['product']
-        }
-        annotations.append(annotation)
+    for dna, features in parse_genbank(gb_content):
+        genomic_sequences.append(dna)
+        for (index, row) in features.iterrows():
+            annotation = {
+                '_id': str(ObjectId()),
+                'class': row['type'],
+                'genomeName': dna.name,
+                'genomicStrand': row['genomicStrand'],
+                'genomicPositions': row['genomicPositions'],
+                'product': row['product']
+            }
+            annotations.append(annotation)
 
 with open('sequences.fasta', 'w') as f:
-    f.write(to_fasta(genomic_sequences))
+    write_fasta(genomic_sequences, f)
 
 with open('annotations.gff3', 'w') as f:
     for annotation in annotations:
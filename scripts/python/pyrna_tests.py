@@ -5,7 +5,7 @@ A script to test the installation of PyRNA
 """
 
 from pyrna.db import PDB
-from pyrna.parsers import parse_pdb, secondary_structure_to_base_pairs
+from pyrna.parsers import parse_pdb, secondary_structure_to_base_pairs, parse_plfold
 from pyrna.computations import Rnafold, Rnaview
 
 def test():
@@ -29,5 +29,19 @@ def test():
         print "\nList of base-pairs computed with RNAfold (RNA Vienna Package):\n"
         print Rnafold().fold(molecule=ts.rna)
 
+def test_parse_plfold():
+    """
+    The headers of the _lunp and _openen files of RNAplfold start with a space and each line ends with a tab.
+    """
+    from StringIO import StringIO
+    lunp_data = " #unpaired probabilities\n #i$\tl=1\t2\t3\t\n1\t0.8960346\tNA\tNA\t\n2\t0.8886427\t0.8638745\tNA\t\n3\t0.5823434\t0.5631389\t0.5585064\t\n"
+    table = parse_plfold(StringIO(lunp_data))
+    assert list(table.columns) == [1, 2, 3]
+    assert list(table.index) == [1, 2, 3]
+    assert abs(table[2][3]-0.5631389) < 1e-6
+    assert table[3].isnull().sum() == 2
+    print "parse_plfold: OK"
+
 if __name__ == '__main__':
+    test_parse_plfold()
     test()
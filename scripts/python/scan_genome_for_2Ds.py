@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+from itertools import izip
 from pyrna.features import DNA
 from pymongo import MongoClient
 from pyrna.computations import Rnafold, Rnasubopt
@@ -20,16 +21,16 @@ for genome in db['genomes'].find():
     print "Processing %s"%molecule.name
     window_size = 300
     sliding_window = 150
-    i = 0
-    while i <= len(molecule)-sliding_window:
+    starts = range(0, len(molecule)-sliding_window+1, sliding_window)
+    windows = [DNA(name = molecule.name, sequence = molecule[i:i+window_size]) for i in starts]
+    #all the windows are folded with a single RNAfold and a single RNAsubopt process
+    for i, dna, ss, suboptimal_structures in izip(starts, windows, rnafold.fold_batch(windows), rnasubopt.fold_batch(windows, random_sample = 20)):
         all_secondary_structures = []
         print "%i %i"%(i,i+window_size)
-        dna = DNA(name = molecule.name, sequence = molecule[i:i+window_size])
-        ss = rnafold.fold(dna)
         ss = base_pairs_to_secondary_structure(dna, ss)
         ss.find_junctions()
         all_secondary_structures.append(ss)
-        for ss in rnasubopt.fold(dna, random_sample = 20):
+        for ss in suboptimal_structures:
             ss = base_pairs_to_secondary_structure(dna, ss)
             ss.find_junctions()
             all_secondary_structures.append(ss)
@@ -42,7 +43,7 @@ for genome in db['genomes'].find():
                         plus_apical_loops.append(positions)
                         print junction['description']    
         print len(plus_apical_loops) 
-        i += sliding_window
+    i = starts[-1]+sliding_window if starts else 0
     #last window
     if i < len(molecule):
         print "%i %i"%(i,len(molecule))
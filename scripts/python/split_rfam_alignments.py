@@ -1,14 +1,15 @@
 #!/usr/bin/env python
 """
-This script splits the file Rfam.full or Rfam.seed into one stockholm alignment per RFAM ID. 
+This script splits the file Rfam.full or Rfam.seed (compressed or not) into one stockholm alignment per RFAM ID. 
 The files are created in the same directory.
 """
 
 import sys, os
+from pyrna.utils import open_input
 
 def split(file):
     output_dir = os.path.dirname(os.path.abspath(file))
-    with open(file) as h:
+    with open_input(file) as h:
         output = None
         
         for line in h:
@@ -18,7 +19,7 @@ def split(file):
                     output = None
                 header = line
             elif line.startswith('#=GF AC   RF'):
-                output = open("%s/%s_%s.sto"%(output_dir, line.split("#=GF AC")[-1].strip(), 'seed' if file.endswith('seed') else 'full'), 'w')
+                output = open("%s/%s_%s.sto"%(output_dir, line.split("#=GF AC")[-1].strip(), 'seed' if 'seed' in os.path.basename(file) else 'full'), 'w')
                 output.write(header)
                 output.write(line)
                 header = ""